@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from agents.budget_optimizer import select_products_jointly
+from agents.catalog import get_catalog
+from agents.category_assigner import ainfer_categories
+from agents.category_index import normalize_item
+from agents.clients import get_llm, get_search
+from agents.config import BATCH_MAX_CARTS
+from agents.product_fetcher import afetch_products_batched
+from agents.products import ItemOptions, as_item_options
+from agents.ratelimit import BATCH, call_priority
+from agents.search_compaction import CompactionMeter, compaction_totals
+
+# Each cart is interpreted (and expanded) on its own, then paused at the first of these so
+# its items can be categorized and searched together with every other cart's.
+PLAN_STOPS = ["Human_review", "category_inference_agent", "product_search_agent"]
+
+
+def _item_key(item: str) -> str:
+    # "Tomatoes" and "tomato" are the same item to search for.
+    return normalize_item(item) or item
+
+
+def as_request(value: Any, index: int) -> Dict[str, Any]:
+    """
+    Validates one batch request: a request string, or an object with "user_input" and
+    optionally "id" and "budget" (which overrides the budget in the text).
+    """
+    request = {"user_input": value} if isinstance(value, str) else value
+    if not isinstance(request, dict):
+        raise ValueError(f"request {index + 1} must be a string or an object")
+    user_input = request.get("user_input")
+    if not isinstance(user_input, str) or not user_input.strip():
+        raise ValueError(f"request {index + 1}: user_input must be a non-empty string")
+    budget = request.get("budget")
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0):
+        raise ValueError(f"request {index + 1}: budget must be a positive number")
+    return {"id": str(request.get("id", index + 1)), "user_input": user_input.strip(), "budget": budget}
+
+
+def read_requests(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Reads batch requests, one per line: either the request text itself or a JSON object
+    (see `as_request`). Blank lines and lines starting with "#" are skipped.
+    """
+    requests = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        value: Any = line
+        if line.startswith("{"):
+            try:
+                value = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {number}: {e}") from None
+        requests.append(as_request(value, len(requests)))
+    return requests
+
+
+class _Cart:
+    """
+    One request's progress through a batch.
+    """
+
+    def __init__(self, request: Dict[str, Any], thread_id: str):
+        self.request = request
+        self.thread_id = thread_id
+        self.config = {"configurable": {"thread_id": thread_id}}
+        self.started = time.perf_counter()
+        self.values: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    @property
+    def review_key(self) -> str:
+        return "expanded_items" if self.values.get("expanded_items") else "item_list"
+
+    @property
+    def items(self) -> List[str]:
+        return list(dict.fromkeys(self.values.get(self.review_key) or []))
+
+    def fail(self, error: Exception) -> None:
+        print(f"Batch request {self.request['id']} failed: {error}")
+        self.error = f"{type(error).__name__}: {error}"
+
+    def result(self) -> Dict[str, Any]:
+        selected = self.values.get("optimized_products") or []
+        result = {
+            "id": self.request["id"],
+            "thread_id": self.thread_id,
+            "user_input": self.request["user_input"],
+            "status": "error" if self.error else "ok",
+        }
+        if self.error:
+            result["error"] = self.error
+        else:
+            result["items"] = self.items
+            result["budget"] = self.values.get("budget")
+            result["optimized_products"] = selected
+            result["total"] = round(sum(float(product.get("price") or 0) for product in selected), 2)
+        result["elapsed_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return result
+
+
+class BatchRun:
+    """
+    Plans many carts at once. Every cart is interpreted concurrently, then the items of
+    all carts are collapsed so each distinct item is categorized and searched only once,
+    and each cart finishes with the shared results as if its review had been accepted.
+    With a shared `budget` the carts are optimized jointly under it, each still kept
+    within its own budget if it has one. At most `max_carts` carts run graph steps at a time; model and
+    search calls are further held to the process-wide rate limits, at batch priority so
+    interactive sessions go first.
+    """
+
+    def __init__(self, graph, requests: List[Dict[str, Any]], budget: Optional[float] = None,
+                 max_carts: int = BATCH_MAX_CARTS):
+        self.graph = graph
+        self.budget = budget
+        batch_id = uuid.uuid4().hex[:8]
+        self.carts = [_Cart(request, f"batch-{batch_id}-{index}") for index, request in enumerate(requests)]
+        self._semaphore = asyncio.Semaphore(max(1, max_carts))
+        self.stats: Dict[str, Any] = {"requests": len(requests)}
+
+    async def _plan(self, cart: _Cart) -> None:
+        async with self._semaphore:
+            try:
+                with call_priority(BATCH):
+                    await self.graph.ainvoke({"user_input": cart.request["user_input"]}, cart.config,
+                                             interrupt_before=PLAN_STOPS)
+                cart.values = (await self.graph.aget_state(cart.config)).values
+            except Exception as e:
+                cart.fail(e)
+
+    async def _shared_products(self, carts: List[_Cart]) -> Tuple[Dict[str, str], Dict[str, List[Dict[str, Any]]]]:
+        """
+        Categorizes and searches every distinct item once.
+        Returns ({item key: category}, {item key: options}).
+        """
+        names: Dict[str, str] = {}
+        categories: Dict[str, str] = {}
+        requested = 0
+        for cart in carts:
+            known = cart.values.get("categories") or {}
+            for item in cart.items:
+                key = _item_key(item)
+                names.setdefault(key, item)
+                requested += 1
+                if item in known:
+                    categories.setdefault(key, known[item])
+
+        missing = [names[key] for key in names if key not in categories]
+        if missing:
+            with call_priority(BATCH):
+                inferred = await ainfer_categories(missing)
+            for item in missing:
+                if item in inferred:
+                    categories[_item_key(item)] = inferred[item]
+
+        keys = [key for key in names if key in categories]
+        pairs = [(names[key], categories[key]) for key in keys]
+        catalog = get_catalog()
+        if catalog is not None:
+            catalog.record_requests([
+                (item, categories[_item_key(item)])
+                for cart in carts for item in cart.items if _item_key(item) in categories
+            ])
+        with call_priority(BATCH):
+            fetched = await afetch_products_batched(get_llm(), get_search(), pairs,
+                                                    CompactionMeter(parent=compaction_totals))
+        self.stats.update({"items": requested, "distinct_items": len(names)})
+        return categories, dict(zip(keys, fetched))
+
+    async def _finish(self, cart: _Cart, categories: Dict[str, str],
+                      options: Dict[str, List[Dict[str, Any]]]) -> _Cart:
+        items = cart.items
+        keys = {item: _item_key(item) for item in items}
+        cart_categories = {item: categories[keys[item]] for item in items if keys[item] in categories}
+        update: Dict[str, Any] = {
+            cart.review_key: items,
+            "categories": cart_categories,
+            "products": [
+                ItemOptions.from_options(item, category, options.get(keys[item]) or [])
+                for item, category in cart_categories.items()
+            ],
+        }
+        if cart.request.get("budget") is not None:
+            update["budget"] = float(cart.request["budget"])
+
+        async with self._semaphore:
+            try:
+                await self.graph.aupdate_state(cart.config, update, as_node="Human_review")
+                stops = ["budget_optimizer_agent"] if self.budget is not None else None
+                with call_priority(BATCH):
+                    await self.graph.ainvoke(None, cart.config, interrupt_before=stops)
+                cart.values = (await self.graph.aget_state(cart.config)).values
+            except Exception as e:
+                cart.fail(e)
+        return cart
+
+    async def _optimize_jointly(self, carts: List[_Cart]) -> None:
+        """
+        Writes each cart's share of the joint selection as the budget optimizer's output,
+        then resumes the cart so the rest of the graph runs as after a normal optimization.
+        """
+        selections = select_products_jointly([as_item_options(cart.values.get("products")) for cart in carts],
+                                             self.budget, [cart.values.get("budget") for cart in carts])
+
+        async def apply(cart: _Cart, selected: List[Dict[str, Any]]) -> None:
+            async with self._semaphore:
+                try:
+                    await self.graph.aupdate_state(cart.config, {"optimized_products": selected},
+                                                   as_node="budget_optimizer_agent")
+                    with call_priority(BATCH):
+                        await self.graph.ainvoke(None, cart.config)
+                    cart.values = (await self.graph.aget_state(cart.config)).values
+                except Exception as e:
+                    cart.fail(e)
+
+        await asyncio.gather(*(apply(cart, selected) for cart, selected in zip(carts, selections)))
+
+    async def results(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Runs the batch, yielding one result per request as its cart is done: failed
+        requests first, then the rest in completion order (all at once when the budget
+        is shared, since the joint optimization needs every cart).
+        """
+        started = time.perf_counter()
+        await asyncio.gather(*(self._plan(cart) for cart in self.carts))
+        for cart in self.carts:
+            if cart.error:
+                yield cart.result()
+        planned = [cart for cart in self.carts if not cart.error]
+
+        if planned:
+            try:
+                categories, options = await self._shared_products(planned)
+            except Exception as e:
+                for cart in planned:
+                    cart.fail(e)
+                    yield cart.result()
+                planned = []
+
+        if planned and self.budget is None:
+            for finished in asyncio.as_completed([self._finish(cart, categories, options) for cart in planned]):
+                yield (await finished).result()
+        elif planned:
+            await asyncio.gather(*(self._finish(cart, categories, options) for cart in planned))
+            await self._optimize_jointly([cart for cart in planned if not cart.error])
+            for cart in planned:
+                yield cart.result()
+        self.stats["elapsed_s"] = round(time.perf_counter() - started, 3)
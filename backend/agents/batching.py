@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agents.config import BATCH_WINDOW_MS, BATCH_MAX_SIZE
+from agents.ratelimit import current_priority
+
+
+class MicroBatcher:
+    """
+    Collects requests that arrive within `window` seconds of each other (up to `max_batch`)
+    and hands them to `dispatch` together. Identical requests in flight at the same time
+    share a single call and result. A batch runs in the context of its most urgent
+    caller, so it goes out at that caller's rate-limit priority.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, name: str, dispatch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 window: float = BATCH_WINDOW_MS / 1000, max_batch: int = BATCH_MAX_SIZE):
+        self.name = name
+        self.dispatch = dispatch
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self._pending: Dict[str, Tuple[Any, asyncio.Future, contextvars.Context]] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, key: str, request: Any) -> Any:
+        self.requests += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._in_flight[key] = future
+        self._pending[key] = (request, future, contextvars.copy_context())
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self.batches += 1
+        context = min((entry[2] for entry in batch.values()), key=lambda context: context.run(current_priority))
+        asyncio.get_running_loop().create_task(self._run(batch), context=context.copy())
+
+    async def _run(self, batch: Dict[str, Tuple[Any, asyncio.Future, contextvars.Context]]) -> None:
+        keys = list(batch)
+        try:
+            results = await self.dispatch([batch[key][0] for key in keys])
+        except Exception as e:
+            results = [e] * len(keys)
+        for key, result in zip(keys, results):
+            future = batch[key][1]
+            self._in_flight.pop(key, None)
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch_size": round((self.requests - self.coalesced) / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class BatchedChatModel:
+    """
+    Wraps a chat model so concurrent `ainvoke` calls from different sessions go out
+    through one `abatch` call. Sync calls and other attributes pass straight through.
+    """
+
+    def __init__(self, llm: Any, **batcher_options):
+        self.llm = llm
+        self.batcher = MicroBatcher("llm", self._dispatch, **batcher_options)
+
+    async def _dispatch(self, inputs: List[Any]) -> List[Any]:
+        abatch = getattr(self.llm, "abatch", None)
+        if abatch is not None:
+            return await abatch(inputs, return_exceptions=True)
+        return await asyncio.gather(*(self.llm.ainvoke(messages) for messages in inputs), return_exceptions=True)
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        if args or kwargs:
+            return await self.llm.ainvoke(messages, *args, **kwargs)
+        return await self.batcher.submit(json.dumps(messages, sort_keys=True, default=str), messages)
+
+    def invoke(self, messages, *args, **kwargs):
+        return self.llm.invoke(messages, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.llm, name)
+
+
+class BatchedSearch:
+    """
+    Wraps the search client so identical queries in flight across sessions run once and
+    queries arriving together are dispatched as one group. Tavily has no multi-query
+    endpoint, so a group is sent as concurrent requests over the shared connection pool.
+    """
+
+    def __init__(self, search: Any, **batcher_options):
+        self.search = search
+        self.batcher = MicroBatcher("search", self._dispatch, **batcher_options)
+
+    async def _dispatch(self, queries: List[Any]) -> List[Any]:
+        return await asyncio.gather(*(self.search.ainvoke(query) for query in queries), return_exceptions=True)
+
+    async def ainvoke(self, query, *args, **kwargs):
+        if args or kwargs:
+            return await self.search.ainvoke(query, *args, **kwargs)
+        return await self.batcher.submit(json.dumps(query, sort_keys=True, default=str), query)
+
+    def invoke(self, query, *args, **kwargs):
+        return self.search.invoke(query, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.search, name)
@@ -1,43 +1,235 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.clients import get_llm
 from agents.states import OverallState
-from typing import Dict, Any, List, Optional
-import json
-from dotenv import load_dotenv
+from agents.config import (
+    BUDGET_OPTIMIZER_MODE,
+    BUDGET_OPTIMIZER_PRICE_WEIGHT,
+    BUDGET_OPTIMIZER_RATING_WEIGHT,
+    BUDGET_OPTIMIZER_MAX_DP_CELLS,
+    BUDGET_OPTIMIZER_MAX_DP_ITEMS,
+)
+from agents.tracing import record_event
+from agents.incremental import input_hash, unchanged
+from agents.products import ItemOptions, ProductOption, as_item_options
+from agents.structured import Selection, StructuredOutputError, ainvoke_structured, invoke_structured
+from typing import Dict, Any, List, Optional, Tuple
+from array import array
+import math
 
-load_dotenv()
+# Rating assumed for options that come back without one.
+DEFAULT_RATING = 3.0
 
-def budget_optimizer_agent(state: OverallState) -> Dict[str, Any]:
+
+def _to_cents(price: Any) -> Optional[int]:
+    try:
+        cents = int(math.ceil(round(float(price) * 100, 6)))
+    except (TypeError, ValueError):
+        return None
+    return cents if cents >= 0 else None
+
+
+def option_utility(option: ProductOption, max_price: float,
+                   price_weight: float = BUDGET_OPTIMIZER_PRICE_WEIGHT,
+                   rating_weight: float = BUDGET_OPTIMIZER_RATING_WEIGHT) -> float:
     """
-    Uses LLM to select the best set of products under the user's budget.
-    Returns a dictionary with the 'optimized_products' update.
+    Scores a single option. Every selected item is worth 1.0 so that covering more items
+    is preferred, plus a bonus for a high rating and for being cheap relative to the
+    item's most expensive option.
     """
-    products: List[Dict[str, Any]] = state.get("products", [])
-    budget: Optional[float] = state.get("budget")
+    try:
+        rating = float(option.rating)
+    except (TypeError, ValueError):
+        rating = DEFAULT_RATING
+    rating = min(max(rating, 0.0), 5.0)
 
-    if not products or budget is None:
-        return {"optimized_products": []}
+    price = float(option.price)
+    price_score = 1.0 - price / max_price if max_price > 0 else 0.0
+
+    return 1.0 + rating_weight * (rating / 5.0) + price_weight * price_score
+
+
+def _candidate_table(products: List[ItemOptions]) -> List[List[Tuple[int, float, ProductOption]]]:
+    """
+    Builds (price_in_cents, utility, option) candidates for each item, in input order.
+    """
+    table = []
+    for prod in products:
+        priced = []
+        for opt in prod:
+            cents = _to_cents(opt.price)
+            if cents is not None:
+                priced.append((cents, opt))
+
+        max_price = max((cents for cents, _ in priced), default=0) / 100
+        table.append([
+            (cents, option_utility(opt, max_price), opt)
+            for cents, opt in priced
+        ])
+    return table
+
+
+def solve_exact(table: List[List[Tuple[int, float, ProductOption]]], budget_cents: int,
+                max_cells: int = BUDGET_OPTIMIZER_MAX_DP_CELLS) -> List[int]:
+    """
+    Multiple-choice knapsack by dynamic programming over price.
+    Returns the chosen option index per item (-1 when the item is dropped).
+
+    Prices are bucketed into units of at least one cent so the table never exceeds
+    `max_cells` columns. Option prices are rounded up and the budget down, so the
+    selection is always within budget.
+    """
+    unit = max(1, math.ceil(budget_cents / max_cells))
+    capacity = budget_cents // unit
+
+    best = [0.0] * (capacity + 1)
+    choices = []
+    for candidates in table:
+        current = best[:]
+        chosen = array("h", [-1]) * (capacity + 1)
+        for index, (cents, utility, _) in enumerate(candidates):
+            weight = -(-cents // unit)
+            if weight > capacity:
+                continue
+            for c in range(capacity, weight - 1, -1):
+                value = best[c - weight] + utility
+                if value > current[c]:
+                    current[c] = value
+                    chosen[c] = index
+        best = current
+        choices.append(chosen)
+
+    selection = [-1] * len(table)
+    c = max(range(capacity + 1), key=best.__getitem__)
+    for i in range(len(table) - 1, -1, -1):
+        index = choices[i][c]
+        selection[i] = index
+        if index >= 0:
+            c -= -(-table[i][index][0] // unit)
+    return selection
+
+
+def solve_greedy(table: List[List[Tuple[int, float, ProductOption]]], budget_cents: int) -> List[int]:
+    """
+    Greedy heuristic for large carts: repeatedly applies the upgrade (adding an item or
+    switching to a better option) with the best utility gained per extra cent that still fits.
+    Returns the chosen option index per item (-1 when the item is dropped).
+    """
+    selection = [-1] * len(table)
+    spent = 0
+
+    while True:
+        best_move = None
+        best_ratio = 0.0
+        for i, candidates in enumerate(table):
+            current_cents, current_utility = 0, 0.0
+            if selection[i] >= 0:
+                current_cents, current_utility, _ = candidates[selection[i]]
+            for index, (cents, utility, _) in enumerate(candidates):
+                gain = utility - current_utility
+                extra = cents - current_cents
+                if gain <= 0 or spent + extra > budget_cents:
+                    continue
+                ratio = math.inf if extra <= 0 else gain / extra
+                if ratio > best_ratio:
+                    best_ratio, best_move = ratio, (i, index, extra)
+        if best_move is None:
+            return selection
+        i, index, extra = best_move
+        selection[i] = index
+        spent += extra
+
+
+def _select(products: List[ItemOptions], budget: float) -> List[Optional[Dict[str, Any]]]:
+    """
+    The chosen option for each product entry, or None where the item is dropped.
+    """
+    try:
+        # Round the budget down so a selection can never exceed it by a cent.
+        budget_cents = int(math.floor(round(float(budget) * 100, 6)))
+    except (TypeError, ValueError):
+        return [None] * len(products)
+    if budget_cents < 0:
+        return [None] * len(products)
+
+    table = _candidate_table(products)
+    if len(table) > BUDGET_OPTIMIZER_MAX_DP_ITEMS:
+        selection = solve_greedy(table, budget_cents)
+    else:
+        selection = solve_exact(table, budget_cents)
+
+    chosen: List[Optional[Dict[str, Any]]] = []
+    for prod, candidates, index in zip(products, table, selection):
+        if index < 0:
+            chosen.append(None)
+            continue
+        option = candidates[index][2]
+        chosen.append({
+            "item": prod.item,
+            **option.to_dict(),
+            "category": option.category or prod.category,
+        })
+    return chosen
+
+
+def select_products(products: List[ItemOptions], budget: float) -> List[Dict[str, Any]]:
+    """
+    Picks at most one option per item so the total stays within `budget`,
+    maximizing the summed option utility. Returns the selected options, each
+    tagged with its item, in the same shape the LLM optimizer used to return.
+    """
+    return [product for product in _select(products, budget) if product is not None]
 
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
 
+def _total(selection: List[Dict[str, Any]]) -> float:
+    return sum(float(product.get("price") or 0) for product in selection)
+
+
+def select_products_jointly(carts: List[List[ItemOptions]], budget: float,
+                            budgets: Optional[List[Optional[float]]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Picks products for several carts under one shared `budget`, maximizing the summed
+    utility across all of them, so money goes where it buys the most. `budgets` caps
+    individual carts as well (None for no cap of its own): a cart the joint pick puts
+    over its cap is solved alone under it, and the other carts are re-picked with what
+    is left. Returns each cart's selection, in cart order.
+    """
+    budgets = list(budgets or [None] * len(carts))
+    selections: List[Optional[List[Dict[str, Any]]]] = [None] * len(carts)
+    remaining = float(budget)
+    while True:
+        open_carts = [index for index, selection in enumerate(selections) if selection is None]
+        chosen = iter(_select([prod for index in open_carts for prod in carts[index]], remaining))
+        picked = {}
+        for index in open_carts:
+            picked[index] = [product for product in (next(chosen) for _ in carts[index]) if product is not None]
+        over = [index for index in open_carts
+                if budgets[index] is not None and _total(picked[index]) > budgets[index]]
+        if not over:
+            for index in open_carts:
+                selections[index] = picked[index]
+            return selections
+        # Capping a cart only lowers its spend, so the rest can be re-picked with the difference.
+        for index in over:
+            selections[index] = select_products(carts[index], budgets[index])
+            remaining -= _total(selections[index])
+
+
+def _build_llm_prompt(products: List[ItemOptions], budget: float) -> str:
     items_summary = []
     for prod in products:
-        item = prod.get("item")
-        category = prod.get("category")
-        options = prod.get("options", [])
         options_summary = [
             {
-                "name": opt.get("name"),
-                "price": opt.get("price"),
-                "rating": opt.get("rating"),
-                "brand": opt.get("brand"),
-                "category": opt.get("category", category),
-                "description": opt.get("description")
+                "name": opt.name,
+                "price": opt.price,
+                "rating": opt.rating,
+                "brand": opt.brand,
+                "category": opt.category or prod.category,
+                "description": opt.description
             }
-            for opt in options if opt.get("price") is not None
+            for opt in prod
         ]
-        items_summary.append({"item": item, "category": category, "options": options_summary})
+        items_summary.append({"item": prod.item, "category": prod.category, "options": options_summary})
 
-    prompt = (
+    return (
         "You are a smart shopping assistant. "
         f"Given a list of items with several product options and a total budget of ${budget}, "
         "select the best combination of products so the total price does not exceed the budget. "
@@ -48,17 +240,110 @@ def budget_optimizer_agent(state: OverallState) -> Dict[str, Any]:
         f"Items and options: {items_summary}"
     )
 
-    response = llm.invoke([{"role": "user", "content": prompt}])
 
+def check_selection(products: List[ItemOptions], selected: List[Dict[str, Any]],
+                    budget: float) -> Optional[List[Dict[str, Any]]]:
+    """
+    Matches an LLM selection against the options that were offered. Returns the matched
+    options, priced as offered, or None if the selection names an unknown option, picks
+    an item twice, or goes over `budget`.
+    """
+    offered = {}
+    for prod in products:
+        for option in prod:
+            offered.setdefault((prod.item, option.name), (prod, option))
+
+    chosen, items, total_cents = [], set(), 0
+    for product in selected:
+        match = offered.get((product.get("item"), product.get("name")))
+        if match is None or match[0].item in items:
+            return None
+        prod, option = match
+        cents = _to_cents(option.price)
+        if cents is None:
+            return None
+        items.add(prod.item)
+        total_cents += cents
+        chosen.append({"item": prod.item, **option.to_dict(), "category": option.category or prod.category})
+    if total_cents > math.floor(round(float(budget) * 100, 6)):
+        return None
+    return chosen
+
+
+def _llm_select_products(products: List[ItemOptions], budget: float) -> Optional[List[Dict[str, Any]]]:
+    """
+    Asks the LLM to pick the product combination, retrying an invalid reply.
+    Returns None if no valid selection within budget came back.
+    """
+    try:
+        selected = invoke_structured(get_llm(), _build_llm_prompt(products, budget), Selection)
+    except StructuredOutputError as e:
+        print(f"Budget optimizer reply rejected: {e}")
+        return None
+    return _checked(products, selected, budget)
+
+
+async def _allm_select_products(products: List[ItemOptions], budget: float) -> Optional[List[Dict[str, Any]]]:
     try:
-        content = response.content.strip()
-        if content.startswith('```json'):
-            content = content[7:-3].strip()
-        optimized_products = json.loads(content)
-        if not isinstance(optimized_products, list):
-            optimized_products = []
-    except (json.JSONDecodeError, AttributeError) as e:
-        print(f"JSON parsing error in budget optimizer: {e}")
-        optimized_products = []
-
-    return {"optimized_products": optimized_products}
+        selected = await ainvoke_structured(get_llm(), _build_llm_prompt(products, budget), Selection)
+    except StructuredOutputError as e:
+        print(f"Budget optimizer reply rejected: {e}")
+        return None
+    return _checked(products, selected, budget)
+
+
+def _checked(products: List[ItemOptions], selected: List[Dict[str, Any]],
+             budget: float) -> Optional[List[Dict[str, Any]]]:
+    checked = check_selection(products, selected, budget)
+    if checked is None:
+        print("Budget optimizer selection is over budget or names unknown options; using the solver.")
+    return checked
+
+
+def budget_optimizer_agent(state: OverallState) -> Dict[str, Any]:
+    """
+    Selects the best set of products under the user's budget.
+    Uses the local knapsack solver unless WALLY_BUDGET_OPTIMIZER_MODE is "llm",
+    in which case the LLM picks and the solver is the fallback.
+    Returns a dictionary with the 'optimized_products' update.
+    """
+    products = as_item_options(state.get("products"))
+    budget: Optional[float] = state.get("budget")
+    digest = input_hash(products, budget, BUDGET_OPTIMIZER_MODE)
+    if unchanged(state, "budget_optimizer_agent", digest, "optimized_products"):
+        return {}
+    hashes = {"budget_optimizer_agent": digest}
+
+    if not products or budget is None:
+        return {"optimized_products": [], "input_hashes": hashes}
+
+    if BUDGET_OPTIMIZER_MODE == "llm":
+        optimized_products = _llm_select_products(products, budget)
+        if optimized_products is not None:
+            return {"optimized_products": optimized_products, "input_hashes": hashes}
+        record_event("fallbacks")
+
+    return {"optimized_products": select_products(products, budget), "input_hashes": hashes}
+
+
+async def abudget_optimizer_agent(state: OverallState) -> Dict[str, Any]:
+    """
+    Async variant of `budget_optimizer_agent`.
+    """
+    products = as_item_options(state.get("products"))
+    budget: Optional[float] = state.get("budget")
+    digest = input_hash(products, budget, BUDGET_OPTIMIZER_MODE)
+    if unchanged(state, "budget_optimizer_agent", digest, "optimized_products"):
+        return {}
+    hashes = {"budget_optimizer_agent": digest}
+
+    if not products or budget is None:
+        return {"optimized_products": [], "input_hashes": hashes}
+
+    if BUDGET_OPTIMIZER_MODE == "llm":
+        optimized_products = await _allm_select_products(products, budget)
+        if optimized_products is not None:
+            return {"optimized_products": optimized_products, "input_hashes": hashes}
+        record_event("fallbacks")
+
+    return {"optimized_products": select_products(products, budget), "input_hashes": hashes}
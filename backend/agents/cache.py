@@ -0,0 +1,196 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from agents.config import CACHE_BACKEND, CACHE_PATH
+from agents.tracing import record_cache
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU store. Entries expire after their TTL.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        # Store and hand out copies so callers can't mutate the cached entry.
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk LRU store shared by every cache namespace in the same file.
+    Values are stored as JSON, so they must be JSON-serializable.
+    """
+
+    def __init__(self, path: str, namespace: str, max_entries: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, last_access)"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+                )
+                return None
+            self._conn.execute(
+                "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        payload = json.dumps(value, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, payload, now + ttl, now),
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND (expires_at < ? OR key IN ("
+                " SELECT key FROM cache WHERE namespace = ?"
+                " ORDER BY last_access DESC LIMIT -1 OFFSET ?))",
+                (self.namespace, now, self.namespace, self.max_entries),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        return row[0]
+
+
+class TTLCache:
+    """
+    A named cache over a pluggable backend, with hit/miss counters.
+    """
+
+    def __init__(self, name: str, backend, ttl: float):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache '{self.name}' read failed: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache(self.name, value is not None)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if value is None or self.ttl <= 0:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            print(f"Cache '{self.name}' write failed: {e}")
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
+
+
+_caches: Dict[str, TTLCache] = {}
+
+
+def make_cache(name: str, ttl: float, max_entries: int) -> TTLCache:
+    """
+    Creates (or returns the existing) cache called `name`, using the backend
+    selected by WALLY_CACHE_BACKEND: "memory" (default) or "sqlite".
+    """
+    if name in _caches:
+        return _caches[name]
+
+    if CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend(CACHE_PATH, name, max_entries)
+    else:
+        backend = MemoryCacheBackend(max_entries)
+
+    cache = TTLCache(name, backend, ttl)
+    _caches[name] = cache
+    return cache
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Returns hit/miss/size counters for every cache created in this process.
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -1,4 +1,5 @@
 from agents.states import OverallState
+from agents.products import as_item_options
 from typing import Dict, Any, List
 import urllib.parse
 
@@ -26,9 +27,7 @@ def cart_builder_agent(state: OverallState) -> Dict[str, str]:
     products = state.get("optimized_products", [])
     
     if not products:
-        products = state.get("products", [])
-        if products and "options" in products[0]:
-             products = [opt for prod in products for opt in prod.get("options", [])]
+        products = [{"name": name} for prod in as_item_options(state.get("products")) for name in prod.names]
 
 
     cart_url = build_walmart_cart_url(products)
@@ -0,0 +1,343 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from agents.category_index import normalize_item
+from agents.config import (
+    CATALOG_ENABLED,
+    CATALOG_PATH,
+    CATALOG_MAX_AGE,
+    CATALOG_REFRESH_INTERVAL,
+    CATALOG_REFRESH_ITEMS,
+    CATALOG_REFRESH_AHEAD,
+)
+from agents.products import product_id
+from agents.ratelimit import BACKGROUND, call_priority
+from agents.tracing import record_event
+
+# Options answered per item, as for a live search.
+MAX_OPTIONS = 5
+
+# Items requested fewer times than this, or not within the window, are not refreshed ahead of time.
+MIN_HOT_REQUESTS = 2
+HOT_WINDOW = 7 * 24 * 60 * 60
+
+# Products and items not seen or requested for this long are dropped.
+RETENTION = 30 * 24 * 60 * 60
+
+_OPTION_COLUMNS = ("name", "price", "rating", "brand", "category", "description")
+_SELECT = "SELECT p.product_id, " + ", ".join(f"p.{column}" for column in _OPTION_COLUMNS)
+
+
+def _category_key(category: Optional[str]) -> str:
+    return " ".join(str(category or "").lower().split())
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProductCatalog:
+    """
+    Local store of every product option extracted so far, keyed by item and category, with
+    the price and rating last seen and when. Product search answers from it while an item's
+    options are younger than `max_age`. Only options stored under the same (normalized)
+    item are served: a product whose name merely contains the item's words, like cream
+    cheese for "cheese", is not an option for it. Request counts tell the
+    `CatalogRefresher` which items are worth keeping fresh.
+    """
+
+    def __init__(self, path: Optional[str], max_age: float = CATALOG_MAX_AGE):
+        self.path = path or ":memory:"
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " item_key TEXT NOT NULL,"
+                " category_key TEXT NOT NULL,"
+                " item TEXT NOT NULL,"
+                " category TEXT NOT NULL,"
+                " requests INTEGER NOT NULL DEFAULT 0,"
+                " last_requested REAL,"
+                " refreshed_at REAL,"
+                " PRIMARY KEY (item_key, category_key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                " item_key TEXT NOT NULL,"
+                " category_key TEXT NOT NULL,"
+                " product_id TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " name TEXT NOT NULL,"
+                " brand TEXT,"
+                " price REAL NOT NULL,"
+                " rating REAL,"
+                " category TEXT,"
+                " description TEXT,"
+                " first_seen REAL NOT NULL,"
+                " last_seen REAL NOT NULL,"
+                " PRIMARY KEY (item_key, category_key, product_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS items_hot ON items (requests)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS products_seen ON products (last_seen)")
+
+    def lookup(self, item: str, category: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns the options last extracted for this item and category while they are
+        fresh, or None if the item should be searched live.
+        """
+        now = time.time()
+        keys = (normalize_item(item), _category_key(category))
+        rows: List[tuple] = []
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT refreshed_at FROM items WHERE item_key = ? AND category_key = ?", keys
+                ).fetchone()
+                if row is not None and row[0] is not None and now - row[0] <= self.max_age:
+                    rows = self._conn.execute(
+                        f"{_SELECT} FROM products p"
+                        " WHERE p.item_key = ? AND p.category_key = ? AND p.last_seen >= ?"
+                        " ORDER BY p.position LIMIT ?",
+                        (*keys, row[0], MAX_OPTIONS),
+                    ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Product catalog read failed: {e}")
+            rows = []
+
+        with self._lock:
+            if rows:
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_event("catalog_hits" if rows else "catalog_misses")
+        if not rows:
+            return None
+        return [dict(zip(_OPTION_COLUMNS, row[1:])) for row in rows]
+
+    def upsert(self, item: str, category: str, options: List[Dict[str, Any]]) -> None:
+        """
+        Records freshly extracted options for the item. Products seen before keep their
+        first-seen time and get the new price, rating and last-seen time.
+        """
+        now = time.time()
+        keys = (normalize_item(item), _category_key(category))
+        rows = []
+        for position, option in enumerate(options):
+            name = str(option.get("name") or "").strip()
+            price = _number(option.get("price"))
+            if not name or price is None:
+                continue
+            brand = option.get("brand") if isinstance(option.get("brand"), str) else None
+            rows.append((*keys, product_id(name, brand), position, name, brand, price,
+                         _number(option.get("rating")), option.get("category") or category,
+                         option.get("description"), now, now))
+        if not rows or not keys[0]:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO items (item_key, category_key, item, category, refreshed_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (item_key, category_key) DO UPDATE SET refreshed_at = excluded.refreshed_at",
+                    (*keys, item, category or "", now),
+                )
+                self._conn.executemany(
+                    "INSERT INTO products (item_key, category_key, product_id, position, name, brand, price, rating,"
+                    " category, description, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (item_key, category_key, product_id) DO UPDATE SET"
+                    " position = excluded.position, name = excluded.name, price = excluded.price,"
+                    " rating = excluded.rating, category = excluded.category,"
+                    " description = COALESCE(excluded.description, products.description),"
+                    " last_seen = excluded.last_seen",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            print(f"Product catalog write failed: {e}")
+
+    def record_requests(self, pairs: List[Tuple[str, str]]) -> None:
+        """
+        Counts a request for each (item, category), for picking the items to refresh.
+        """
+        now = time.time()
+        rows = [(normalize_item(item), _category_key(category), item, category or "", now)
+                for item, category in pairs if normalize_item(item)]
+        if not rows:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT INTO items (item_key, category_key, item, category, requests, last_requested)"
+                    " VALUES (?, ?, ?, ?, 1, ?)"
+                    " ON CONFLICT (item_key, category_key) DO UPDATE SET"
+                    " requests = items.requests + 1, last_requested = excluded.last_requested",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            print(f"Product catalog write failed: {e}")
+
+    def hot_items(self, limit: int, refreshed_before: float) -> List[Tuple[str, str]]:
+        """
+        The most-requested recent items whose options were last extracted before `refreshed_before`.
+        """
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT item, category FROM items"
+                " WHERE requests >= ? AND last_requested >= ? AND refreshed_at < ?"
+                " ORDER BY requests DESC LIMIT ?",
+                (MIN_HOT_REQUESTS, time.time() - HOT_WINDOW, refreshed_before, limit),
+            )]
+
+    def refreshed_since(self, pairs: List[Tuple[str, str]], since: float) -> List[Tuple[str, str]]:
+        """
+        The (item, category) pairs whose options were rewritten at or after `since`.
+        """
+        with self._lock:
+            return [
+                (item, category) for item, category in pairs
+                if (self._conn.execute(
+                    "SELECT 1 FROM items WHERE item_key = ? AND category_key = ? AND refreshed_at >= ?",
+                    (normalize_item(item), _category_key(category), since),
+                ).fetchone()) is not None
+            ]
+
+    def prune(self, retention: float = RETENTION) -> None:
+        cutoff = time.time() - retention
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM products WHERE last_seen < ?", (cutoff,))
+            self._conn.execute(
+                "DELETE FROM items WHERE COALESCE(last_requested, 0) < ? AND COALESCE(refreshed_at, 0) < ?",
+                (cutoff, cutoff),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM products")
+            self._conn.execute("DELETE FROM items")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = self._conn.execute("SELECT COUNT(*) FROM items WHERE refreshed_at IS NOT NULL").fetchone()[0]
+            products = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        return {
+            "items": items,
+            "products": products,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CatalogRefresher:
+    """
+    Background thread that re-fetches the most-requested items every `interval` seconds,
+    once they are `ahead` of the way to going stale, so hot items keep being answered
+    from the catalog and only the long tail waits on a live search.
+    """
+
+    def __init__(self, catalog: ProductCatalog, interval: float = CATALOG_REFRESH_INTERVAL,
+                 batch_size: int = CATALOG_REFRESH_ITEMS, ahead: float = CATALOG_REFRESH_AHEAD):
+        self.catalog = catalog
+        self.interval = interval
+        self.batch_size = batch_size
+        self.ahead = ahead
+        self.rounds = 0
+        self.refreshed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_once()
+            except Exception as e:
+                print(f"Catalog refresh failed: {e}")
+
+    def refresh_once(self) -> int:
+        """
+        Refreshes one round of hot items and returns how many were refreshed: fetched
+        with at least one option and rewritten in the catalog. Items whose fetch failed
+        or found nothing keep their old entry and count as failed.
+        """
+        from agents.clients import get_llm, get_search
+        from agents.product_fetcher import fetch_products_batched
+
+        pairs = self.catalog.hot_items(self.batch_size, time.time() - self.catalog.max_age * self.ahead)
+        refreshed: List[Tuple[str, str]] = []
+        if pairs:
+            print(f"Refreshing catalog for {[item for item, _ in pairs]}")
+            started = time.time()
+            with call_priority(BACKGROUND):
+                results = fetch_products_batched(get_llm(), get_search(), pairs, refresh=True)
+            fetched = [pair for pair, options in zip(pairs, results) if options]
+            refreshed = self.catalog.refreshed_since(fetched, started)
+        self.catalog.prune()
+        self.rounds += 1
+        self.refreshed += len(refreshed)
+        self.failed += len(pairs) - len(refreshed)
+        return len(refreshed)
+
+    def stats(self) -> Dict[str, int]:
+        return {"rounds": self.rounds, "refreshed": self.refreshed, "failed": self.failed}
+
+
+_lock = threading.Lock()
+_catalog: Optional[ProductCatalog] = None
+_refresher: Optional[CatalogRefresher] = None
+
+
+def get_catalog() -> Optional[ProductCatalog]:
+    """
+    Returns the process-wide catalog, opening it on first use, or None when
+    WALLY_CATALOG_ENABLED is off.
+    """
+    global _catalog, _refresher
+    if _catalog is None and CATALOG_ENABLED:
+        with _lock:
+            if _catalog is None:
+                catalog = ProductCatalog(CATALOG_PATH)
+                _refresher = CatalogRefresher(catalog)
+                _catalog = catalog
+    return _catalog
+
+
+def get_catalog_refresher() -> Optional[CatalogRefresher]:
+    """
+    Returns the refresher for the process-wide catalog, or None when it is off.
+    """
+    get_catalog()
+    return _refresher
+
+
+def catalog_stats() -> Dict[str, Any]:
+    """
+    Returns size and hit counters for the process-wide catalog and its refresher.
+    """
+    if _catalog is None:
+        return {}
+    return {**_catalog.stats(), "refresh": _refresher.stats()}
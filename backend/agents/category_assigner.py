@@ -1,23 +1,17 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.clients import get_llm
 from agents.states import OverallState
-from typing import Dict, Any, List, Literal
-from langgraph.types import Command, interrupt
-from dotenv import load_dotenv
+from agents.category_index import category_index
+from agents.config import CATEGORY_INDEX_ENABLED, PARSE_RETRIES
+from agents.tracing import record_event
+from agents.structured import Categories, StructuredOutputError, backoff_delay, count_event, parse
+from typing import Dict, Any, List, Literal, Tuple
+from langgraph.types import Command
+import asyncio
+import time
 
-load_dotenv()
 
-def category_inference_agent(state: OverallState) -> Command[Literal["product_search_agent"]]:
-    """
-    Maps each item to a Walmart category name using LLM reasoning.
-    Returns: {"categories": {item: category_name, ...}}
-    """
-    items: List[str] = state.get("expanded_items") or state.get("item_list") or []
-    if not items:
-        print("No items found, returning empty categories")
-        return Command(update={"categories": {}}, goto="product_search_agent")
-
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-    prompt = (
+def _build_prompt(items: List[str]) -> str:
+    return (
         "You are a Walmart.com shopping assistant. "
         "Given a list of product names, map each to the most relevant Walmart.com category name. "
         "Use only top-level or second-level categories as found on Walmart.com. "
@@ -31,24 +25,164 @@ def category_inference_agent(state: OverallState) -> Command[Literal["product_se
         f"Items: {items}"
     )
 
-    response = llm.invoke([{"role": "user", "content": prompt}])
 
+def _parse_response(response, pending: List[str]) -> Dict[str, str]:
+    """
+    Returns the categories the reply gives for `pending` items; an unusable reply gives none.
+    """
     try:
-        import json
-        content = response.content.strip()
-
-        if content.startswith('```json'):
-            content = content[7:]  
-        if content.endswith('```'):
-            content = content[:-3] 
-        content = content.strip()
-        categories = json.loads(content)
-        if not isinstance(categories, dict):
-            categories = {}
-    except Exception as e:
-        print(f"JSON parsing error: {e}")
-        categories = {}
-
-    print(f"Category inference result: {categories}")
+        categories = parse(response, Categories)
+    except StructuredOutputError as e:
+        print(f"Category inference reply rejected: {e}")
+        return {}
+    return {item: categories[item] for item in pending if item in categories}
+
+
+def _next_round(inferred: Dict[str, str], pending: List[str], attempt: int) -> List[str]:
+    """
+    Returns the items still missing a category, counting a retry if there will be another round.
+    """
+    pending = [item for item in pending if item not in inferred]
+    if pending and attempt < PARSE_RETRIES:
+        count_event(Categories, "retries")
+    return pending
+
+
+def _finish(inferred: Dict[str, str], pending: List[str]) -> Dict[str, str]:
+    if pending:
+        # Searching without a category still finds products; dropping the item would not.
+        count_event(Categories, "failures")
+        record_event("fallbacks", len(pending))
+        print(f"No category for {pending} after {PARSE_RETRIES + 1} attempt(s); searching without one")
+        inferred.update({item: "" for item in pending})
+    print(f"Category inference result: {inferred}")
+    return inferred
+
+
+def _infer(llm, items: List[str]) -> Dict[str, str]:
+    """
+    Asks the LLM for the categories of `items`. Items a reply leaves out (or the whole
+    batch, if the reply is unusable) are asked for again on their own, with backoff.
+    """
+    inferred: Dict[str, str] = {}
+    pending = list(items)
+    for attempt in range(PARSE_RETRIES + 1):
+        response = llm.invoke([{"role": "user", "content": _build_prompt(pending)}])
+        inferred.update(_parse_response(response, pending))
+        pending = _next_round(inferred, pending, attempt)
+        if not pending or attempt == PARSE_RETRIES:
+            break
+        time.sleep(backoff_delay(attempt))
+    return _finish(inferred, pending)
+
+
+async def _ainfer(llm, items: List[str]) -> Dict[str, str]:
+    """
+    Async variant of `_infer`.
+    """
+    inferred: Dict[str, str] = {}
+    pending = list(items)
+    for attempt in range(PARSE_RETRIES + 1):
+        response = await llm.ainvoke([{"role": "user", "content": _build_prompt(pending)}])
+        inferred.update(_parse_response(response, pending))
+        pending = _next_round(inferred, pending, attempt)
+        if not pending or attempt == PARSE_RETRIES:
+            break
+        await asyncio.sleep(backoff_delay(attempt))
+    return _finish(inferred, pending)
+
+
+def _split_known(state: OverallState) -> Tuple[List[str], Dict[str, str], List[str]]:
+    """
+    Returns (items, categories already known for them, items still to categorize).
+    Categories can already be known from the fused planner, an earlier run, or the
+    local category index.
+    """
+    items: List[str] = state.get("expanded_items") or state.get("item_list") or []
+    existing: Dict[str, str] = state.get("categories") or {}
+    known = {item: existing[item] for item in items if item in existing}
+    missing = [item for item in items if item not in existing]
+    if missing and CATEGORY_INDEX_ENABLED:
+        indexed, missing = category_index.lookup(missing)
+        known.update(indexed)
+    return items, known, missing
+
+
+def _learn(missing: List[str], inferred: Dict[str, str]) -> None:
+    if CATEGORY_INDEX_ENABLED:
+        category_index.learn({item: inferred[item] for item in missing if inferred.get(item)})
+
+
+def _merge(items: List[str], known: Dict[str, str], inferred: Dict[str, str]) -> Dict[str, str]:
+    categories = {}
+    for item in items:
+        if item in known:
+            categories[item] = known[item]
+        elif item in inferred:
+            categories[item] = inferred[item]
+    for item, category in inferred.items():
+        categories.setdefault(item, category)
+    return categories
+
+
+def infer_categories(items: List[str]) -> Dict[str, str]:
+    """
+    Categorizes `items` outside the graph, e.g. for prefetching: the local index first,
+    then one LLM call for the rest.
+    """
+    _, known, missing = _split_known({"item_list": items})
+    inferred = {}
+    if missing:
+        inferred = _infer(get_llm(), missing)
+        _learn(missing, inferred)
+    return _merge(items, known, inferred)
+
+
+async def ainfer_categories(items: List[str]) -> Dict[str, str]:
+    """
+    Async variant of `infer_categories`.
+    """
+    _, known, missing = _split_known({"item_list": items})
+    inferred = {}
+    if missing:
+        inferred = await _ainfer(get_llm(), missing)
+        _learn(missing, inferred)
+    return _merge(items, known, inferred)
+
+
+def category_inference_agent(state: OverallState) -> Command[Literal["product_search_agent"]]:
+    """
+    Maps each item to a Walmart category name using LLM reasoning.
+    Only items without a known category are sent to the LLM.
+    Returns: {"categories": {item: category_name, ...}}
+    """
+    items, known, missing = _split_known(state)
+    if not items:
+        print("No items found, returning empty categories")
+        return Command(update={"categories": {}}, goto="product_search_agent")
+    if not missing:
+        return Command(update={"categories": _merge(items, known, {})}, goto="product_search_agent")
+
+    inferred = _infer(get_llm(), missing)
+    _learn(missing, inferred)
+    categories = _merge(items, known, inferred)
     
     return Command(update={"categories": categories}, goto="product_search_agent")
+
+
+async def acategory_inference_agent(state: OverallState) -> Command[Literal["product_search_agent"]]:
+    """
+    Async variant of `category_inference_agent`.
+    """
+    items, known, missing = _split_known(state)
+    if not items:
+        print("No items found, returning empty categories")
+        return Command(update={"categories": {}}, goto="product_search_agent")
+    if not missing:
+        return Command(update={"categories": _merge(items, known, {})}, goto="product_search_agent")
+
+    inferred = await _ainfer(get_llm(), missing)
+    _learn(missing, inferred)
+    categories = _merge(items, known, inferred)
+
+    return Command(update={"categories": categories}, goto="product_search_agent")
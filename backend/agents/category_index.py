@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from agents.config import (
+    CATEGORY_INDEX_PATH,
+    CATEGORY_INDEX_FUZZY_THRESHOLD,
+)
+from agents.tracing import metrics
+
+SEED_PATH = os.path.join(os.path.dirname(__file__), "data", "category_seed.json")
+
+_WORD_PATTERN = re.compile(r"[a-z0-9%]+")
+
+
+def singularize(word: str) -> str:
+    """
+    Cheap English singularization, good enough for grocery item names.
+    """
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith(("ches", "shes", "xes", "zes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_item(item: str) -> str:
+    """
+    Lowercases, drops punctuation and singularizes each word: "Roma Tomatoes!" -> "roma tomato".
+    """
+    return " ".join(singularize(word) for word in _WORD_PATTERN.findall(str(item).lower()))
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CategoryIndex:
+    """
+    Item -> Walmart category lookup. Matches normalized/singularized names exactly, then
+    by trigram similarity above `fuzzy_threshold`. Anything else is left to the LLM:
+    a shared word says little about the category ("lemon pepper" is not produce).
+    Learned entries are persisted to `path` as JSON when a path is given.
+    """
+
+    def __init__(self, seed: Dict[str, str], path: Optional[str] = None,
+                 fuzzy_threshold: float = CATEGORY_INDEX_FUZZY_THRESHOLD):
+        self.path = path
+        self.fuzzy_threshold = fuzzy_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, str] = {}
+        self._learned: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+        for item, category in seed.items():
+            self._add(item, category)
+        for item, category in self._load_learned().items():
+            self._add(item, category)
+            self._learned[normalize_item(item)] = category
+
+    def _load_learned(self) -> Dict[str, str]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                learned = json.load(f)
+            return learned if isinstance(learned, dict) else {}
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not load category index from {self.path}: {e}")
+            return {}
+
+    def _add(self, item: str, category: str) -> Optional[str]:
+        key = normalize_item(item)
+        if not key or not isinstance(category, str) or not category:
+            return None
+        if key not in self._entries:
+            for gram in _trigrams(key):
+                self._grams[gram].add(key)
+        self._entries[key] = category
+        return key
+
+    def _match(self, key: str) -> Optional[str]:
+        if key in self._entries:
+            return self._entries[key]
+
+        grams = _trigrams(key)
+        counts: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                counts[candidate] += 1
+        best, best_score = None, 0.0
+        for candidate, shared in counts.items():
+            score = shared / (len(grams) + len(_trigrams(candidate)) - shared)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is not None and best_score >= self.fuzzy_threshold:
+            return self._entries[best]
+        return None
+
+    def lookup(self, items: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+        """
+        Returns ({item: category} for items the index knows, [items it doesn't]).
+        Hits and misses are also counted as `wally_category_index_lookups_total`.
+        """
+        found: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._lock:
+            for item in items:
+                category = self._match(normalize_item(item))
+                if category is None:
+                    missing.append(item)
+                    self.misses += 1
+                else:
+                    found[item] = category
+                    self.hits += 1
+        for result, count in (("hit", len(found)), ("miss", len(missing))):
+            if count:
+                metrics.inc("wally_category_index_lookups_total", "Category index lookups by result.",
+                            count, result=result)
+        return found, missing
+
+    def learn(self, categories: Dict[str, str]) -> None:
+        """
+        Adds LLM-assigned categories to the index and persists them.
+        """
+        with self._lock:
+            changed = False
+            for item, category in categories.items():
+                key = self._add(item, category)
+                if key and self._learned.get(key) != category:
+                    self._learned[key] = category
+                    changed = True
+            if changed:
+                self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._learned, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save category index to {self.path}: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "learned": len(self._learned),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _load_seed() -> Dict[str, str]:
+    try:
+        with open(SEED_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not load category seed table: {e}")
+        return {}
+
+
+category_index = CategoryIndex(_load_seed(), path=CATEGORY_INDEX_PATH or None)
+
+
+def category_index_stats() -> Dict[str, float]:
+    """
+    Returns size and hit-rate counters for the process-wide category index.
+    """
+    return category_index.stats()
@@ -0,0 +1,413 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+from agents.config import (
+    CHECKPOINTER,
+    CHECKPOINT_PATH,
+    CHECKPOINT_TTL,
+    CHECKPOINT_IDLE_TTL,
+    CHECKPOINT_HISTORY,
+    CHECKPOINT_COMPRESS_BYTES,
+)
+
+# Prefix of the channels that schedule a node for the next step.
+TRIGGER_PREFIX = "branch:to:"
+
+# Minimum number of seconds between two TTL sweeps triggered by writes.
+EVICTION_INTERVAL = 60.0
+
+_COMPRESSED = "z:"
+
+
+def reached_end(checkpoint: Checkpoint) -> bool:
+    """
+    True when no node is scheduled to run after `checkpoint`, i.e. the run got to END.
+    A node is scheduled while its trigger channel holds a value at a version the node
+    has not seen yet (consuming a trigger empties it); a run paused at an interrupt
+    still has its node scheduled.
+    """
+    values = checkpoint["channel_values"]
+    seen = checkpoint["versions_seen"]
+    for channel, version in checkpoint["channel_versions"].items():
+        if channel not in values:
+            continue
+        if channel == "__start__":
+            node = channel
+        elif channel.startswith(TRIGGER_PREFIX):
+            node = channel[len(TRIGGER_PREFIX):]
+        else:
+            continue
+        if str(seen.get(node, {}).get(channel, "")) < str(version):
+            return False
+    return True
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpoint saver backed by a single SQLite file, so threads survive restarts and can be
+    shared by several worker processes.
+
+    Channel values are stored once per version (not once per checkpoint) and large payloads
+    are zlib-compressed. Only the latest `max_history` checkpoints of each thread are kept,
+    and threads are dropped once idle for longer than `ttl` (finished runs) or `idle_ttl`
+    (runs still waiting, e.g. at the review step).
+    """
+
+    def __init__(self, path: str, *, ttl: float = CHECKPOINT_TTL, idle_ttl: float = CHECKPOINT_IDLE_TTL,
+                 max_history: int = CHECKPOINT_HISTORY,
+                 compress_bytes: int = CHECKPOINT_COMPRESS_BYTES, serde=None):
+        super().__init__(serde=serde)
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        # The latest checkpoint and its parent are needed to resume an interrupt.
+        self.max_history = max(2, max_history)
+        self.compress_bytes = compress_bytes
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                " thread_id TEXT PRIMARY KEY,"
+                " updated_at REAL NOT NULL,"
+                " finished INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                " thread_id TEXT NOT NULL,"
+                " checkpoint_ns TEXT NOT NULL,"
+                " checkpoint_id TEXT NOT NULL,"
+                " parent_id TEXT,"
+                " type TEXT NOT NULL,"
+                " checkpoint BLOB NOT NULL,"
+                " metadata_type TEXT NOT NULL,"
+                " metadata BLOB NOT NULL,"
+                " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " thread_id TEXT NOT NULL,"
+                " checkpoint_ns TEXT NOT NULL,"
+                " channel TEXT NOT NULL,"
+                " version TEXT NOT NULL,"
+                " type TEXT NOT NULL,"
+                " value BLOB,"
+                " PRIMARY KEY (thread_id, checkpoint_ns, channel, version))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS writes ("
+                " thread_id TEXT NOT NULL,"
+                " checkpoint_ns TEXT NOT NULL,"
+                " checkpoint_id TEXT NOT NULL,"
+                " task_id TEXT NOT NULL,"
+                " idx INTEGER NOT NULL,"
+                " channel TEXT NOT NULL,"
+                " type TEXT NOT NULL,"
+                " value BLOB,"
+                " task_path TEXT NOT NULL DEFAULT '',"
+                " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS threads_age ON threads (finished, updated_at)")
+        self.evict_expired()
+
+    # Serialization
+
+    def _dump(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        if self.compress_bytes > 0 and len(data) >= self.compress_bytes:
+            return _COMPRESSED + type_, zlib.compress(data)
+        return type_, data
+
+    def _load(self, type_: str, data: bytes) -> Any:
+        if type_.startswith(_COMPRESSED):
+            return self.serde.loads_typed((type_[len(_COMPRESSED):], zlib.decompress(data)))
+        return self.serde.loads_typed((type_, data))
+
+    # Reads
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        channel_values = {}
+        for channel, version in versions.items():
+            row = self._conn.execute(
+                "SELECT type, value FROM blobs"
+                " WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if row is not None and row[0] != "empty":
+                channel_values[channel] = self._load(*row)
+        return channel_values
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        rows = self._conn.execute(
+            "SELECT task_id, channel, type, value FROM writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+            " ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return [(task_id, channel, self._load(type_, value)) for task_id, channel, type_, value in rows]
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, row, metadata=None) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, data, metadata_type, metadata_data = row
+        checkpoint = self._load(type_, data)
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+            },
+            metadata=metadata if metadata is not None else self._load(metadata_type, metadata_data),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_id,
+                }}
+                if parent_id else None
+            ),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "SELECT checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    columns + " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    columns + " WHERE thread_id = ? AND checkpoint_ns = ?"
+                    " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            return self._to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint,"
+                 " metadata_type, metadata FROM checkpoints")
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        # Materialize under the lock so callers can interleave other saver calls while iterating.
+        results = []
+        with self._lock:
+            for thread_id, checkpoint_ns, *row in self._conn.execute(query, params).fetchall():
+                if limit is not None and len(results) >= limit:
+                    break
+                metadata = self._load(row[4], row[5])
+                if filter and not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(self._to_tuple(thread_id, checkpoint_ns, row, metadata))
+        yield from results
+
+    # Writes
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        checkpoint_copy = checkpoint.copy()
+        values: Dict[str, Any] = checkpoint_copy.pop("channel_values")
+
+        blobs = []
+        for channel, version in new_versions.items():
+            type_, data = self._dump(values[channel]) if channel in values else ("empty", None)
+            blobs.append((thread_id, checkpoint_ns, channel, str(version), type_, data))
+        type_, data = self._dump(checkpoint_copy)
+        metadata_type, metadata_data = self._dump(get_checkpoint_metadata(config, metadata))
+        finished = int(reached_end(checkpoint))
+
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, data, metadata_type, metadata_data),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, updated_at, finished) VALUES (?, ?, ?)",
+                (thread_id, time.time(), finished),
+            )
+            self._trim_history(thread_id, checkpoint_ns)
+
+        if time.time() - self._last_eviction >= EVICTION_INTERVAL:
+            self.evict_expired()
+
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for index, (channel, value) in enumerate(writes):
+            type_, data = self._dump(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id,
+                         WRITES_IDX_MAP.get(channel, index), channel, type_, data, task_path))
+        # Special writes (errors, interrupts, resumes) overwrite; regular writes are only stored once.
+        overwrite = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        with self._lock, self._conn:
+            self._conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _trim_history(self, thread_id: str, checkpoint_ns: str) -> None:
+        """
+        Drops all but the newest `max_history` checkpoints of a thread, along with their
+        pending writes and any channel value no remaining checkpoint refers to.
+        Must be called with the lock held, inside a transaction.
+        """
+        rows = self._conn.execute(
+            "SELECT checkpoint_id, type, checkpoint FROM checkpoints"
+            " WHERE thread_id = ? AND checkpoint_ns = ?"
+            " ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_history - 1),
+        ).fetchall()
+        if not rows:
+            return
+        oldest_id, type_, data = rows[0]
+        key = (thread_id, checkpoint_ns, oldest_id)
+        self._conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", key
+        )
+        self._conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", key
+        )
+        # Versions only grow, so anything older than what the oldest kept checkpoint
+        # points at is unreachable.
+        oldest_versions = self._load(type_, data)["channel_versions"]
+        self._conn.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version < ?",
+            [(thread_id, checkpoint_ns, channel, str(version)) for channel, version in oldest_versions.items()],
+        )
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock, self._conn:
+            self._delete_threads([thread_id])
+
+    def _delete_threads(self, thread_ids: List[str]) -> None:
+        params = [(thread_id,) for thread_id in thread_ids]
+        for table in ("checkpoints", "blobs", "writes", "threads"):
+            self._conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", params)
+
+    def evict_expired(self) -> int:
+        """
+        Deletes threads whose last checkpoint is older than their TTL. Returns how many were removed.
+        """
+        now = time.time()
+        self._last_eviction = now
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT thread_id FROM threads"
+                " WHERE (finished = 1 AND ? > 0 AND updated_at < ?)"
+                " OR (finished = 0 AND ? > 0 AND updated_at < ?)",
+                (self.ttl, now - self.ttl, self.idle_ttl, now - self.idle_ttl),
+            ).fetchall()
+            expired = [row[0] for row in rows]
+            if expired:
+                self._delete_threads(expired)
+        if expired:
+            print(f"Evicted {len(expired)} expired checkpoint thread(s)")
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("threads", "checkpoints", "blobs", "writes")
+            }
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Zero-padded string versions sort correctly in SQL, which `_trim_history` relies on.
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # Async variants: SQLite calls are short, so they run on a worker thread.
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        results = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in results:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def make_checkpointer():
+    """
+    Returns the checkpointer selected by WALLY_CHECKPOINTER: "sqlite" (default),
+    which persists threads to WALLY_CHECKPOINT_PATH, or "memory".
+    """
+    if CHECKPOINTER == "memory":
+        return InMemorySaver()
+    return SQLiteCheckpointSaver(CHECKPOINT_PATH or ":memory:")
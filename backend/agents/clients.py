@@ -0,0 +1,124 @@
+import threading
+from typing import Any, Dict, Optional
+
+from agents.config import (
+    CLIENT_MODE,
+    FAKE_CLIENT_LATENCY,
+    FAKE_PROVIDER_URL,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    LLM_TIMEOUT,
+    LLM_TRANSPORT,
+    SEARCH_MAX_RESULTS,
+    LLM_RPM,
+    LLM_TPM,
+    SEARCH_RPM,
+)
+from agents.ratelimit import ProviderLimiter, RateLimitedClient
+from agents.tracing import traced_client
+
+_lock = threading.Lock()
+_llm: Optional[Any] = None
+_search: Optional[Any] = None
+
+# Shared by every caller of the built-in clients, so the limits hold across concurrent runs.
+llm_limiter = ProviderLimiter("llm", LLM_RPM, LLM_TPM)
+search_limiter = ProviderLimiter("search", SEARCH_RPM)
+
+
+def _build_llm() -> Any:
+    if CLIENT_MODE == "fake":
+        from agents.fakes import FakeChatModel, HttpChatModel
+        if FAKE_PROVIDER_URL:
+            return HttpChatModel(FAKE_PROVIDER_URL)
+        return FakeChatModel(latency=FAKE_CLIENT_LATENCY)
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # Retries are left to the limiter wrapping the model (WALLY_PROVIDER_RETRIES), so every
+    # attempt goes through its token bucket and circuit breaker.
+    params = {"model": LLM_MODEL, "max_retries": 0}
+    if LLM_TEMPERATURE >= 0:
+        params["temperature"] = LLM_TEMPERATURE
+    if LLM_TIMEOUT > 0:
+        params["timeout"] = LLM_TIMEOUT
+    if LLM_TRANSPORT:
+        params["transport"] = LLM_TRANSPORT
+    return ChatGoogleGenerativeAI(**params)
+
+
+def _build_search() -> Any:
+    if CLIENT_MODE == "fake":
+        from agents.fakes import FakeSearch, HttpSearch
+        if FAKE_PROVIDER_URL:
+            return HttpSearch(FAKE_PROVIDER_URL)
+        return FakeSearch(latency=FAKE_CLIENT_LATENCY)
+
+    from agents.tavily_pool import PooledTavilySearch
+
+    return PooledTavilySearch(max_results=SEARCH_MAX_RESULTS)
+
+
+def get_llm() -> Any:
+    """
+    Returns the process-wide chat model, building it on first use.
+    Set WALLY_CLIENT_MODE=fake to get an offline stand-in instead of Gemini.
+    """
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                _llm = traced_client(RateLimitedClient(_build_llm(), llm_limiter), "llm")
+    return _llm
+
+
+def get_search() -> Any:
+    """
+    Returns the process-wide web search client, building it on first use.
+    Calls to it and to `get_llm` go through the process-wide `search_limiter` and
+    `llm_limiter`, which rate-limit, retry and circuit-break them.
+    """
+    global _search
+    if _search is None:
+        with _lock:
+            if _search is None:
+                _search = traced_client(RateLimitedClient(_build_search(), search_limiter), "search")
+    return _search
+
+
+def set_clients(llm: Optional[Any] = None, search: Optional[Any] = None) -> None:
+    """
+    Replaces the shared clients, e.g. with fakes for tests or load runs.
+    """
+    global _llm, _search
+    with _lock:
+        if llm is not None:
+            _llm = traced_client(llm, "llm")
+        if search is not None:
+            _search = traced_client(search, "search")
+
+
+def reset_clients() -> None:
+    """
+    Drops the shared clients so the next call rebuilds them from configuration.
+    """
+    global _llm, _search
+    with _lock:
+        _llm = None
+        _search = None
+
+
+async def aclose_clients() -> None:
+    """
+    Releases connections the shared search client holds on the running event loop.
+    """
+    close = getattr(_search, "aclose", None)
+    if close is not None:
+        await close()
+
+
+def provider_stats() -> Dict[str, Any]:
+    """
+    Returns rate-limit, retry and circuit state for the LLM and search providers.
+    """
+    return {"llm": llm_limiter.stats(), "search": search_limiter.stats()}
@@ -0,0 +1,135 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _get_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Invalid integer for {name}: {value!r}, using {default}")
+        return default
+
+
+def _get_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Invalid number for {name}: {value!r}, using {default}")
+        return default
+
+
+# Per-user data directory for the cache, catalog, category index and checkpoints, so
+# running from another directory neither loses state nor picks up someone else's.
+DATA_DIR = os.path.expanduser(
+    os.getenv("WALLY_DATA_DIR") or os.path.join(os.getenv("XDG_CACHE_HOME") or "~/.cache", "wally")
+)
+
+# ProductSearchAgent settings
+PRODUCT_SEARCH_MAX_CONCURRENCY = max(1, _get_int("WALLY_PRODUCT_SEARCH_MAX_CONCURRENCY", 8))
+PRODUCT_SEARCH_ITEM_TIMEOUT = _get_float("WALLY_PRODUCT_SEARCH_ITEM_TIMEOUT", 60.0)
+
+# BudgetOptimizerAgent settings
+BUDGET_OPTIMIZER_MODE = os.getenv("WALLY_BUDGET_OPTIMIZER_MODE", "solver").strip().lower()  # "solver" or "llm"
+BUDGET_OPTIMIZER_PRICE_WEIGHT = _get_float("WALLY_BUDGET_OPTIMIZER_PRICE_WEIGHT", 0.5)
+BUDGET_OPTIMIZER_RATING_WEIGHT = _get_float("WALLY_BUDGET_OPTIMIZER_RATING_WEIGHT", 0.5)
+BUDGET_OPTIMIZER_MAX_DP_CELLS = max(100, _get_int("WALLY_BUDGET_OPTIMIZER_MAX_DP_CELLS", 20000))
+BUDGET_OPTIMIZER_MAX_DP_ITEMS = _get_int("WALLY_BUDGET_OPTIMIZER_MAX_DP_ITEMS", 60)
+
+# Cache settings
+CACHE_BACKEND = os.getenv("WALLY_CACHE_BACKEND", "memory").strip().lower()  # "memory" or "sqlite"
+CACHE_PATH = os.path.expanduser(os.getenv("WALLY_CACHE_PATH", os.path.join(DATA_DIR, "cache.sqlite")))
+SEARCH_CACHE_TTL = _get_float("WALLY_SEARCH_CACHE_TTL", 6 * 60 * 60)
+SEARCH_CACHE_MAX_ENTRIES = _get_int("WALLY_SEARCH_CACHE_MAX_ENTRIES", 5000)
+EXTRACTION_CACHE_TTL = _get_float("WALLY_EXTRACTION_CACHE_TTL", 6 * 60 * 60)
+EXTRACTION_CACHE_MAX_ENTRIES = _get_int("WALLY_EXTRACTION_CACHE_MAX_ENTRIES", 5000)
+
+# Product catalog settings
+CATALOG_ENABLED = os.getenv("WALLY_CATALOG_ENABLED", "true").strip().lower() not in ("0", "false", "no")
+CATALOG_PATH = os.path.expanduser(os.getenv("WALLY_CATALOG_PATH", os.path.join(DATA_DIR, "catalog.sqlite")))  # empty keeps it in memory
+CATALOG_MAX_AGE = _get_float("WALLY_CATALOG_MAX_AGE", 24 * 60 * 60)  # older options are searched again
+CATALOG_REFRESH_INTERVAL = _get_float("WALLY_CATALOG_REFRESH_INTERVAL", 30 * 60)  # 0 disables background refresh
+CATALOG_REFRESH_ITEMS = max(1, _get_int("WALLY_CATALOG_REFRESH_ITEMS", 50))  # hottest items refreshed per round
+CATALOG_REFRESH_AHEAD = _get_float("WALLY_CATALOG_REFRESH_AHEAD", 0.75)  # refresh after this fraction of max age
+
+# Product extraction settings
+EXTRACTION_MODE = os.getenv("WALLY_EXTRACTION_MODE", "batched").strip().lower()  # "batched" or "per_item"
+EXTRACTION_BATCH_TOKENS = _get_int("WALLY_EXTRACTION_BATCH_TOKENS", 60000)
+EXTRACTION_BATCH_MAX_ITEMS = max(1, _get_int("WALLY_EXTRACTION_BATCH_MAX_ITEMS", 10))
+
+# Search-result compaction settings
+COMPACTION_ENABLED = os.getenv("WALLY_COMPACTION_ENABLED", "true").strip().lower() not in ("0", "false", "no")
+COMPACTION_TOKEN_BUDGET = _get_int("WALLY_COMPACTION_TOKEN_BUDGET", 1500)
+COMPACTION_SNIPPET_CHARS = _get_int("WALLY_COMPACTION_SNIPPET_CHARS", 400)
+COMPACTION_DIRECT_MIN_OPTIONS = _get_int("WALLY_COMPACTION_DIRECT_MIN_OPTIONS", 3)
+
+# Client settings
+CLIENT_MODE = os.getenv("WALLY_CLIENT_MODE", "live").strip().lower()  # "live" or "fake"
+FAKE_CLIENT_LATENCY = _get_float("WALLY_FAKE_CLIENT_LATENCY", 0.0)
+FAKE_PROVIDER_URL = os.getenv("WALLY_FAKE_PROVIDER_URL", "").strip()  # fake mode calls this FakeProviderServer
+LLM_MODEL = os.getenv("WALLY_LLM_MODEL", "gemini-2.0-flash")
+LLM_TEMPERATURE = _get_float("WALLY_LLM_TEMPERATURE", -1.0)  # negative keeps the model default
+LLM_TIMEOUT = _get_float("WALLY_LLM_TIMEOUT", 0.0)  # 0 keeps the client default
+LLM_TRANSPORT = os.getenv("WALLY_LLM_TRANSPORT") or None  # "rest", "grpc" or "grpc_asyncio"
+SEARCH_MAX_RESULTS = _get_int("WALLY_SEARCH_MAX_RESULTS", 50)
+SEARCH_POOL_SIZE = max(1, _get_int("WALLY_SEARCH_POOL_SIZE", 16))
+SEARCH_TIMEOUT = _get_float("WALLY_SEARCH_TIMEOUT", 30.0)
+
+# Provider rate-limit settings (shared by every caller in the process)
+LLM_RPM = _get_float("WALLY_LLM_RPM", 0.0)  # requests per minute; 0 is unlimited until the provider pushes back
+LLM_TPM = _get_float("WALLY_LLM_TPM", 0.0)  # estimated tokens per minute; 0 is unlimited
+SEARCH_RPM = _get_float("WALLY_SEARCH_RPM", 0.0)
+PROVIDER_RETRIES = max(0, _get_int("WALLY_PROVIDER_RETRIES", 4))  # for 429, 5xx, timeouts and connection errors
+PROVIDER_BACKOFF = _get_float("WALLY_PROVIDER_BACKOFF", 0.5)  # longest first retry wait, doubled for each after
+PROVIDER_MAX_BACKOFF = _get_float("WALLY_PROVIDER_MAX_BACKOFF", 30.0)
+PROVIDER_RESERVE = min(0.9, max(0.0, _get_float("WALLY_PROVIDER_RESERVE", 0.2)))  # share of each limit left free for interactive calls
+CIRCUIT_FAILURES = max(1, _get_int("WALLY_CIRCUIT_FAILURES", 5))  # consecutive failures that open a provider's circuit
+CIRCUIT_COOLDOWN = _get_float("WALLY_CIRCUIT_COOLDOWN", 30.0)  # seconds calls fail fast before one is let through
+
+# Planner settings
+PLANNER_MODE = os.getenv("WALLY_PLANNER_MODE", "staged").strip().lower()  # "staged" or "fused"
+
+# Category index settings
+CATEGORY_INDEX_ENABLED = os.getenv("WALLY_CATEGORY_INDEX_ENABLED", "true").strip().lower() not in ("0", "false", "no")
+CATEGORY_INDEX_PATH = os.path.expanduser(os.getenv("WALLY_CATEGORY_INDEX_PATH", os.path.join(DATA_DIR, "categories.json")))  # empty keeps learned entries in memory
+CATEGORY_INDEX_FUZZY_THRESHOLD = _get_float("WALLY_CATEGORY_INDEX_FUZZY_THRESHOLD", 0.7)
+
+# Checkpointer settings
+CHECKPOINTER = os.getenv("WALLY_CHECKPOINTER", "sqlite").strip().lower()  # "sqlite" or "memory"
+CHECKPOINT_PATH = os.path.expanduser(os.getenv("WALLY_CHECKPOINT_PATH", os.path.join(DATA_DIR, "checkpoints.sqlite")))  # empty keeps checkpoints in memory
+CHECKPOINT_TTL = _get_float("WALLY_CHECKPOINT_TTL", 24 * 60 * 60)  # finished threads; 0 keeps them forever
+CHECKPOINT_IDLE_TTL = _get_float("WALLY_CHECKPOINT_IDLE_TTL", 7 * 24 * 60 * 60)  # threads still waiting for input
+CHECKPOINT_HISTORY = _get_int("WALLY_CHECKPOINT_HISTORY", 20)
+CHECKPOINT_COMPRESS_BYTES = _get_int("WALLY_CHECKPOINT_COMPRESS_BYTES", 1024)  # 0 disables compression
+
+# HTTP server settings
+SERVER_HOST = os.getenv("WALLY_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = _get_int("WALLY_SERVER_PORT", 8000)
+SERVER_MAX_CONCURRENT_RUNS = max(1, _get_int("WALLY_SERVER_MAX_CONCURRENT_RUNS", 64))
+SERVER_WAIT_TIMEOUT = _get_float("WALLY_SERVER_WAIT_TIMEOUT", 120.0)  # for ?wait=true
+BATCH_WINDOW_MS = _get_float("WALLY_BATCH_WINDOW_MS", 5.0)
+BATCH_MAX_SIZE = _get_int("WALLY_BATCH_MAX_SIZE", 16)
+
+# Batch mode settings
+BATCH_MAX_CARTS = max(1, _get_int("WALLY_BATCH_MAX_CARTS", 16))  # carts in flight at once
+
+# Tracing settings
+TRACE_LOG = os.getenv("WALLY_TRACE_LOG", "").strip()  # "stderr", "stdout" or a file path; empty disables
+OTLP_ENDPOINT = os.getenv("WALLY_OTLP_ENDPOINT", "").strip()  # e.g. http://localhost:4318/v1/traces
+OTLP_FLUSH_INTERVAL = _get_float("WALLY_OTLP_FLUSH_INTERVAL", 2.0)
+
+# Speculative prefetch settings
+PREFETCH_ENABLED = os.getenv("WALLY_PREFETCH_ENABLED", "true").strip().lower() not in ("0", "false", "no")
+PREFETCH_MAX_SESSIONS = max(1, _get_int("WALLY_PREFETCH_MAX_SESSIONS", 256))
+
+# Structured-output parsing settings
+PARSE_RETRIES = max(0, _get_int("WALLY_PARSE_RETRIES", 2))  # extra LLM calls for a reply that fails validation
+PARSE_BACKOFF = _get_float("WALLY_PARSE_BACKOFF", 0.25)  # seconds before the first retry, doubled for each after
+PARSE_MAX_BACKOFF = _get_float("WALLY_PARSE_MAX_BACKOFF", 4.0)
@@ -0,0 +1,491 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage
+
+# Ingredients returned for a few common dishes; other dishes get generic ingredients.
+DISH_INGREDIENTS = {
+    "pasta": ["spaghetti", "tomato sauce", "ground beef", "onion", "garlic", "parmesan cheese"],
+    "spaghetti": ["spaghetti", "tomato sauce", "ground beef", "onion", "garlic", "parmesan cheese"],
+    "tacos": ["taco shells", "ground beef", "lettuce", "tomatoes", "shredded cheese", "sour cream", "salsa"],
+    "pancakes": ["flour", "eggs", "milk", "butter", "maple syrup", "baking powder"],
+    "salad": ["lettuce", "tomatoes", "cucumber", "croutons", "salad dressing"],
+    "curry": ["chicken breast", "coconut milk", "curry paste", "onion", "rice", "cilantro"],
+}
+
+GOAL_WORDS = ("make", "cook", "bake", "prepare", "recipe", "dinner", "lunch", "breakfast", "party")
+BRANDS = ["Great Value", "Marketside", "Freshness Guaranteed", "Kraft", "Barilla", "Hunt's", "Prego"]
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _delay(latency: float, jitter: float) -> float:
+    """
+    Returns `latency` spread uniformly by +/- `jitter` (a fraction of it).
+    """
+    if jitter <= 0:
+        return latency
+    return max(0.0, latency * random.uniform(1 - jitter, 1 + jitter))
+
+
+def _prompt_text(messages) -> str:
+    # A retry conversation is answered as its original prompt.
+    return messages[0]["content"] if isinstance(messages[0], dict) else messages[0].content
+
+
+def malform(content: str) -> str:
+    """
+    Breaks a JSON reply the way models sometimes do: wrapped in prose, with a trailing
+    comma, cut off part-way, or replaced by a refusal.
+    """
+    raw = content.replace("```json", "").replace("```", "").strip()
+    kind = random.choice(("prose", "trailing_comma", "truncated", "refusal"))
+    if kind == "prose":
+        return f"Sure! Here is the JSON you asked for:\n{raw}\nLet me know if you need anything else."
+    if kind == "trailing_comma":
+        return raw[:-1] + "," + raw[-1:]
+    if kind == "truncated":
+        return raw[:max(1, int(len(raw) * 0.7))]
+    return "I'm sorry, I can't help with that request."
+
+
+def fake_options(item: str, category: str, count: int = 5) -> List[Dict[str, Any]]:
+    """
+    Deterministic product options for an item, so repeated runs see the same catalog.
+    """
+    seed = _seed(item.lower())
+    options = []
+    for i in range(count):
+        value = (seed >> (i * 3)) % 1000
+        options.append({
+            "name": f"{BRANDS[(seed + i) % len(BRANDS)]} {item.title()} {i + 1}",
+            "price": round(1.0 + value / 100, 2),
+            "rating": round(3.0 + ((seed >> i) % 21) / 10, 1),
+            "brand": BRANDS[(seed + i) % len(BRANDS)],
+            "category": category,
+            "description": f"{item} option {i + 1}",
+        })
+    return options
+
+
+class FakeChatModel:
+    """
+    Offline stand-in for ChatGoogleGenerativeAI. Recognizes each agent's prompt and
+    answers in the format that agent expects, after `latency` seconds (+/- `jitter`).
+    A `malformed` fraction of replies are broken to exercise parsing and retries.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, malformed: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.malformed = malformed
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, messages) -> AIMessage:
+        prompt = _prompt_text(messages)
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+        content = "```json\n" + json.dumps(self.answer(prompt)) + "\n```"
+        if self.malformed and random.random() < self.malformed:
+            content = malform(content)
+        return AIMessage(content=content)
+
+    def invoke(self, messages, *args, **kwargs) -> AIMessage:
+        if self.latency:
+            time.sleep(_delay(self.latency, self.jitter))
+        return self._respond(messages)
+
+    async def ainvoke(self, messages, *args, **kwargs) -> AIMessage:
+        if self.latency:
+            await asyncio.sleep(_delay(self.latency, self.jitter))
+        return self._respond(messages)
+
+    def answer(self, prompt: str) -> Any:
+        if "User input:" in prompt and "expanded_items" in prompt:
+            return self._plan(prompt.rsplit("User input:", 1)[1].strip())
+        if "User input:" in prompt and "task_type" in prompt:
+            return self._interpret(prompt.rsplit("User input:", 1)[1].strip())
+        if "Goal or dish:" in prompt:
+            goal = prompt.split("Goal or dish:", 1)[1].split("\n", 1)[0].strip().lower()
+            return self._expand(goal)
+        if "map each to the most relevant Walmart.com category" in prompt:
+            return {item: "Grocery" for item in self._listed_items(prompt)}
+        if "keys are exactly these item names:" in prompt:
+            names = json.loads(prompt.split("keys are exactly these item names:", 1)[1].split("\n", 1)[0])
+            return {name: fake_options(name, "Grocery") for name in names}
+        match = re.search(r'search results about "([^"]+)"', prompt)
+        if match:
+            return fake_options(match.group(1), "Grocery")
+        return []
+
+    @staticmethod
+    def _listed_items(prompt: str) -> List[str]:
+        match = re.search(r"Items: (\[.*\])", prompt, re.DOTALL)
+        if not match:
+            return []
+        return [a or b for a, b in re.findall(r"'([^']*)'|\"([^\"]*)\"", match.group(1))]
+
+    @staticmethod
+    def _interpret(user_input: str) -> Dict[str, Any]:
+        budget_match = re.search(r"\$\s?(\d+(?:\.\d+)?)", user_input)
+        budget = float(budget_match.group(1)) if budget_match else None
+        text = re.sub(r"((for|under|within|below)\s+)*\$\s?\d+(?:\.\d+)?", "", user_input).strip(" .")
+        lowered = text.lower()
+        if any(word in lowered for word in GOAL_WORDS):
+            dish = next((d for d in DISH_INGREDIENTS if d in lowered), lowered)
+            return {"task_type": "goal_or_dish", "item_list": [dish], "budget": budget}
+        text = re.sub(r"^(i need|get me|buy|i want)\s+", "", text, flags=re.IGNORECASE)
+        items = [part.strip() for part in re.split(r",|\band\b", text) if part.strip()]
+        return {"task_type": "direct_product_list", "item_list": items, "budget": budget}
+
+    @classmethod
+    def _plan(cls, user_input: str) -> Dict[str, Any]:
+        plan = cls._interpret(user_input)
+        expanded = cls._expand(plan["item_list"][0]) if plan["task_type"] == "goal_or_dish" else []
+        plan["expanded_items"] = expanded
+        plan["categories"] = {item: "Grocery" for item in expanded or plan["item_list"]}
+        return plan
+
+    @staticmethod
+    def _expand(goal: str) -> List[str]:
+        for dish, ingredients in DISH_INGREDIENTS.items():
+            if dish in goal:
+                return ingredients
+        return [f"{goal} base", f"{goal} seasoning", f"{goal} topping"]
+
+
+class FakeSearch:
+    """
+    Offline stand-in for TavilySearch returning walmart.com-shaped results after `latency` seconds
+    (+/- `jitter`).
+    """
+
+    def __init__(self, latency: float = 0.0, max_results: int = 10, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_results = max_results
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _results(self, query: str) -> Dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+        item = query.split(" site:")[0]
+        results = []
+        for i, option in enumerate(fake_options(item, "Grocery", count=min(self.max_results, 8))):
+            slug = option["name"].replace(" ", "-")
+            results.append({
+                "url": f"https://www.walmart.com/ip/{slug}/{_seed(slug) % 10**8}",
+                "title": f"{option['name']} - Walmart.com",
+                "content": f"{option['description']}. Now ${option['price']:.2f}. "
+                           f"{option['rating']} out of 5 stars.",
+                "score": round(1.0 - i * 0.05, 2),
+            })
+        return {"query": query, "results": results}
+
+    def invoke(self, query: str, *args, **kwargs) -> Dict[str, Any]:
+        if self.latency:
+            time.sleep(_delay(self.latency, self.jitter))
+        return self._results(query)
+
+    async def ainvoke(self, query: str, *args, **kwargs) -> Dict[str, Any]:
+        if self.latency:
+            await asyncio.sleep(_delay(self.latency, self.jitter))
+        return self._results(query)
+
+
+class _ProviderHTTPServer(ThreadingHTTPServer):
+    # A load test opens many connections at once; the default backlog of 5 would stall
+    # the rest in TCP retransmits.
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class FakeProviderServer:
+    """
+    Local HTTP stand-in for the Gemini and Tavily APIs, for exercising rate limits,
+    retries and circuit breaking. POST /llm with {"prompt": ...} answers like
+    `FakeChatModel`, and POST /search with {"query": ...} like `FakeSearch`, each after
+    its latency. Each path allows `rpm` requests per `window` seconds (0 is unlimited)
+    and answers 429 with a Retry-After beyond that; an `error_rate` fraction of requests,
+    or every request while `down` is set, get a 503 instead.
+    """
+
+    def __init__(self, rpm: int = 0, window: float = 60.0, error_rate: float = 0.0, llm_latency: float = 0.0,
+                 search_latency: float = 0.0, jitter: float = 0.0, port: int = 0):
+        self.rpm = rpm
+        self.window = window
+        self.error_rate = error_rate
+        self.down = False
+        self.latency = {"/llm": llm_latency, "/search": search_latency}
+        self.jitter = jitter
+        self.counts = {path: {"ok": 0, "throttled": 0, "errors": 0} for path in self.latency}
+        self._model = FakeChatModel()
+        self._search = FakeSearch()
+        self._served: Dict[str, deque] = {path: deque() for path in self.latency}
+        self._lock = threading.Lock()
+        self._server = _ProviderHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FakeProviderServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-provider", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self, path: str) -> Optional[float]:
+        """
+        Counts a request against the quota. Returns None if it may be served, or the
+        seconds until it could have been.
+        """
+        with self._lock:
+            now = time.monotonic()
+            served = self._served[path]
+            while served and served[0] <= now - self.window:
+                served.popleft()
+            if self.rpm and len(served) >= self.rpm:
+                self.counts[path]["throttled"] += 1
+                return served[0] + self.window - now
+            served.append(now)
+            return None
+
+    def _answer(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        if path == "/llm":
+            return {"content": self._model._respond([{"content": body.get("prompt", "")}]).content}
+        return self._search._results(str(body.get("query", "")))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                path = self.path.split("?", 1)[0]
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if path not in server.latency:
+                    self._send(404, {"detail": {"error": "not found"}})
+                    return
+                if server.down or (server.error_rate and random.random() < server.error_rate):
+                    with server._lock:
+                        server.counts[path]["errors"] += 1
+                    self._send(503, {"detail": {"error": "service unavailable"}})
+                    return
+                wait = server._admit(path)
+                if wait is not None:
+                    self._send(429, {"detail": {"error": "rate limit exceeded"}},
+                               {"Retry-After": f"{max(wait, 0.0):.2f}"})
+                    return
+                if server.latency[path]:
+                    time.sleep(_delay(server.latency[path], server.jitter))
+                with server._lock:
+                    server.counts[path]["ok"] += 1
+                self._send(200, server._answer(path, body))
+
+        return Handler
+
+
+# requests and aiohttp are only needed against a fake provider server, so they are
+# imported on first use rather than with the fakes.
+def _http_session():
+    import requests
+
+    return requests.Session()
+
+
+def _aio_session(timeout: float):
+    import aiohttp
+
+    return aiohttp.ClientSession(raise_for_status=True, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+class HttpChatModel:
+    """
+    Chat model that calls a `FakeProviderServer` over HTTP, raising the HTTP errors
+    requests and aiohttp raise for a real API.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/") + "/llm"
+        self.timeout = timeout
+        self._session = _http_session()
+
+    def invoke(self, messages, *args, **kwargs) -> AIMessage:
+        response = self._session.post(self.url, json={"prompt": _prompt_text(messages)}, timeout=self.timeout)
+        response.raise_for_status()
+        return AIMessage(content=response.json()["content"])
+
+    async def ainvoke(self, messages, *args, **kwargs) -> AIMessage:
+        async with _aio_session(self.timeout) as session:
+            async with session.post(self.url, json={"prompt": _prompt_text(messages)}) as response:
+                return AIMessage(content=(await response.json())["content"])
+
+
+class HttpSearch:
+    """
+    Search client that calls a `FakeProviderServer` over HTTP, like `HttpChatModel`.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/") + "/search"
+        self.timeout = timeout
+        self._session = _http_session()
+
+    def invoke(self, query, *args, **kwargs) -> Dict[str, Any]:
+        response = self._session.post(self.url, json={"query": str(query)}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def ainvoke(self, query, *args, **kwargs) -> Dict[str, Any]:
+        async with _aio_session(self.timeout) as session:
+            async with session.post(self.url, json={"query": str(query)}) as response:
+                return await response.json()
+
+
+class Fixtures:
+    """
+    Recorded LLM responses and search results, keyed by a hash of the prompt or query
+    and stored as one JSON file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Dict[str, Dict[str, Any]] = {"llm": {}, "search": {}}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data.update(json.load(f))
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, text: str) -> Any:
+        return self._data[kind].get(self.key(text))
+
+    def put(self, kind: str, text: str, value: Any) -> None:
+        with self._lock:
+            self._data[kind][self.key(text)] = value
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._data.values())
+
+
+class RecordingChatModel:
+    """
+    Passes calls through to a real chat model and records each response into `fixtures`.
+    """
+
+    def __init__(self, llm: Any, fixtures: Fixtures):
+        self.llm = llm
+        self.fixtures = fixtures
+
+    def invoke(self, messages, *args, **kwargs):
+        response = self.llm.invoke(messages, *args, **kwargs)
+        self.fixtures.put("llm", _prompt_text(messages), response.content)
+        return response
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        response = await self.llm.ainvoke(messages, *args, **kwargs)
+        self.fixtures.put("llm", _prompt_text(messages), response.content)
+        return response
+
+
+class RecordingSearch:
+    """
+    Passes queries through to a real search client and records each result into `fixtures`.
+    """
+
+    def __init__(self, search: Any, fixtures: Fixtures):
+        self.search = search
+        self.fixtures = fixtures
+
+    def invoke(self, query, *args, **kwargs):
+        results = self.search.invoke(query, *args, **kwargs)
+        self.fixtures.put("search", str(query), results)
+        return results
+
+    async def ainvoke(self, query, *args, **kwargs):
+        results = await self.search.ainvoke(query, *args, **kwargs)
+        self.fixtures.put("search", str(query), results)
+        return results
+
+
+class ReplayChatModel(FakeChatModel):
+    """
+    Answers from recorded fixtures, falling back to the synthetic answers for unseen prompts.
+    """
+
+    def __init__(self, fixtures: Fixtures, latency: float = 0.0, jitter: float = 0.0):
+        super().__init__(latency=latency, jitter=jitter)
+        self.fixtures = fixtures
+        self.replayed = 0
+
+    def _respond(self, messages) -> AIMessage:
+        content = self.fixtures.get("llm", _prompt_text(messages))
+        if content is None:
+            return super()._respond(messages)
+        with self._lock:
+            self.calls += 1
+            self.replayed += 1
+            self.prompt_chars += len(_prompt_text(messages))
+        return AIMessage(content=content)
+
+
+class ReplaySearch(FakeSearch):
+    """
+    Returns recorded search results, falling back to synthetic ones for unseen queries.
+    """
+
+    def __init__(self, fixtures: Fixtures, latency: float = 0.0, jitter: float = 0.0):
+        super().__init__(latency=latency, jitter=jitter)
+        self.fixtures = fixtures
+        self.replayed = 0
+
+    def _results(self, query: str) -> Dict[str, Any]:
+        results = self.fixtures.get("search", str(query))
+        if results is None:
+            return super()._results(query)
+        with self._lock:
+            self.calls += 1
+            self.replayed += 1
+        return results
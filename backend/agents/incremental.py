@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from agents.tracing import record_event
+from agents.products import ItemOptions, as_item_options
+
+
+def input_hash(*parts: Any) -> str:
+    """
+    Content hash of a node's inputs, stable across runs and processes.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def merge_hashes(left: Optional[Dict[str, str]], right: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """
+    State reducer for `input_hashes`: each node only replaces its own entry, and an
+    empty update (see `new_request`) clears them all.
+    """
+    if right is not None and not right:
+        return {}
+    return {**(left or {}), **(right or {})}
+
+
+def new_request() -> Dict[str, Any]:
+    """
+    The state update that starts a new request on a thread: results left by the
+    previous request are cleared, so none of them is reused for the new one.
+    """
+    return {
+        "expanded_items": [],
+        "categories": {},
+        "products": None,
+        "optimized_products": None,
+        "input_hashes": {},
+    }
+
+
+def unchanged(state: Dict[str, Any], node: str, digest: str, output: str) -> bool:
+    """
+    True when `node` already ran on inputs hashing to `digest` and its `output` is still
+    in the state, so running it again would produce the same update.
+    """
+    if (state.get("input_hashes") or {}).get(node) != digest or state.get(output) is None:
+        return False
+    record_event("node_skips")
+    return True
+
+
+def reuse_products(state: Dict[str, Any], pairs: List[Tuple[str, str]]) -> Dict[str, ItemOptions]:
+    """
+    Options already in the state's `products` for the same item and category.
+    """
+    wanted = set(pairs)
+    reused = {
+        product.item: product
+        for product in as_item_options(state.get("products"))
+        if (product.item, product.category) in wanted and len(product)
+    }
+    record_event("products_reused", len(reused))
+    return reused
+
+
+def _edited_list(current: List[str], items: Optional[List[str]], add: Optional[List[str]],
+                 remove: Optional[List[str]]) -> List[str]:
+    if items is not None:
+        return list(dict.fromkeys(items))
+    removed = set(remove or [])
+    kept = [item for item in current if item not in removed]
+    return list(dict.fromkeys(kept + [item for item in add or [] if item not in removed]))
+
+
+def plan_update(values: Dict[str, Any], items: Optional[List[str]] = None, add: Optional[List[str]] = None,
+                remove: Optional[List[str]] = None, budget: Optional[float] = None) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    Works out the state update for a cart edit on a finished thread and the node to
+    apply it as: "Human_review" when the list changed, so only new items are categorized
+    and searched, or "product_search_agent" when only the budget changed, so only the
+    budget optimizer runs again. Returns None when nothing would change.
+    """
+    if values.get("products") is None:
+        raise ValueError("thread has no products to update; run a request first")
+
+    review_key = "expanded_items" if values.get("expanded_items") else "item_list"
+    current = list(values.get(review_key) or [])
+    new_list = _edited_list(current, items, add, remove)
+    update: Dict[str, Any] = {}
+    if budget is not None and budget != values.get("budget"):
+        update["budget"] = float(budget)
+
+    if new_list != current:
+        categories = values.get("categories") or {}
+        update[review_key] = new_list
+        update["categories"] = {item: categories[item] for item in new_list if item in categories}
+        return update, "Human_review"
+    if update:
+        return update, "product_search_agent"
+    return None
+
+
+def _update_span(started: float) -> Dict[str, Any]:
+    # Starts a fresh trace for the update, like an entry node does for a new request.
+    return {"node": "cart_update", "trace_id": uuid.uuid4().hex,
+            "ms": round((time.perf_counter() - started) * 1000, 1), "entry": True}
+
+
+def _check_idle(snapshot) -> None:
+    if snapshot.next:
+        raise ValueError(f"thread is not finished (waiting at {list(snapshot.next)})")
+
+
+def update_cart(graph, thread_id: str, items: Optional[List[str]] = None, add: Optional[List[str]] = None,
+                remove: Optional[List[str]] = None, budget: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Applies a cart edit to a finished thread and re-runs only what it affects: categories
+    and products for added items, then the budget optimizer. `items` replaces the list
+    outright; otherwise `add` and `remove` edit it. Returns the thread's new state values.
+    """
+    started = time.perf_counter()
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = graph.get_state(config)
+    _check_idle(snapshot)
+    plan = plan_update(snapshot.values or {}, items, add, remove, budget)
+    if plan is None:
+        return snapshot.values
+    update, as_node = plan
+    update["trace"] = [_update_span(started)]
+    graph.update_state(config, update, as_node=as_node)
+    graph.invoke(None, config=config)
+    return graph.get_state(config).values
+
+
+async def aupdate_cart(graph, thread_id: str, items: Optional[List[str]] = None, add: Optional[List[str]] = None,
+                       remove: Optional[List[str]] = None, budget: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Async variant of `update_cart`.
+    """
+    started = time.perf_counter()
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = await graph.aget_state(config)
+    _check_idle(snapshot)
+    plan = plan_update(snapshot.values or {}, items, add, remove, budget)
+    if plan is None:
+        return snapshot.values
+    update, as_node = plan
+    update["trace"] = [_update_span(started)]
+    await graph.aupdate_state(config, update, as_node=as_node)
+    await graph.ainvoke(None, config=config)
+    return (await graph.aget_state(config)).values
+
+
+_BUDGET_PATTERN = re.compile(r"^(?:now\s+)?(?:make\s+it\s+)?(?:under|budget|below)\s*\$?\s*(\d+(?:\.\d+)?)\s*$", re.I)
+_EDIT_PATTERN = re.compile(r"^(add|remove|drop)\s+(.+)$", re.I)
+
+
+def parse_update(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Recognizes quick tweaks such as "under $30", "add eggs, milk" or "remove bread".
+    Returns `update_cart` keyword arguments, or None if `text` is a new request.
+    """
+    text = text.strip()
+    match = _BUDGET_PATTERN.match(text)
+    if match:
+        return {"budget": float(match.group(1))}
+    match = _EDIT_PATTERN.match(text)
+    if match:
+        names = [name.strip() for name in re.split(r",|\band\b", match.group(2)) if name.strip()]
+        if names:
+            return {"add" if match.group(1).lower() == "add" else "remove": names}
+    return None
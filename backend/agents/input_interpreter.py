@@ -1,18 +1,13 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.clients import get_llm
+from agents.incremental import new_request
 from agents.states import InputInterpreterInputState
-from typing import Literal, Dict, Any
+from agents.structured import InterpretedInput, invoke_structured, ainvoke_structured
+from typing import Literal
 from langgraph.types import Command
 import uuid
 
-from dotenv import load_dotenv
-
-load_dotenv()
-
-def input_interpreter(state: InputInterpreterInputState) -> Command[Literal["item_expansion_agent", "category_inference_agent"]]:
-    user_input = state.get("user_input", "")
-
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-    prompt = (
+def _build_prompt(user_input: str) -> str:
+    return (
         "You are a highly skilled AI assistant for a smart shopping cart system. "
         "Your job is to analyze the user's input and extract the following information:\n\n"
         "1. task_type: Determine if the input is a direct product list (the user lists specific products to buy) "
@@ -30,28 +25,23 @@ def input_interpreter(state: InputInterpreterInputState) -> Command[Literal["ite
         "User input: " + user_input
     )
 
-    response = llm.invoke([{"role": "user", "content": prompt}])
-
-    try:
-        import json
-        content = response.content.strip()
-        if content.startswith('```json'):
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
-        parsed = json.loads(content.strip())
-        task_type = parsed.get("task_type")
-        item_list = parsed.get("item_list", [])
-        budget = parsed.get("budget")
-    except Exception:
-        task_type = None
-        item_list = []
-        budget = None
-
-    update = {
-        "task_type": task_type,
-        "item_list": item_list,
-        "budget": budget,
-    }
-    
-    return Command(update=update)
\ No newline at end of file
+
+def input_interpreter(state: InputInterpreterInputState) -> Command[Literal["item_expansion_agent", "category_inference_agent"]]:
+    user_input = state.get("user_input", "")
+
+    llm = get_llm()
+    prompt = _build_prompt(user_input)
+
+    return Command(update={**new_request(), **invoke_structured(llm, prompt, InterpretedInput)})
+
+
+async def ainput_interpreter(state: InputInterpreterInputState) -> Command[Literal["item_expansion_agent", "category_inference_agent"]]:
+    """
+    Async variant of `input_interpreter`, used when the graph runs with `ainvoke`/`astream`.
+    """
+    user_input = state.get("user_input", "")
+
+    llm = get_llm()
+    prompt = _build_prompt(user_input)
+
+    return Command(update={**new_request(), **await ainvoke_structured(llm, prompt, InterpretedInput)})
@@ -1,10 +1,20 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.clients import get_llm
 from agents.states import OverallState
+from agents.structured import ExpandedItems, invoke_structured, ainvoke_structured
 from typing import Dict, Any
-import json
-from dotenv import load_dotenv
 
-load_dotenv()
+def _build_prompt(item_list) -> str:
+    goal = item_list[0] if isinstance(item_list, list) and item_list else ""
+    return (
+        "You are an expert shopping assistant. Given a user's goal or dish, "
+        "expand it into a list of specific, purchasable grocery items. "
+        "Focus on the essential ingredients that a user would typically need to buy for this dish. "
+        "Exclude common household items that are likely to be on hand, such as water, salt, pepper, and basic cooking oils, unless they are a specialty item (e.g., 'truffle oil'). "
+        "Return ONLY a JSON array of item names. No extra text.\n\n"
+        f"Goal or dish: {goal}\n"
+        'Example response: ["spaghetti", "tomato sauce", "ground beef", "onion", "garlic"]'
+    )
+
 
 def item_expansion_agent(state: OverallState) -> Dict[str, Any]:
     """
@@ -15,28 +25,21 @@ def item_expansion_agent(state: OverallState) -> Dict[str, Any]:
     if not item_list or state.get("task_type") != "goal_or_dish":
         return {"expanded_items": []}
 
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-    goal = item_list[0] if isinstance(item_list, list) and item_list else ""
-    prompt = (
-        "You are an expert shopping assistant. Given a user's goal or dish, "
-        "expand it into a list of specific, purchasable grocery items. "
-        "Focus on the essential ingredients that a user would typically need to buy for this dish. "
-        "Exclude common household items that are likely to be on hand, such as water, salt, pepper, and basic cooking oils, unless they are a specialty item (e.g., 'truffle oil'). "
-        "Return ONLY a JSON array of item names. No extra text.\n\n"
-        f"Goal or dish: {goal}\n"
-        'Example response: ["spaghetti", "tomato sauce", "ground beef", "onion", "garlic"]'
-    )
+    llm = get_llm()
+    prompt = _build_prompt(item_list)
+
+    return {"expanded_items": invoke_structured(llm, prompt, ExpandedItems)}
 
-    response = llm.invoke([{"role": "user", "content": prompt}])
 
-    try:
-        content = response.content.strip()
-        if content.startswith('```json'):
-            content = content[7:-3].strip()
-        expanded_items = json.loads(content)
-        if not isinstance(expanded_items, list):
-            expanded_items = []
-    except (json.JSONDecodeError, AttributeError):
-        expanded_items = []
+async def aitem_expansion_agent(state: OverallState) -> Dict[str, Any]:
+    """
+    Async variant of `item_expansion_agent`.
+    """
+    item_list = state.get("item_list", [])
+    if not item_list or state.get("task_type") != "goal_or_dish":
+        return {"expanded_items": []}
+
+    llm = get_llm()
+    prompt = _build_prompt(item_list)
 
-    return {"expanded_items": expanded_items}
\ No newline at end of file
+    return {"expanded_items": await ainvoke_structured(llm, prompt, ExpandedItems)}
@@ -0,0 +1,86 @@
+from agents.clients import get_llm
+from agents.states import InputInterpreterInputState
+from agents.category_index import category_index
+from agents.config import CATEGORY_INDEX_ENABLED
+from agents.incremental import new_request
+from agents.structured import Plan, invoke_structured, ainvoke_structured
+from typing import Dict, Any, List, Literal
+from langgraph.types import Command
+
+
+def _build_prompt(user_input: str) -> str:
+    return (
+        "You are a highly skilled AI assistant for a smart Walmart.com shopping cart system. "
+        "Analyze the user's input and return all of the following in one response:\n\n"
+        "1. task_type: 'direct_product_list' if the user lists specific products to buy, or 'goal_or_dish' "
+        "if the user describes a dish to make, a meal to prepare, or a shopping goal.\n"
+        "2. item_list: the product names if the user listed products, or a list with the dish/goal name "
+        "if the input is goal/dish-based.\n"
+        "3. budget: the budget as a float if the user mentions one (e.g., '$50', 'under 100 dollars'), otherwise null.\n"
+        "4. expanded_items: for a goal/dish, the specific, purchasable grocery items needed for it. "
+        "Focus on the essential ingredients and exclude common household items that are likely to be on hand, "
+        "such as water, salt, pepper, and basic cooking oils, unless they are a specialty item (e.g., 'truffle oil'). "
+        "For a direct product list, return an empty list.\n"
+        "5. categories: a JSON object mapping every purchasable item (expanded_items for a goal/dish, "
+        "item_list otherwise) to the most relevant top-level or second-level Walmart.com category name.\n\n"
+        "Respond ONLY as a JSON object with the keys task_type, item_list, budget, expanded_items, categories.\n"
+        "Do not include any explanation or extra text. Example:\n"
+        "{\n"
+        '  "task_type": "goal_or_dish",\n'
+        '  "item_list": ["spaghetti bolognese"],\n'
+        '  "budget": 25.0,\n'
+        '  "expanded_items": ["spaghetti", "tomato sauce", "ground beef"],\n'
+        '  "categories": {"spaghetti": "Pasta & Noodles", "tomato sauce": "Pantry", "ground beef": "Meat & Seafood"}\n'
+        "}\n\n"
+        "User input: " + user_input
+    )
+
+
+def _plan_update(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns a validated plan into the state update, keeping categories only for the items
+    that will be bought. Items left uncategorized go through category inference.
+    Results of an earlier request on the thread are cleared.
+    """
+    task_type = plan["task_type"]
+    item_list = plan["item_list"]
+    budget = plan["budget"]
+    expanded_items = plan["expanded_items"] if task_type == "goal_or_dish" else []
+    categories = plan["categories"]
+
+    items = expanded_items or item_list
+    if CATEGORY_INDEX_ENABLED:
+        category_index.learn({item: categories[item] for item in items if item in categories})
+    return {
+        **new_request(),
+        "task_type": task_type,
+        "item_list": item_list,
+        "budget": budget,
+        "expanded_items": expanded_items,
+        "categories": {item: categories[item] for item in items if item in categories},
+    }
+
+
+def fused_planner_agent(state: InputInterpreterInputState) -> Command[Literal["Human_review", "category_inference_agent", "product_search_agent"]]:
+    """
+    Does the work of input_interpreter, item_expansion_agent and category_inference_agent
+    in a single LLM round-trip.
+    """
+    user_input = state.get("user_input", "")
+
+    llm = get_llm()
+    plan = invoke_structured(llm, _build_prompt(user_input), Plan)
+
+    return Command(update=_plan_update(plan))
+
+
+async def afused_planner_agent(state: InputInterpreterInputState) -> Command[Literal["Human_review", "category_inference_agent", "product_search_agent"]]:
+    """
+    Async variant of `fused_planner_agent`.
+    """
+    user_input = state.get("user_input", "")
+
+    llm = get_llm()
+    plan = await ainvoke_structured(llm, _build_prompt(user_input), Plan)
+
+    return Command(update=_plan_update(plan))
@@ -0,0 +1,243 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from agents.config import (
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_SESSIONS,
+    PRODUCT_SEARCH_MAX_CONCURRENCY,
+    EXTRACTION_MODE,
+)
+from agents.ratelimit import BACKGROUND, run_at_priority
+from agents.tracing import detached_context
+
+
+def current_thread_id() -> Optional[str]:
+    """
+    Returns the graph thread_id of the node being run, or None outside a graph run.
+    """
+    try:
+        from langgraph.config import get_config
+
+        thread_id = get_config()["configurable"].get("thread_id")
+    except (RuntimeError, KeyError):
+        return None
+    return str(thread_id) if thread_id is not None else None
+
+
+class _ItemJob:
+    """
+    Speculative work for one item: its category, then its product options.
+    """
+
+    def __init__(self, item: str):
+        self.item = item
+        self.category: Future = Future()
+        self.options: Future = Future()
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        for future in (self.category, self.options):
+            if not future.done():
+                future.cancel()
+
+    def set_result(self, future: Future, value: Any) -> None:
+        if not future.done():
+            future.set_result(value)
+
+    def set_exception(self, future: Future, error: BaseException) -> None:
+        if not future.done():
+            future.set_exception(error)
+
+
+class Prefetcher:
+    """
+    Categorizes items and fetches their products in the background while the graph waits
+    at human review, keyed by thread_id. Each review round calls `sync` with the list on
+    screen: items that were removed are cancelled and only new items are started.
+    Product search then `take`s whatever is ready (or nearly ready) for the final list.
+    """
+
+    def __init__(self, max_workers: int = PRODUCT_SEARCH_MAX_CONCURRENCY,
+                 max_sessions: int = PREFETCH_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="prefetch")
+        self._sessions: "OrderedDict[str, Dict[str, _ItemJob]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.started = 0
+        self.cancelled = 0
+        self.used = 0
+
+    def _submit(self, fn, *args) -> None:
+        # Prefetching is speculative, so its model and search calls yield to interactive ones.
+        self._executor.submit(detached_context().run, run_at_priority, BACKGROUND, fn, *args)
+
+    def sync(self, thread_id: str, items: List[str], categories: Optional[Dict[str, str]] = None) -> None:
+        """
+        Makes the background work for `thread_id` match `items`. Known `categories`
+        are used as-is; other items are categorized first.
+        """
+        categories = categories or {}
+        wanted = list(dict.fromkeys(items))
+        with self._lock:
+            session = self._sessions.get(thread_id)
+            if session is None:
+                session = self._sessions[thread_id] = {}
+            self._sessions.move_to_end(thread_id)
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                for job in evicted.values():
+                    job.cancel()
+
+            for item in [item for item in session if item not in wanted]:
+                session.pop(item).cancel()
+                self.cancelled += 1
+            added = [_ItemJob(item) for item in wanted if item not in session]
+            for job in added:
+                session[job.item] = job
+            self.started += len(added)
+
+        if not added:
+            return
+        known = [job for job in added if job.item in categories]
+        for job in known:
+            job.set_result(job.category, categories[job.item])
+        unknown = [job for job in added if job.item not in categories]
+        if known:
+            self._submit(self._fetch, known)
+        if unknown:
+            self._submit(self._categorize, unknown)
+        print(f"Prefetching products for {[job.item for job in added]}")
+
+    def _categorize(self, jobs: List[_ItemJob]) -> None:
+        from agents.category_assigner import infer_categories
+
+        live = [job for job in jobs if not job.cancelled.is_set()]
+        if not live:
+            return
+        try:
+            categories = infer_categories([job.item for job in live])
+        except Exception as e:
+            print(f"Prefetch categorization failed: {e}")
+            for job in live:
+                job.set_exception(job.category, e)
+                job.set_exception(job.options, e)
+            return
+
+        categorized = []
+        for job in live:
+            if job.item in categories:
+                job.set_result(job.category, categories[job.item])
+                categorized.append(job)
+            else:
+                error = LookupError(f"no category for {job.item}")
+                job.set_exception(job.category, error)
+                job.set_exception(job.options, error)
+        if categorized:
+            self._fetch(categorized)
+
+    def _fetch(self, jobs: List[_ItemJob]) -> None:
+        from agents.clients import get_llm, get_search
+        from agents.product_fetcher import (
+            fallback_product_options,
+            fetch_products_batched,
+            fetch_products_for_item,
+            run_in_order,
+        )
+
+        live = [job for job in jobs if not job.cancelled.is_set()]
+        if not live:
+            return
+        pairs = [(job.item, job.category.result()) for job in live]
+        llm, search = get_llm(), get_search()
+        try:
+            if EXTRACTION_MODE == "per_item":
+                def fetch(item: str, category: str) -> List[Dict[str, Any]]:
+                    return fetch_products_for_item(llm, search, item, category)
+
+                all_options = run_in_order(fetch, pairs, on_failure=fallback_product_options)
+            else:
+                all_options = fetch_products_batched(llm, search, pairs)
+        except Exception as e:
+            print(f"Prefetch for {[item for item, _ in pairs]} failed: {e}")
+            for job in live:
+                job.set_exception(job.options, e)
+            return
+        for job, product_options in zip(live, all_options):
+            job.set_result(job.options, product_options)
+
+    def categories(self, thread_id: str, items: List[str], timeout: float) -> Dict[str, str]:
+        """
+        Returns the prefetched categories for `items`, waiting up to `timeout` seconds in
+        total for ones still being inferred.
+        """
+        with self._lock:
+            session = dict(self._sessions.get(thread_id) or {})
+        deadline = time.monotonic() + timeout
+        found = {}
+        for item in items:
+            job = session.get(item)
+            if job is None:
+                continue
+            try:
+                found[item] = job.category.result(max(0.0, deadline - time.monotonic()))
+            except Exception:
+                continue
+        return found
+
+    def take(self, thread_id: str, pairs: List[Tuple[str, str]], timeout: float) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Ends the thread's prefetch session and returns the options prefetched for `pairs`,
+        waiting up to `timeout` seconds in total for work still in flight. Items whose
+        category changed since, or whose prefetch failed, are left out for the caller to fetch.
+        """
+        with self._lock:
+            session = self._sessions.pop(thread_id, None)
+        if not session:
+            return {}
+
+        deadline = time.monotonic() + timeout
+        found = {}
+        for item, category in pairs:
+            job = session.pop(item, None)
+            if job is None:
+                continue
+            try:
+                if job.category.result(max(0.0, deadline - time.monotonic())) != category:
+                    job.cancel()
+                    continue
+                found[item] = job.options.result(max(0.0, deadline - time.monotonic()))
+            except Exception:
+                job.cancel()
+        for job in session.values():
+            job.cancel()
+        with self._lock:
+            self.used += len(found)
+        return found
+
+    async def atake(self, thread_id: str, pairs: List[Tuple[str, str]],
+                    timeout: float) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Async variant of `take`.
+        """
+        return await asyncio.to_thread(self.take, thread_id, pairs, timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "started": self.started,
+                "cancelled": self.cancelled,
+                "used": self.used,
+            }
+
+
+prefetcher = Prefetcher() if PREFETCH_ENABLED else None
+
+
+def prefetch_stats() -> Dict[str, int]:
+    return prefetcher.stats() if prefetcher is not None else {}
@@ -1,23 +1,152 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from agents.clients import get_llm, get_search
 from agents.states import OverallState
-from typing import Dict, Any, List, Literal
-from langgraph.types import Command, interrupt
-from langchain_tavily import TavilySearch
+from agents.config import (
+    PRODUCT_SEARCH_MAX_CONCURRENCY,
+    PRODUCT_SEARCH_ITEM_TIMEOUT,
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_MAX_ENTRIES,
+    EXTRACTION_CACHE_TTL,
+    EXTRACTION_CACHE_MAX_ENTRIES,
+    EXTRACTION_MODE,
+    EXTRACTION_BATCH_TOKENS,
+    EXTRACTION_BATCH_MAX_ITEMS,
+    COMPACTION_ENABLED,
+)
+from agents.cache import make_cache
+from agents.catalog import get_catalog
+from agents.tracing import record_event
+from agents.prefetch import prefetcher, current_thread_id
+from agents.incremental import input_hash, unchanged, reuse_products
+from agents.products import ItemOptions
+from agents.structured import (
+    ProductOptions,
+    ProductOptionsByItem,
+    ainvoke_structured,
+    invoke_structured,
+    parse,
+)
+from agents.search_compaction import (
+    CompactionMeter,
+    compaction_totals,
+    compact_search_results,
+    estimate_tokens,
+    options_from_compacted,
+)
+from typing import Dict, Any, List, Literal, Callable, Tuple, Optional, Union
+from langgraph.types import Command
+from langgraph.config import get_stream_writer
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import asyncio
 import json
+import time
 
-def product_search_agent(state: OverallState) -> Command[Literal["budget_optimizer_agent"]]:
-    categories = state.get("categories", {})
-    products = []
-    
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-    tavily_search = TavilySearch(max_results=50)
-    
-    def fetch_products_for_item(item: str, category: str) -> List[Dict[str, Any]]:
-        
-        base_query = f"{item} {category} site:walmart.com price rating"
+# Raw Tavily results keyed by normalized query, and parsed options keyed by (item, category).
+search_cache = make_cache("search", SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES)
+extraction_cache = make_cache("extraction", EXTRACTION_CACHE_TTL, EXTRACTION_CACHE_MAX_ENTRIES)
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def extraction_key(item: str, category: str) -> str:
+    return f"{normalize_query(item)}|{normalize_query(category)}"
+
+
+def known_options(item: str, category: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Options already known for the item: from the extraction cache, else from the product
+    catalog while its entry is fresh. Returns None if the item has to be searched.
+    """
+    cached_options = extraction_cache.get(extraction_key(item, category))
+    catalog = get_catalog() if cached_options is None else None
+    if catalog is not None:
+        cached_options = catalog.lookup(item, category)
+    return cached_options
+
+
+def remember_options(item: str, category: str, product_options: List[Dict[str, Any]]) -> None:
+    """
+    Caches freshly extracted options and records them in the product catalog.
+    Empty results are not kept, so the item is searched again next time.
+    """
+    if not product_options:
+        return
+    extraction_cache.set(extraction_key(item, category), product_options)
+    catalog = get_catalog()
+    if catalog is not None:
+        catalog.upsert(item, category, product_options)
+
+
+def fallback_product_options(item: str, category: str) -> List[Dict[str, Any]]:
+    """
+    Used when no products could be found or extracted for an item: the item gets no
+    options, so the budget optimizer leaves it out instead of buying a made-up product.
+    """
+    record_event("fallbacks")
+    print(f"No products found for {item}")
+    return []
+
+
+def search_query(item: str, category: str) -> str:
+    if not category:
+        return f"{item} site:walmart.com price rating"
+    return f"{item} {category} site:walmart.com price rating"
+
+
+def search_products(tavily_search, item: str, category: str, refresh: bool = False) -> Any:
+    """
+    Runs the Walmart web search for an item, served from the search cache when possible.
+    `refresh` skips the cache read so the results are current.
+    """
+    base_query = search_query(item, category)
+    key = normalize_query(base_query)
+
+    search_results = None if refresh else search_cache.get(key)
+    if search_results is None:
         search_results = tavily_search.invoke(base_query)
-        
-        prompt = f"""
+        search_cache.set(key, search_results)
+    return search_results
+
+
+async def asearch_products(tavily_search, item: str, category: str, refresh: bool = False) -> Any:
+    """
+    Async variant of `search_products`.
+    """
+    base_query = search_query(item, category)
+    key = normalize_query(base_query)
+
+    search_results = None if refresh else search_cache.get(key)
+    if search_results is None:
+        search_results = await tavily_search.ainvoke(base_query)
+        search_cache.set(key, search_results)
+    return search_results
+
+
+def prepare_search_results(item: str, category: str, search_results: Any,
+                           meter: Optional[CompactionMeter] = None) -> Tuple[Any, Optional[List[Dict[str, Any]]]]:
+    """
+    Compacts raw search results before they reach the LLM.
+    Returns (payload for the extraction prompt, options parsed without the LLM or None).
+    """
+    if not COMPACTION_ENABLED:
+        return search_results, None
+
+    compacted = compact_search_results(item, search_results)
+    direct_options = options_from_compacted(category, compacted)
+    if not compacted:
+        # Nothing from walmart.com survived; there is nothing for the LLM to extract.
+        direct_options = []
+
+    if meter is not None:
+        prompt_tokens = 0 if direct_options is not None else estimate_tokens(compacted)
+        meter.add(estimate_tokens(search_results), prompt_tokens, llm_skipped=direct_options is not None)
+    return compacted, direct_options
+
+
+def _item_prompt(item: str, category: str, search_results: Any) -> str:
+    return f"""
 You are a product information extractor. From the following search results about "{item}" from Walmart, 
 extract exactly 5 different product options with these details:
 - name: Product name
@@ -34,49 +163,574 @@ Respond ONLY with a JSON array of exactly 5 product objects. If fewer than 5 pro
 Example format:
 [{{"name": "Product Name", "price": 12.99, "rating": 4.5, "brand": "Brand Name", "category": "{category}", "description": "Brief description"}}]
 """
-        
-        try:
-            response = llm.invoke([{"role": "user", "content": prompt}])
-            content = response.content.strip()
-            
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            product_options = json.loads(content)
-            
-            valid_options = []
-            for option in product_options:
-                if isinstance(option, dict) and option.get('name') and option.get('price'):
-                    try:
-                        option['price'] = float(option['price'])
-                        valid_options.append(option)
-                    except (ValueError, TypeError):
-                        continue
-            
-            return valid_options[:5]
-            
-        except Exception as e:
-            print(f"Error extracting products for {item}: {e}")
-
-            return [{
-                "name": f"{item.title()} - Option 1",
-                "price": 10.99,
-                "rating": 4.0,
-                "brand": "Generic",
-                "category": category,
-                "description": f"Quality {item} product"
-            }]
-    
-    for item, category in categories.items():
-        product_options = fetch_products_for_item(item, category)
-        
-        products.append({
-            "item": item,
-            "category": category,
-            "options": product_options
-        })
-    
-    return Command(update={"products": products}, goto="budget_optimizer_agent")
+
+
+def extract_product_options(llm, item: str, category: str, search_results: Any) -> Optional[List[Dict[str, Any]]]:
+    """
+    Asks the LLM for up to 5 product options from the search results, retrying an
+    invalid reply. Returns None if no valid reply came back.
+    """
+    prompt = _item_prompt(item, category, search_results)
+    try:
+        return invoke_structured(llm, prompt, ProductOptions)
+    except Exception as e:
+        print(f"Error extracting products for {item}: {e}")
+        return None
+
+
+async def aextract_product_options(llm, item: str, category: str, search_results: Any) -> Optional[List[Dict[str, Any]]]:
+    """
+    Async variant of `extract_product_options`.
+    """
+    prompt = _item_prompt(item, category, search_results)
+    try:
+        return await ainvoke_structured(llm, prompt, ProductOptions)
+    except Exception as e:
+        print(f"Error extracting products for {item}: {e}")
+        return None
+
+
+def pack_extraction_batches(
+    searched: List[Tuple[str, str, Any]],
+    token_budget: int = EXTRACTION_BATCH_TOKENS,
+    max_items: int = EXTRACTION_BATCH_MAX_ITEMS,
+) -> List[List[Tuple[str, str, Any]]]:
+    """
+    Groups (item, category, search_results) entries into batches whose search payloads
+    fit in `token_budget` tokens. An entry larger than the budget gets a batch of its own.
+    """
+    batches: List[List[Tuple[str, str, Any]]] = []
+    current: List[Tuple[str, str, Any]] = []
+    current_tokens = 0
+    for entry in searched:
+        tokens = estimate_tokens(entry[2])
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(entry)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_prompt(batch: List[Tuple[str, str, Any]]) -> str:
+    sections = []
+    for item, category, search_results in batch:
+        sections.append(
+            f'Item: "{item}" (category: {category})\n'
+            f"Search Results:\n{search_results}\n"
+        )
+    item_names = json.dumps([item for item, _, _ in batch])
+
+    return f"""
+You are a product information extractor. Below are Walmart search results for several shopping items.
+For EACH item, extract exactly 5 different product options with these details:
+- name: Product name
+- price: Price as a number (extract from $X.XX format)
+- rating: Rating out of 5 (if available, otherwise null)
+- brand: Brand name
+- category: Product category
+- description: Brief description
+
+{chr(10).join(sections)}
+Respond ONLY with a JSON object whose keys are exactly these item names: {item_names}
+Each value is a JSON array of up to 5 product objects for that item, using only that item's search results.
+Example format:
+{{"milk": [{{"name": "Product Name", "price": 12.99, "rating": 4.5, "brand": "Brand Name", "category": "Dairy & Eggs", "description": "Brief description"}}]}}
+"""
+
+
+def _parse_batch_response(response, batch: List[Tuple[str, str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    parsed = parse(response, ProductOptionsByItem)
+    return {item: parsed[item] for item, _, _ in batch if parsed.get(item)}
+
+
+def extract_product_options_batch(llm, batch: List[Tuple[str, str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Extracts product options for several items with a single LLM call.
+    Returns {item: options} for every item whose part of the response validated;
+    items that are missing or malformed are left out so the caller can retry just those.
+    """
+    try:
+        response = llm.invoke([{"role": "user", "content": _batch_prompt(batch)}])
+        return _parse_batch_response(response, batch)
+    except Exception as e:
+        print(f"Error extracting products for batch {[item for item, _, _ in batch]}: {e}")
+        return {}
+
+
+async def aextract_product_options_batch(llm, batch: List[Tuple[str, str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Async variant of `extract_product_options_batch`.
+    """
+    try:
+        response = await llm.ainvoke([{"role": "user", "content": _batch_prompt(batch)}])
+        return _parse_batch_response(response, batch)
+    except Exception as e:
+        print(f"Error extracting products for batch {[item for item, _, _ in batch]}: {e}")
+        return {}
+
+
+def fetch_products_for_item(llm, tavily_search, item: str, category: str,
+                            meter: Optional[CompactionMeter] = None) -> List[Dict[str, Any]]:
+    """
+    Searches Walmart for a single item and extracts up to 5 product options with the LLM.
+    Both the raw search and the extracted options are cached, and the options go into the
+    product catalog; fallbacks are never kept.
+    """
+    cached_options = known_options(item, category)
+    if cached_options is not None:
+        return cached_options
+
+    try:
+        search_results = search_products(tavily_search, item, category)
+    except Exception as e:
+        print(f"Error searching products for {item}: {e}")
+        return fallback_product_options(item, category)
+
+    payload, product_options = prepare_search_results(item, category, search_results, meter)
+    if product_options is None:
+        product_options = extract_product_options(llm, item, category, payload)
+    if product_options is None:
+        return fallback_product_options(item, category)
+
+    remember_options(item, category, product_options)
+    return product_options
+
+
+async def afetch_products_for_item(llm, tavily_search, item: str, category: str,
+                                   meter: Optional[CompactionMeter] = None) -> List[Dict[str, Any]]:
+    """
+    Async variant of `fetch_products_for_item`.
+    """
+    cached_options = known_options(item, category)
+    if cached_options is not None:
+        return cached_options
+
+    try:
+        search_results = await asearch_products(tavily_search, item, category)
+    except Exception as e:
+        print(f"Error searching products for {item}: {e}")
+        return fallback_product_options(item, category)
+
+    payload, product_options = prepare_search_results(item, category, search_results, meter)
+    if product_options is None:
+        product_options = await aextract_product_options(llm, item, category, payload)
+    if product_options is None:
+        return fallback_product_options(item, category)
+
+    remember_options(item, category, product_options)
+    return product_options
+
+
+def _describe(calls: List[Tuple[Any, ...]], index: int) -> str:
+    subject = calls[index][0] if calls[index] else None
+    return subject if isinstance(subject, str) else f"task {index}"
+
+
+def run_in_order(
+    fn: Callable[..., Any],
+    calls: List[Tuple[Any, ...]],
+    on_failure: Callable[..., Any],
+    max_concurrency: int = PRODUCT_SEARCH_MAX_CONCURRENCY,
+    item_timeout: Optional[float] = PRODUCT_SEARCH_ITEM_TIMEOUT,
+) -> List[Any]:
+    """
+    Runs `fn(*args)` for every args tuple with at most `max_concurrency` calls in flight.
+    Each call gets `item_timeout` seconds from the moment it starts; calls that fail or
+    time out are replaced by `on_failure(*args)` so they never hold up the rest.
+    Results are returned in input order.
+    """
+    if not calls:
+        return []
+
+    name = getattr(fn, "__name__", "task")
+    results: List[Any] = [None] * len(calls)
+    started: Dict[int, float] = {}
+
+    def run(index: int, args: Tuple[Any, ...]) -> Any:
+        started[index] = time.monotonic()
+        return fn(*args)
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_concurrency, len(calls))),
+        thread_name_prefix="product-search",
+    )
+    futures = {
+        # Each worker runs in a copy of the caller's context so its calls are traced to the node.
+        executor.submit(contextvars.copy_context().run, run, index, args): index
+        for index, args in enumerate(calls)
+    }
+    pending = set(futures)
+
+    try:
+        while pending:
+            poll = 0.25
+            if item_timeout and item_timeout > 0:
+                now = time.monotonic()
+                for future in pending:
+                    start = started.get(futures[future])
+                    if start is not None:
+                        poll = min(poll, start + item_timeout - now)
+            done, pending = wait(pending, timeout=max(poll, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    print(f"Error in {name} for {_describe(calls, index)}: {e}")
+                    results[index] = on_failure(*calls[index])
+
+            if item_timeout and item_timeout > 0:
+                now = time.monotonic()
+                for future in list(pending):
+                    index = futures[future]
+                    start = started.get(index)
+                    if start is not None and now - start > item_timeout:
+                        print(f"{name} for {_describe(calls, index)} timed out after {item_timeout}s")
+                        results[index] = on_failure(*calls[index])
+                        pending.discard(future)
+    finally:
+        # Timed-out calls cannot be interrupted; let them finish in the background.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+async def arun_in_order(
+    fn: Callable[..., Any],
+    calls: List[Tuple[Any, ...]],
+    on_failure: Callable[..., Any],
+    max_concurrency: int = PRODUCT_SEARCH_MAX_CONCURRENCY,
+    item_timeout: Optional[float] = PRODUCT_SEARCH_ITEM_TIMEOUT,
+    on_result: Optional[Callable[[int, Any], None]] = None,
+) -> List[Any]:
+    """
+    Async variant of `run_in_order` for coroutine functions. Timed-out calls are cancelled.
+    `on_result(index, result)` is called as each call finishes, in completion order.
+    """
+    name = getattr(fn, "__name__", "task")
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(index: int, args: Tuple[Any, ...]) -> Any:
+        async with semaphore:
+            try:
+                if item_timeout and item_timeout > 0:
+                    result = await asyncio.wait_for(fn(*args), item_timeout)
+                else:
+                    result = await fn(*args)
+            except asyncio.TimeoutError:
+                print(f"{name} for {_describe(calls, index)} timed out after {item_timeout}s")
+                result = on_failure(*args)
+            except Exception as e:
+                print(f"Error in {name} for {_describe(calls, index)}: {e}")
+                result = on_failure(*args)
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    return list(await asyncio.gather(*(run(index, args) for index, args in enumerate(calls))))
+
+
+def _cached_options(pairs: List[Tuple[str, str]]) -> Tuple[List[Optional[List[Dict[str, Any]]]], List[int]]:
+    """
+    Looks every pair up in the extraction cache and the product catalog.
+    Returns (results with known options filled in, indexes of the misses).
+    """
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(pairs)
+    missing = []
+    for index, (item, category) in enumerate(pairs):
+        cached_options = known_options(item, category)
+        if cached_options is not None:
+            results[index] = cached_options
+        else:
+            missing.append(index)
+    return results, missing
+
+
+def _absorb_search_results(pairs, missing, search_results, results,
+                           meter: Optional[CompactionMeter]) -> List[Tuple[str, str, Any]]:
+    """
+    Fills in results that need no LLM call (failed searches get fallbacks, clean parses
+    are used directly) and returns the (item, category, payload) entries left to extract.
+    """
+    searched = []
+    for index, found in zip(missing, search_results):
+        item, category = pairs[index]
+        if found is None:
+            results[index] = fallback_product_options(item, category)
+            continue
+        payload, direct_options = prepare_search_results(item, category, found, meter)
+        if direct_options is None:
+            searched.append((item, category, payload))
+        else:
+            results[index] = direct_options
+            remember_options(item, category, direct_options)
+    return searched
+
+
+def _finish_extraction(pairs, results, extracted: Dict[str, List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+    for index, (item, category) in enumerate(pairs):
+        if results[index] is not None:
+            continue
+        product_options = extracted.get(item)
+        if product_options is None:
+            results[index] = fallback_product_options(item, category)
+            continue
+        remember_options(item, category, product_options)
+        results[index] = product_options
+    return results
+
+
+def fetch_products_batched(llm, tavily_search, pairs: List[Tuple[str, str]],
+                           meter: Optional[CompactionMeter] = None, refresh: bool = False) -> List[List[Dict[str, Any]]]:
+    """
+    Fetches options for many items with as few LLM calls as possible: cached items are
+    served directly, searches run concurrently, results that parse cleanly skip the LLM,
+    and the rest are packed into token-budgeted batches for extraction. Items missing
+    from a batch response are retried one at a time. Results are returned in input order.
+    `refresh` searches every item live, ignoring what is cached or in the catalog.
+    """
+    if refresh:
+        results, missing = [None] * len(pairs), list(range(len(pairs)))
+    else:
+        results, missing = _cached_options(pairs)
+
+    def search(item: str, category: str) -> Any:
+        return search_products(tavily_search, item, category, refresh)
+
+    def extract_batch(batch: List[Tuple[str, str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        return extract_product_options_batch(llm, batch)
+
+    def extract_item(item: str, category: str, found: Any) -> Optional[List[Dict[str, Any]]]:
+        return extract_product_options(llm, item, category, found)
+
+    search_results = run_in_order(
+        search,
+        [pairs[index] for index in missing],
+        on_failure=lambda item, category: None,
+    )
+    searched = _absorb_search_results(pairs, missing, search_results, results, meter)
+
+    extracted: Dict[str, List[Dict[str, Any]]] = {}
+    for batch_result in run_in_order(
+        extract_batch,
+        [(batch,) for batch in pack_extraction_batches(searched)],
+        on_failure=lambda batch: {},
+    ):
+        extracted.update(batch_result)
+
+    retries = [entry for entry in searched if entry[0] not in extracted]
+    if retries:
+        print(f"Retrying extraction individually for: {[item for item, _, _ in retries]}")
+        record_event("retries", len(retries))
+    retried = run_in_order(
+        extract_item,
+        retries,
+        on_failure=lambda item, category, found: None,
+    )
+    for (item, _, _), product_options in zip(retries, retried):
+        if product_options is not None:
+            extracted[item] = product_options
+
+    return _finish_extraction(pairs, results, extracted)
+
+
+async def afetch_products_batched(llm, tavily_search, pairs: List[Tuple[str, str]],
+                                  meter: Optional[CompactionMeter] = None,
+                                  on_item: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+                                  refresh: bool = False) -> List[List[Dict[str, Any]]]:
+    """
+    Async variant of `fetch_products_batched`. `on_item(index, options)` is called once per
+    pair as soon as its options are known, so callers can stream partial results.
+    """
+    if refresh:
+        results, missing = [None] * len(pairs), list(range(len(pairs)))
+    else:
+        results, missing = _cached_options(pairs)
+    positions = {item: index for index, (item, _) in enumerate(pairs)}
+    reported = set()
+
+    def report(index: int, product_options: Optional[List[Dict[str, Any]]]) -> None:
+        if on_item is not None and product_options is not None and index not in reported:
+            reported.add(index)
+            on_item(index, product_options)
+
+    def report_known() -> None:
+        for index, product_options in enumerate(results):
+            report(index, product_options)
+
+    async def search(item: str, category: str) -> Any:
+        return await asearch_products(tavily_search, item, category, refresh)
+
+    async def extract_batch(batch: List[Tuple[str, str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        return await aextract_product_options_batch(llm, batch)
+
+    async def extract_item(item: str, category: str, found: Any) -> Optional[List[Dict[str, Any]]]:
+        return await aextract_product_options(llm, item, category, found)
+
+    report_known()
+    search_results = await arun_in_order(
+        search,
+        [pairs[index] for index in missing],
+        on_failure=lambda item, category: None,
+    )
+    searched = _absorb_search_results(pairs, missing, search_results, results, meter)
+    report_known()
+
+    def report_batch(_: int, batch_result: Dict[str, List[Dict[str, Any]]]) -> None:
+        for item, product_options in batch_result.items():
+            report(positions[item], product_options)
+
+    extracted: Dict[str, List[Dict[str, Any]]] = {}
+    for batch_result in await arun_in_order(
+        extract_batch,
+        [(batch,) for batch in pack_extraction_batches(searched)],
+        on_failure=lambda batch: {},
+        on_result=report_batch,
+    ):
+        extracted.update(batch_result)
+
+    retries = [entry for entry in searched if entry[0] not in extracted]
+    if retries:
+        print(f"Retrying extraction individually for: {[item for item, _, _ in retries]}")
+        record_event("retries", len(retries))
+
+    def report_retry(index: int, product_options: Optional[List[Dict[str, Any]]]) -> None:
+        report(positions[retries[index][0]], product_options)
+
+    retried = await arun_in_order(
+        extract_item,
+        retries,
+        on_failure=lambda item, category, found: None,
+        on_result=report_retry,
+    )
+    for (item, _, _), product_options in zip(retries, retried):
+        if product_options is not None:
+            extracted[item] = product_options
+
+    results = _finish_extraction(pairs, results, extracted)
+    report_known()
+    return results
+
+
+def _products_update(pairs: List[Tuple[str, str]], all_options: List[Union[ItemOptions, List[Dict[str, Any]]]],
+                     meter: CompactionMeter, digest: str) -> Command[Literal["budget_optimizer_agent"]]:
+    products = []
+    for (item, category), product_options in zip(pairs, all_options):
+        if not isinstance(product_options, ItemOptions):
+            product_options = ItemOptions.from_options(item, category, product_options)
+        products.append(product_options)
+
+    if COMPACTION_ENABLED and meter.items:
+        print(f"Search compaction: {meter.summary()}")
+
+    return Command(update={"products": products, "input_hashes": {"product_search_agent": digest}},
+                   goto="budget_optimizer_agent")
+
+
+def _merge_prefetched(pairs: List[Tuple[str, str]], prefetched: Dict[str, Any],
+                      fetched: List[List[Dict[str, Any]]]) -> List[Any]:
+    """
+    Puts reused or prefetched options and freshly fetched ones back in the order of `pairs`.
+    """
+    remaining = iter(fetched)
+    return [prefetched[item] if item in prefetched else next(remaining) for item, _ in pairs]
+
+
+def product_search_agent(state: OverallState) -> Command[Literal["budget_optimizer_agent"]]:
+    """
+    Finds product options for each categorized item. Options already in the state for the
+    same item and category are reused, so an edited cart only searches for its new items.
+    """
+    categories = state.get("categories", {})
+    pairs = list(categories.items())
+    digest = input_hash(pairs)
+    if unchanged(state, "product_search_agent", digest, "products"):
+        return Command(goto="budget_optimizer_agent")
+
+    llm = get_llm()
+    tavily_search = get_search()
+    meter = CompactionMeter(parent=compaction_totals)
+
+    prefetched = reuse_products(state, pairs)
+    catalog = get_catalog()
+    if catalog is not None:
+        catalog.record_requests([pair for pair in pairs if pair[0] not in prefetched])
+    thread_id = current_thread_id() if prefetcher is not None else None
+    if thread_id is not None:
+        taken = prefetcher.take(thread_id, [pair for pair in pairs if pair[0] not in prefetched],
+                                PRODUCT_SEARCH_ITEM_TIMEOUT)
+        record_event("prefetch_hits", len(taken))
+        prefetched.update(taken)
+    to_fetch = [pair for pair in pairs if pair[0] not in prefetched]
+
+    if EXTRACTION_MODE == "per_item":
+        def fetch(item: str, category: str) -> List[Dict[str, Any]]:
+            return fetch_products_for_item(llm, tavily_search, item, category, meter)
+
+        fetched = run_in_order(
+            fetch,
+            to_fetch,
+            on_failure=fallback_product_options,
+        )
+    else:
+        fetched = fetch_products_batched(llm, tavily_search, to_fetch, meter)
+
+    return _products_update(pairs, _merge_prefetched(pairs, prefetched, fetched), meter, digest)
+
+
+async def aproduct_search_agent(state: OverallState) -> Command[Literal["budget_optimizer_agent"]]:
+    """
+    Async variant of `product_search_agent`. When streamed with the "custom" mode, each
+    item's options are emitted as soon as they are known.
+    """
+    categories = state.get("categories", {})
+    pairs = list(categories.items())
+    digest = input_hash(pairs)
+    if unchanged(state, "product_search_agent", digest, "products"):
+        return Command(goto="budget_optimizer_agent")
+
+    llm = get_llm()
+    tavily_search = get_search()
+    writer = get_stream_writer()
+    meter = CompactionMeter(parent=compaction_totals)
+
+    prefetched = reuse_products(state, pairs)
+    catalog = get_catalog()
+    if catalog is not None:
+        catalog.record_requests([pair for pair in pairs if pair[0] not in prefetched])
+    thread_id = current_thread_id() if prefetcher is not None else None
+    if thread_id is not None:
+        taken = await prefetcher.atake(thread_id, [pair for pair in pairs if pair[0] not in prefetched],
+                                       PRODUCT_SEARCH_ITEM_TIMEOUT)
+        record_event("prefetch_hits", len(taken))
+        prefetched.update(taken)
+    for item, category in pairs:
+        if item in prefetched:
+            product_options = prefetched[item]
+            if isinstance(product_options, ItemOptions):
+                product_options = product_options.options()
+            writer({"item": item, "category": category, "options": product_options})
+    to_fetch = [pair for pair in pairs if pair[0] not in prefetched]
+
+    def emit(index: int, product_options: List[Dict[str, Any]]) -> None:
+        item, category = to_fetch[index]
+        writer({"item": item, "category": category, "options": product_options})
+
+    if EXTRACTION_MODE == "per_item":
+        async def fetch(item: str, category: str) -> List[Dict[str, Any]]:
+            return await afetch_products_for_item(llm, tavily_search, item, category, meter)
+
+        fetched = await arun_in_order(
+            fetch,
+            to_fetch,
+            on_failure=fallback_product_options,
+            on_result=emit,
+        )
+    else:
+        fetched = await afetch_products_batched(llm, tavily_search, to_fetch, meter, on_item=emit)
+
+    return _products_update(pairs, _merge_prefetched(pairs, prefetched, fetched), meter, digest)
@@ -0,0 +1,150 @@
+import hashlib
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+
+def _intern(text: Any) -> Optional[str]:
+    return sys.intern(text) if isinstance(text, str) else None
+
+
+def product_id(name: str, brand: Optional[str] = None) -> str:
+    """
+    Stable ID for a product: the same name and brand always give the same ID.
+    """
+    key = f"{' '.join(str(brand or '').lower().split())}|{' '.join(str(name).lower().split())}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+class ProductOption:
+    """
+    One product option, read from an `ItemOptions` table.
+    """
+
+    __slots__ = ("id", "name", "price", "rating", "brand", "category", "description")
+
+    def __init__(self, id: str, name: str, price: float, rating: Optional[float],
+                 brand: Optional[str], category: Optional[str], description: str = ""):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.rating = rating
+        self.brand = brand
+        self.category = category
+        self.description = description
+
+    def to_dict(self, description: bool = True) -> Dict[str, Any]:
+        option = {
+            "id": self.id,
+            "name": self.name,
+            "price": self.price,
+            "rating": self.rating,
+            "brand": self.brand,
+            "category": self.category,
+        }
+        if description:
+            option["description"] = self.description
+        return option
+
+
+class ItemOptions:
+    """
+    The product options found for one item, stored column-wise so a cart of many items
+    checkpoints as a few short lists per item rather than one dict per option. Brand and
+    category strings are interned and IDs are derived from name and brand rather than stored.
+    `categories` is left empty when every option is in the item's category, and
+    `descriptions` when no option has one.
+    """
+
+    __slots__ = ("item", "category", "names", "prices", "ratings", "brands", "categories", "descriptions")
+
+    def __init__(self, item: str, category: str, names: Sequence[str] = (), prices: Sequence[float] = (),
+                 ratings: Sequence[Optional[float]] = (), brands: Sequence[Optional[str]] = (),
+                 categories: Sequence[Optional[str]] = (), descriptions: Sequence[str] = ()):
+        self.item = item
+        self.category = _intern(category) or ""
+        self.names = tuple(names)
+        self.prices = tuple(prices)
+        self.ratings = tuple(ratings)
+        self.brands = tuple(_intern(brand) for brand in brands)
+        self.categories = tuple(_intern(option_category) for option_category in categories)
+        if all(option_category == self.category for option_category in self.categories):
+            self.categories = ()
+        self.descriptions = tuple(str(description or "") for description in descriptions)
+        if not any(self.descriptions):
+            self.descriptions = ()
+
+    @property
+    def ids(self) -> List[str]:
+        return [product_id(name, brand) for name, brand in zip(self.names, self.brands)]
+
+    @classmethod
+    def from_options(cls, item: str, category: str, options: List[Dict[str, Any]]) -> "ItemOptions":
+        """
+        Builds the table from option dicts (as extracted or cached).
+        """
+        columns: Dict[str, list] = {
+            name: [] for name in ("names", "prices", "ratings", "brands", "categories", "descriptions")
+        }
+        for option in options:
+            try:
+                price = float(option["price"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            name = str(option.get("name", ""))
+            columns["names"].append(name)
+            columns["prices"].append(price)
+            columns["ratings"].append(option.get("rating"))
+            columns["brands"].append(option.get("brand"))
+            columns["categories"].append(option.get("category") or category)
+            columns["descriptions"].append(option.get("description") or "")
+        return cls(item, category, **columns)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> ProductOption:
+        name, brand = self.names[index], self.brands[index]
+        category = self.categories[index] if self.categories else self.category
+        description = self.descriptions[index] if self.descriptions else ""
+        return ProductOption(product_id(name, brand), name, self.prices[index], self.ratings[index], brand,
+                             category, description)
+
+    def __iter__(self) -> Iterator[ProductOption]:
+        return (self[index] for index in range(len(self.names)))
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, ItemOptions) and self._asdict() == other._asdict()
+
+    def __repr__(self) -> str:
+        # Also what input hashes see, so it covers every column.
+        return f"ItemOptions({self._asdict()!r})"
+
+    def _asdict(self) -> Dict[str, Any]:
+        # The checkpoint serializer stores objects with `_asdict` as their keyword arguments.
+        return {
+            "item": self.item,
+            "category": self.category,
+            "names": self.names,
+            "prices": self.prices,
+            "ratings": self.ratings,
+            "brands": self.brands,
+            "categories": self.categories,
+            "descriptions": self.descriptions,
+        }
+
+    def options(self, description: bool = True) -> List[Dict[str, Any]]:
+        return [option.to_dict(description) for option in self]
+
+    def to_dict(self, description: bool = True) -> Dict[str, Any]:
+        return {"item": self.item, "category": self.category, "options": self.options(description)}
+
+
+def as_item_options(products: Optional[List[Any]]) -> List[ItemOptions]:
+    """
+    Reads the state's `products`, converting entries checkpointed as plain dicts.
+    """
+    return [
+        product if isinstance(product, ItemOptions)
+        else ItemOptions.from_options(product.get("item"), product.get("category"), product.get("options") or [])
+        for product in products or []
+    ]
@@ -0,0 +1,498 @@
+import asyncio
+import contextlib
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from agents.config import (
+    CIRCUIT_COOLDOWN,
+    CIRCUIT_FAILURES,
+    PROVIDER_BACKOFF,
+    PROVIDER_MAX_BACKOFF,
+    PROVIDER_RESERVE,
+    PROVIDER_RETRIES,
+)
+from agents.search_compaction import estimate_tokens
+from agents.tracing import record_event
+
+# Call priorities, highest first. Interactive calls are made while someone waits on the
+# answer; batch calls plan many carts at once; background calls (prefetch and catalog
+# refresh) are speculative.
+INTERACTIVE, BATCH, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = ("interactive", "batch", "background")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("call_priority", default=INTERACTIVE)
+
+_STATUS_PATTERN = re.compile(r"\b(429|50[0-4])\b")
+_RETRY_AFTER_PATTERN = re.compile(r"retry(?:[ _-]?delay|[ _-]?after)?\W{0,4}(?:in\s+)?(\d+(?:\.\d+)?)\s*s", re.I)
+_TRANSIENT_NAMES = ("Timeout", "Connection", "ServiceUnavailable", "DeadlineExceeded")
+
+# Throttling halves the request rate; each successful call then gives back one request
+# per minute of it, until the configured (or learned) rate is reached again.
+_DECREASE = 0.5
+_MIN_SCALE = 0.05
+# 429s arriving together come from one burst, so they only slow the rate down once.
+_THROTTLE_GRACE = 1.0
+# A learned rate is dropped after this many seconds without a 429.
+_RELEARN_AFTER = 300.0
+# Longest a waiting caller sleeps before looking again, so priorities and circuit
+# changes are noticed promptly.
+_MAX_POLL = 0.5
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a provider whose circuit is open after repeated failures.
+    """
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} is unavailable; circuit open for another {retry_in:.1f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+@contextlib.contextmanager
+def call_priority(level: int) -> Iterator[None]:
+    """
+    Runs provider calls made inside the block, and in tasks started from it, at `level`.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def run_at_priority(level: int, fn: Callable[..., Any], *args) -> Any:
+    """
+    Calls `fn(*args)` with its provider calls made at `level`.
+    """
+    with call_priority(level):
+        return fn(*args)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """
+    The HTTP status behind a provider error, read from the exception (or the response
+    or exception it wraps) or from its message. None when there is none.
+    """
+    for source in (error, getattr(error, "response", None), error.__cause__):
+        for attribute in ("status_code", "status", "code"):
+            value = getattr(source, attribute, None)
+            if isinstance(value, int) and not isinstance(value, bool) and 100 <= value < 600:
+                return value
+    text = str(error)
+    match = _STATUS_PATTERN.search(text)
+    if match:
+        return int(match.group(1))
+    if "RESOURCE_EXHAUSTED" in text or "rate limit" in text.lower():
+        return 429
+    if "UNAVAILABLE" in text:
+        return 503
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Seconds the provider asked callers to wait, from a Retry-After header or a
+    "retry in 12s" style hint in the message. None when it gave none.
+    """
+    for source in (error, getattr(error, "response", None)):
+        headers = getattr(source, "headers", None)
+        value = headers.get("Retry-After") if headers is not None else None
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+    match = _RETRY_AFTER_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def _transient(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(name in type(error).__name__ for name in _TRANSIENT_NAMES)
+
+
+def _payload_tokens(payload: Any) -> int:
+    if not isinstance(payload, (list, tuple)):
+        return estimate_tokens(payload)
+    return sum(
+        estimate_tokens(message.get("content", "") if isinstance(message, dict) else getattr(message, "content", message))
+        for message in payload
+    )
+
+
+def _reply_tokens(result: Any) -> int:
+    usage = getattr(result, "usage_metadata", None)
+    if isinstance(usage, dict) and usage.get("output_tokens"):
+        return int(usage["output_tokens"])
+    content = getattr(result, "content", None)
+    return estimate_tokens(content) if content else 0
+
+
+class _Bucket:
+    """
+    Token bucket holding up to a minute's worth of `per_minute`, refilled continuously.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute * scale / 60)
+        self.updated = now
+
+    def wait(self, need: float, scale: float) -> float:
+        # Seconds until `need` tokens are in the bucket; a need over the bucket's size
+        # only waits for a full bucket.
+        return max(0.0, min(need, self.per_minute) - self.level) * 60 / (self.per_minute * scale)
+
+
+class ProviderLimiter:
+    """
+    Rate limiter, retry policy and circuit breaker for one provider, shared by every
+    thread and event loop in the process.
+
+    Calls are held to `rpm` requests and `tpm` estimated tokens per minute (0 is
+    unlimited). When the provider answers 429 anyway its Retry-After is honored and
+    the rate is halved, then creeps back up with each successful call; with no limit
+    set, the first 429 instead starts limiting at the rate calls were succeeding. Batch and background calls wait
+    while higher-priority calls are waiting, and leave `reserve` of each limit free.
+    After `failures` consecutive 5xx replies, timeouts or connection errors the circuit
+    opens: calls fail fast with `CircuitOpenError` for `cooldown` seconds, then a single
+    call is let through to probe whether the provider has recovered.
+    """
+
+    def __init__(self, name: str, rpm: float = 0.0, tpm: float = 0.0, retries: int = PROVIDER_RETRIES,
+                 backoff: float = PROVIDER_BACKOFF, max_backoff: float = PROVIDER_MAX_BACKOFF,
+                 reserve: float = PROVIDER_RESERVE, failures: int = CIRCUIT_FAILURES,
+                 cooldown: float = CIRCUIT_COOLDOWN):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reserve = reserve
+        self.failure_threshold = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._recent: deque = deque()  # when recent calls succeeded
+        self._waiting = [0] * len(PRIORITY_NAMES)
+        self._waited = [0.0] * len(PRIORITY_NAMES)
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._blocked_until = 0.0
+        self._throttled_at = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.retried = 0
+        self.errors = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        """
+        Sets new limits (None keeps the current one) and forgets what was learned.
+        """
+        with self._lock:
+            if rpm is not None:
+                self.rpm = max(0.0, rpm)
+            if tpm is not None:
+                self.tpm = max(0.0, tpm)
+            self.scale = 1.0
+            self._learned_rpm = 0.0
+            self._requests = _Bucket(self.rpm) if self.rpm else None
+            self._tokens = _Bucket(self.tpm) if self.tpm else None
+
+    @property
+    def effective_rpm(self) -> float:
+        return (self.rpm or self._learned_rpm) * self.scale
+
+    def _check_circuit(self, now: float) -> None:
+        # Once the cooldown is over one call may go out to probe the provider; the rest
+        # keep failing fast until it is back.
+        if self._opened_at is None:
+            return
+        retry_in = self._opened_at + self.cooldown - now
+        probing = self._probe_at is not None and now - self._probe_at < self.cooldown
+        if retry_in <= 0 and not probing:
+            return
+        self.rejected += 1
+        record_event("circuit_rejections")
+        raise CircuitOpenError(self.name, max(0.0, retry_in))
+
+    def _take(self, cost: int, count: int, priority: int) -> float:
+        """
+        Takes `count` requests and `cost` tokens if `priority` may have them now and
+        returns 0.0; otherwise returns how long to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._check_circuit(now)
+            if now < self._blocked_until:
+                return min(self._blocked_until - now, _MAX_POLL)
+            if any(self._waiting[level] for level in range(priority)):
+                return _MAX_POLL / 5
+            headroom = self.reserve if priority > INTERACTIVE else 0.0
+            wait = 0.0
+            for bucket, need in ((self._requests, count), (self._tokens, cost)):
+                if bucket is not None:
+                    bucket.refill(now, self.scale)
+                    wait = max(wait, bucket.wait(need + headroom * bucket.per_minute, self.scale))
+            if wait > 0:
+                return min(wait, _MAX_POLL)
+            for bucket, need in ((self._requests, count), (self._tokens, cost)):
+                if bucket is not None:
+                    bucket.level -= need
+            if self._opened_at is not None:
+                self._probe_at = now
+            self.calls += count
+            return 0.0
+
+    def acquire(self, cost: int = 0, count: int = 1) -> None:
+        """
+        Blocks until `count` requests costing `cost` tokens may go out at the caller's
+        priority. Raises `CircuitOpenError` if the circuit is open.
+        """
+        priority = current_priority()
+        wait = self._take(cost, count, priority)
+        if wait <= 0:
+            return
+        started = time.monotonic()
+        self._enter(priority)
+        try:
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._take(cost, count, priority)
+        finally:
+            self._leave(priority, time.monotonic() - started)
+
+    async def aacquire(self, cost: int = 0, count: int = 1) -> None:
+        """
+        Async variant of `acquire`.
+        """
+        priority = current_priority()
+        wait = self._take(cost, count, priority)
+        if wait <= 0:
+            return
+        started = time.monotonic()
+        self._enter(priority)
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._take(cost, count, priority)
+        finally:
+            self._leave(priority, time.monotonic() - started)
+
+    def _enter(self, priority: int) -> None:
+        with self._lock:
+            self._waiting[priority] += 1
+
+    def _leave(self, priority: int, waited: float) -> None:
+        with self._lock:
+            self._waiting[priority] -= 1
+            self._waited[priority] += waited
+
+    def succeeded(self, tokens: int = 0) -> None:
+        """
+        Records a successful call, charging the `tokens` of its reply.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent[0] < now - 60:
+                self._recent.popleft()
+            if self._tokens is not None and tokens:
+                self._tokens.level -= tokens
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + 1 / max(1.0, self.rpm or self._learned_rpm))
+            elif self._learned_rpm and now - self._throttled_at > _RELEARN_AFTER:
+                # Quotas change: stop holding to a learned rate once it has gone unchallenged.
+                self._learned_rpm = 0.0
+                self._requests = None
+            self._close_circuit()
+
+    def _close_circuit(self) -> None:
+        self._failures = 0
+        if self._opened_at is not None:
+            print(f"{self.name} has recovered; closing its circuit")
+            self._opened_at = self._probe_at = None
+
+    def failed(self, error: BaseException, attempt: int) -> Optional[float]:
+        """
+        Records a failed call. Returns how long to wait before retrying it, or None when
+        it should not be retried: the error is not a throttle or a transient failure, or
+        this was the last of the retries.
+        """
+        status = error_status(error)
+        with self._lock:
+            now = time.monotonic()
+            self.errors += 1
+            if status == 429:
+                wait = retry_after(error)
+                self._throttle(now, wait)
+            elif (status is not None and status >= 500) or _transient(error):
+                wait = None
+                self._failures += 1
+                if self._opened_at is not None or self._failures >= self.failure_threshold:
+                    if self._opened_at is None:
+                        self.circuit_opens += 1
+                        record_event("circuit_opens")
+                        print(f"{self.name} failed {self._failures} times in a row; opening its circuit "
+                              f"for {self.cooldown:g}s")
+                    self._opened_at = now
+                    self._probe_at = None
+            else:
+                # The provider answered, just not with something worth retrying.
+                self._close_circuit()
+                return None
+            if attempt >= self.retries:
+                return None
+            self.retried += 1
+        record_event("provider_retries")
+        # Full jitter keeps callers that failed together from retrying together.
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(delay, wait or 0.0)
+
+    def _throttle(self, now: float, wait: Optional[float]) -> None:
+        self.throttled += 1
+        record_event("provider_throttles")
+        if wait:
+            self._blocked_until = max(self._blocked_until, now + wait)
+        if now - self._throttled_at < _THROTTLE_GRACE:
+            return
+        self._throttled_at = now
+        if not self.rpm and not self._learned_rpm:
+            # No limit was set: start from how many calls the provider accepted this past minute.
+            self._learned_rpm = max(1.0, float(len(self._recent)))
+            self._requests = _Bucket(self._learned_rpm)
+        else:
+            self.scale = max(_MIN_SCALE, self.scale * _DECREASE)
+        for bucket in (self._requests, self._tokens):
+            if bucket is not None:
+                bucket.level = min(bucket.level, 0.0)
+                bucket.updated = now
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            if self._opened_at is None:
+                circuit = "closed"
+            elif now < self._opened_at + self.cooldown:
+                circuit = "open"
+            else:
+                circuit = "half_open"
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "effective_rpm": round(self.effective_rpm, 1),
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "circuit": circuit,
+                "circuit_opens": self.circuit_opens,
+                "waiting": dict(zip(PRIORITY_NAMES, self._waiting)),
+                "waited_s": {name: round(waited, 3) for name, waited in zip(PRIORITY_NAMES, self._waited)},
+            }
+
+
+class RateLimitedClient:
+    """
+    Wraps an LLM or search client so every call goes through `limiter`: it waits for its
+    share of the limits, fails fast while the circuit is open, and is retried with
+    jittered backoff on 429s, 5xx replies, timeouts and connection errors. In a batch
+    call each input counts as a request, and failed inputs are retried one by one.
+    Other attributes pass straight through.
+    """
+
+    def __init__(self, client: Any, limiter: ProviderLimiter):
+        self.client = client
+        self.limiter = limiter
+
+    def _cost(self, payload: Any) -> int:
+        return _payload_tokens(payload) if self.limiter.tpm else 0
+
+    def _done(self, result: Any) -> Any:
+        self.limiter.succeeded(_reply_tokens(result) if self.limiter.tpm else 0)
+        return result
+
+    def invoke(self, payload, *args, **kwargs):
+        cost = self._cost(payload)
+        attempt = 0
+        while True:
+            self.limiter.acquire(cost)
+            try:
+                return self._done(self.client.invoke(payload, *args, **kwargs))
+            except Exception as e:
+                delay = self.limiter.failed(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def ainvoke(self, payload, *args, **kwargs):
+        return await self._acall(payload, args, kwargs)
+
+    async def _acall(self, payload: Any, args: Tuple, kwargs: Dict[str, Any], attempt: int = 0) -> Any:
+        cost = self._cost(payload)
+        while True:
+            await self.limiter.aacquire(cost)
+            try:
+                return self._done(await self.client.ainvoke(payload, *args, **kwargs))
+            except Exception as e:
+                delay = self.limiter.failed(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _retry_input(self, payload: Any, delay: float, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        await asyncio.sleep(delay)
+        try:
+            return await self._acall(payload, args, kwargs, attempt=1)
+        except Exception as e:
+            return e
+
+    async def _abatch(self, abatch, inputs: List[Any], *args, return_exceptions: bool = False, **kwargs) -> List[Any]:
+        await self.limiter.aacquire(sum(self._cost(payload) for payload in inputs), len(inputs))
+        results = list(await abatch(inputs, *args, return_exceptions=True, **kwargs))
+        retries = {}
+        for index, result in enumerate(results):
+            if not isinstance(result, Exception):
+                self._done(result)
+                continue
+            delay = self.limiter.failed(result, 0)
+            if delay is not None:
+                retries[index] = self._retry_input(inputs[index], delay, args, kwargs)
+        for index, result in zip(retries, await asyncio.gather(*retries.values())):
+            results[index] = result
+        if not return_exceptions:
+            error = next((result for result in results if isinstance(result, Exception)), None)
+            if error is not None:
+                raise error
+        return results
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.client, name)
+        if name != "abatch":
+            return attr
+
+        async def abatch(inputs, *args, **kwargs):
+            return await self._abatch(attr, inputs, *args, **kwargs)
+
+        return abatch
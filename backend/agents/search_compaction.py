@@ -0,0 +1,197 @@
+import re
+import threading
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlparse
+
+from agents.config import (
+    COMPACTION_TOKEN_BUDGET,
+    COMPACTION_SNIPPET_CHARS,
+    COMPACTION_DIRECT_MIN_OPTIONS,
+)
+
+PRICE_PATTERN = re.compile(r"\$\s?(\d{1,4}(?:,\d{3})*(?:\.\d{1,2})?)")
+RATING_PATTERN = re.compile(
+    r"(\d(?:\.\d{1,2})?)\s*(?:out of 5|/\s?5|stars?)", re.IGNORECASE
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+TITLE_SUFFIX_PATTERN = re.compile(r"\s*[-|]\s*walmart\.com\s*$", re.IGNORECASE)
+
+# Results whose titles share at least this fraction of tokens are treated as duplicates.
+DUPLICATE_SIMILARITY = 0.8
+
+
+def estimate_tokens(text: Any) -> int:
+    """
+    Rough token count (about 4 characters per token) used for prompt budgeting.
+    """
+    return len(str(text)) // 4 + 1
+
+
+def _tokens(text: str) -> set:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def extract_price(text: str) -> Optional[float]:
+    match = PRICE_PATTERN.search(text or "")
+    if not match:
+        return None
+    try:
+        price = float(match.group(1).replace(",", ""))
+    except ValueError:
+        return None
+    return price if price > 0 else None
+
+
+def extract_rating(text: str) -> Optional[float]:
+    for match in RATING_PATTERN.finditer(text or ""):
+        rating = float(match.group(1))
+        if 0 <= rating <= 5:
+            return rating
+    return None
+
+
+def is_walmart_url(url: str) -> bool:
+    host = urlparse(url or "").netloc.lower()
+    return host == "walmart.com" or host.endswith(".walmart.com")
+
+
+def is_product_page(url: str) -> bool:
+    return "/ip/" in urlparse(url or "").path
+
+
+def _raw_results(search_results: Any) -> List[Dict[str, Any]]:
+    if isinstance(search_results, dict):
+        results = search_results.get("results", [])
+    elif isinstance(search_results, list):
+        results = search_results
+    else:
+        return []
+    return [result for result in results if isinstance(result, dict)]
+
+
+def compact_search_results(item: str, search_results: Any,
+                           token_budget: int = COMPACTION_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Shrinks raw Tavily results to what the extractor needs: walmart.com results only,
+    near-duplicates removed, price and rating pulled out of the text, ranked by relevance
+    to `item` and cut to `token_budget` tokens.
+    """
+    item_tokens = _tokens(item)
+    candidates = []
+    for result in _raw_results(search_results):
+        url = result.get("url", "")
+        if not is_walmart_url(url):
+            continue
+        title = TITLE_SUFFIX_PATTERN.sub("", str(result.get("title") or "")).strip()
+        content = " ".join(str(result.get("content") or "").split())
+        text_tokens = _tokens(f"{title} {content}")
+        overlap = len(item_tokens & text_tokens) / len(item_tokens) if item_tokens else 0.0
+        title_overlap = len(item_tokens & _tokens(title)) / len(item_tokens) if item_tokens else 0.0
+        try:
+            score = float(result.get("score") or 0.0)
+        except (TypeError, ValueError):
+            score = 0.0
+        candidates.append({
+            "title": title,
+            "url": url.split("?")[0],
+            "price": extract_price(f"{title} {content}"),
+            "rating": extract_rating(content),
+            "snippet": content[:COMPACTION_SNIPPET_CHARS],
+            "relevance": title_overlap + overlap + score,
+        })
+
+    candidates.sort(key=lambda candidate: candidate["relevance"], reverse=True)
+
+    compacted: List[Dict[str, Any]] = []
+    seen_title_tokens: List[set] = []
+    seen_urls = set()
+    used_tokens = 0
+    for candidate in candidates:
+        if candidate["url"] in seen_urls:
+            continue
+        title_tokens = _tokens(candidate["title"])
+        if title_tokens and any(
+            len(title_tokens & seen) / len(title_tokens | seen) >= DUPLICATE_SIMILARITY
+            for seen in seen_title_tokens
+        ):
+            continue
+
+        entry = {key: value for key, value in candidate.items() if key != "relevance" and value is not None}
+        tokens = estimate_tokens(entry)
+        if compacted and used_tokens + tokens > token_budget:
+            break
+        compacted.append(entry)
+        used_tokens += tokens
+        seen_urls.add(candidate["url"])
+        seen_title_tokens.append(title_tokens)
+
+    return compacted
+
+
+def options_from_compacted(category: str, compacted: List[Dict[str, Any]],
+                           min_options: int = COMPACTION_DIRECT_MIN_OPTIONS) -> Optional[List[Dict[str, Any]]]:
+    """
+    Builds product options straight from product-page results with a cleanly parsed price,
+    so the LLM can be skipped. Returns None if fewer than `min_options` such results exist.
+    """
+    options = []
+    for result in compacted:
+        if result.get("price") is None or not result.get("title") or not is_product_page(result.get("url", "")):
+            continue
+        options.append({
+            "name": result["title"],
+            "price": result["price"],
+            "rating": result.get("rating"),
+            "brand": None,
+            "category": category,
+            "description": result.get("snippet", "")[:160],
+        })
+        if len(options) == 5:
+            break
+
+    if min_options <= 0 or len(options) < min_options:
+        return None
+    return options
+
+
+class CompactionMeter:
+    """
+    Counts prompt tokens before and after compaction, and how many items skipped the LLM.
+    Every meter also feeds the process-wide totals in `compaction_totals`.
+    """
+
+    def __init__(self, parent: Optional["CompactionMeter"] = None):
+        self.parent = parent
+        self.raw_tokens = 0
+        self.compacted_tokens = 0
+        self.items = 0
+        self.llm_skipped = 0
+        self._lock = threading.Lock()
+
+    def add(self, raw_tokens: int, compacted_tokens: int, llm_skipped: bool = False) -> None:
+        with self._lock:
+            self.raw_tokens += raw_tokens
+            self.compacted_tokens += compacted_tokens
+            self.items += 1
+            self.llm_skipped += int(llm_skipped)
+        if self.parent is not None:
+            self.parent.add(raw_tokens, compacted_tokens, llm_skipped)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "items": self.items,
+            "raw_tokens": self.raw_tokens,
+            "compacted_tokens": self.compacted_tokens,
+            "tokens_saved": self.raw_tokens - self.compacted_tokens,
+            "llm_skipped": self.llm_skipped,
+        }
+
+
+compaction_totals = CompactionMeter()
+
+
+def compaction_stats() -> Dict[str, int]:
+    """
+    Returns token savings accumulated by this process.
+    """
+    return compaction_totals.summary()
@@ -1,5 +1,9 @@
 from typing_extensions import TypedDict, NotRequired, Literal, Optional
-from typing import List, Dict, Any
+from typing import Annotated, List, Dict, Any
+
+from agents.tracing import merge_trace
+from agents.incremental import merge_hashes
+from agents.products import ItemOptions
 
 class InputInterpreterInputState(TypedDict):
     user_input: str
@@ -8,6 +12,7 @@ class InputInterpreterInputState(TypedDict):
 
 class InputInterpreterOutputState(TypedDict):
     optimized_products: Optional[List[Dict[str, Any]]]
+    trace: Annotated[List[Dict[str, Any]], merge_trace]
 
 class OverallState(TypedDict):
     # InputInterpreter fields
@@ -23,11 +28,17 @@ class OverallState(TypedDict):
     categories: NotRequired[Dict[str, str]]  # item -> category
 
     # ProductSearchAgent fields
-    products: NotRequired[List[Dict[str, Any]]]  # List of items with multiple product options
+    products: NotRequired[List[ItemOptions]]  # Per-item option tables (see agents.products)
 
     # BudgetOptimizerAgent fields
     optimized_products: Optional[List[Dict[str, Any]]]
 
     # CartBuilderAgent fields
     cart_url: NotRequired[str]
+
+    # Per-node trace summaries for the current request (see agents.tracing)
+    trace: Annotated[List[Dict[str, Any]], merge_trace]
+
+    # Content hash of each node's inputs when it last ran (see agents.incremental)
+    input_hashes: Annotated[Dict[str, str], merge_hashes]
     
\ No newline at end of file
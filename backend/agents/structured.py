@@ -0,0 +1,330 @@
+import ast
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Literal, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, RootModel, ValidationError, field_validator, model_validator
+
+from agents.config import PARSE_RETRIES, PARSE_BACKOFF, PARSE_MAX_BACKOFF
+from agents.tracing import record_event
+
+
+class StructuredOutputError(ValueError):
+    """
+    Raised when a model reply is still not valid for its schema after repair and retries.
+    """
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """
+    Reads numbers the way models write them: 12.99, "12.99", "$1,299.00", "12.99 USD".
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError("expected a number")
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d[\d,]*(?:\.\d+)?", str(value))
+    if match is None:
+        raise ValueError(f"expected a number, got {value!r}")
+    return float(match.group(0).replace(",", ""))
+
+
+def _clean_items(value: Any) -> Any:
+    if not isinstance(value, list):
+        return value
+    items = [str(item).strip() for item in value if item is not None and not isinstance(item, (dict, list))]
+    return list(dict.fromkeys(item for item in items if item))
+
+
+def _clean_categories(value: Any) -> Any:
+    # A blank or non-string category counts as missing, so only that item is retried.
+    if not isinstance(value, dict):
+        return value
+    return {
+        str(item).strip(): category.strip()
+        for item, category in value.items()
+        if isinstance(category, str) and category.strip()
+    }
+
+
+class InterpretedInput(BaseModel):
+    """a JSON object with task_type, item_list and budget"""
+
+    task_type: Literal["direct_product_list", "goal_or_dish"]
+    item_list: List[str] = Field(default_factory=list)
+    budget: Optional[float] = None
+
+    _items = field_validator("item_list", mode="before")(_clean_items)
+    _budget = field_validator("budget", mode="before")(_to_float)
+
+
+class ExpandedItems(RootModel[List[str]]):
+    """a JSON array of item names"""
+
+    _items = field_validator("root", mode="before")(_clean_items)
+
+
+class Categories(RootModel[Dict[str, str]]):
+    """a JSON object mapping each item to a category name"""
+
+    _categories = field_validator("root", mode="before")(_clean_categories)
+
+
+class Plan(InterpretedInput):
+    """a JSON object with task_type, item_list, budget, expanded_items and categories"""
+
+    expanded_items: List[str] = Field(default_factory=list)
+    categories: Dict[str, str] = Field(default_factory=dict)
+
+    _expanded = field_validator("expanded_items", mode="before")(_clean_items)
+    _categories = field_validator("categories", mode="before")(_clean_categories)
+
+
+class ProductOption(BaseModel):
+    """a product object with name, price, rating, brand, category and description"""
+
+    model_config = ConfigDict(extra="allow")
+
+    name: str = Field(min_length=1)
+    price: float = Field(gt=0)
+    rating: Optional[float] = None
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    description: Optional[str] = None
+
+    _price = field_validator("price", mode="before")(_to_float)
+
+    @field_validator("rating", mode="before")
+    @classmethod
+    def _lenient_rating(cls, value: Any) -> Optional[float]:
+        try:
+            return _to_float(value)
+        except ValueError:
+            return None
+
+
+class ProductOptions(RootModel[List[ProductOption]]):
+    """a JSON array of up to 5 product objects with name, price, rating, brand, category and description"""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _keep_valid(cls, value: Any) -> Any:
+        # Options without a name or a usable price are dropped rather than failing the item.
+        if not isinstance(value, list):
+            return value
+        valid = []
+        for option in value:
+            try:
+                valid.append(ProductOption.model_validate(option))
+            except ValidationError:
+                continue
+        return valid[:5]
+
+
+class ProductOptionsByItem(RootModel[Dict[str, ProductOptions]]):
+    """a JSON object mapping each item name to a JSON array of up to 5 product objects"""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _keep_lists(cls, value: Any) -> Any:
+        # Items whose value is not an array are left out so they can be retried on their own.
+        if not isinstance(value, dict):
+            return value
+        return {str(item): options for item, options in value.items() if isinstance(options, list)}
+
+
+class SelectedProduct(ProductOption):
+    """a selected product object with item, name and price"""
+
+    item: str = Field(min_length=1)
+
+
+class Selection(RootModel[List[SelectedProduct]]):
+    """a JSON array of selected product objects, each with item, name and price"""
+
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def _outermost(text: str) -> str:
+    """
+    The span from the first opening bracket to its match, or to the last point where the
+    text was still well-formed if the reply was cut off, with the open brackets closed.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return text
+    stack: List[str] = []
+    in_string = escaped = False
+    last_complete: Optional[Tuple[int, List[str]]] = None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return text[start:i + 1]
+            last_complete = (i, list(stack))
+    if last_complete is None:
+        return text[start:]
+    end, still_open = last_complete
+    return text[start:end + 1] + "".join(reversed(still_open))
+
+
+def loads_lenient(text: str) -> Tuple[Any, bool]:
+    """
+    Parses JSON from a model reply. Clean JSON (fenced or not) is parsed as-is; otherwise
+    a repair pass drops surrounding prose, smart quotes and trailing commas, closes a
+    truncated reply, and accepts Python-style literals. Returns (value, repaired).
+    """
+    text = text.strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError as e:
+        error = e
+
+    candidate = _TRAILING_COMMA.sub(r"\1", _outermost(text.translate(_SMART_QUOTES)))
+    try:
+        return json.loads(candidate), True
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError(f"not valid JSON: {error}") from None
+    if not isinstance(value, (dict, list)):
+        raise ValueError(f"not valid JSON: {error}")
+    return value, True
+
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def count_event(schema: Type[BaseModel], event: str) -> None:
+    """
+    Counts a parsing outcome for `schema`, also as a `wally_parse_<event>_total` metric.
+    """
+    with _stats_lock:
+        counts = _stats.setdefault(schema.__name__, {})
+        counts[event] = counts.get(event, 0) + 1
+    if event != "parsed":
+        record_event(f"parse_{event}")
+
+
+def parse_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Per-schema counts of replies parsed, repaired, rejected (errors), retried and given up on (failures).
+    """
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def _describe(error: ValidationError) -> str:
+    problems = []
+    for detail in error.errors()[:5]:
+        where = ".".join(str(part) for part in detail["loc"]) or "reply"
+        problems.append(f"{where}: {detail['msg']}")
+    return "; ".join(problems)
+
+
+def parse(response: Any, schema: Type[BaseModel]) -> Any:
+    """
+    Validates a model reply (a message or its text) against `schema` and returns plain
+    Python data. Raises StructuredOutputError if it can't be parsed even after repair.
+    """
+    text = getattr(response, "content", response)
+    if not isinstance(text, str) or not text.strip():
+        count_event(schema, "errors")
+        raise StructuredOutputError("empty reply")
+    try:
+        value, repaired = loads_lenient(text)
+        result = schema.model_validate(value)
+    except ValueError as e:
+        # pydantic's ValidationError is a ValueError too.
+        count_event(schema, "errors")
+        raise StructuredOutputError(_describe(e) if isinstance(e, ValidationError) else str(e)) from None
+    count_event(schema, "repairs" if repaired else "parsed")
+    return result.model_dump()
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with jitter for retry number `attempt` (0-based).
+    """
+    return min(PARSE_MAX_BACKOFF, PARSE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _retry_messages(prompt: str, response: Any, schema: Type[BaseModel], error: StructuredOutputError) -> List[Dict[str, str]]:
+    messages = [{"role": "user", "content": prompt}]
+    reply = getattr(response, "content", None)
+    if isinstance(reply, str) and reply.strip():
+        messages.append({"role": "assistant", "content": reply})
+    messages.append({
+        "role": "user",
+        "content": f"That reply was not valid ({error}). Respond again with ONLY {schema.__doc__.strip()}, "
+                   "and no other text.",
+    })
+    return messages
+
+
+def invoke_structured(llm, prompt: str, schema: Type[BaseModel], retries: int = PARSE_RETRIES) -> Any:
+    """
+    Sends `prompt` and returns the reply parsed against `schema`. An invalid reply is
+    answered with the validation error, after an exponential backoff, up to `retries`
+    times. Raises StructuredOutputError once retries run out.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    for attempt in range(retries + 1):
+        response = llm.invoke(messages)
+        try:
+            return parse(response, schema)
+        except StructuredOutputError as e:
+            if attempt >= retries:
+                count_event(schema, "failures")
+                raise
+            count_event(schema, "retries")
+            time.sleep(backoff_delay(attempt))
+            messages = _retry_messages(prompt, response, schema, e)
+
+
+async def ainvoke_structured(llm, prompt: str, schema: Type[BaseModel], retries: int = PARSE_RETRIES) -> Any:
+    """
+    Async variant of `invoke_structured`.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    for attempt in range(retries + 1):
+        response = await llm.ainvoke(messages)
+        try:
+            return parse(response, schema)
+        except StructuredOutputError as e:
+            if attempt >= retries:
+                count_event(schema, "failures")
+                raise
+            count_event(schema, "retries")
+            await asyncio.sleep(backoff_delay(attempt))
+            messages = _retry_messages(prompt, response, schema, e)
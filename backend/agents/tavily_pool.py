@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Dict, Mapping, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from agents.config import SEARCH_MAX_RESULTS, SEARCH_POOL_SIZE, SEARCH_TIMEOUT
+
+TAVILY_API_URL = "https://api.tavily.com"
+
+
+class TavilyAPIError(RuntimeError):
+    """
+    A non-200 answer from the Tavily API. Carries the status and response headers so
+    the rate limiter can retry, honour Retry-After or open its circuit.
+    """
+
+    def __init__(self, status_code: int, message: str, headers: Optional[Mapping[str, str]] = None):
+        super().__init__(f"Error {status_code}: {message}")
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+
+
+def _error_message(body: Any, default: str) -> str:
+    detail = body.get("detail") if isinstance(body, dict) else None
+    if isinstance(detail, dict) and detail.get("error"):
+        return str(detail["error"])
+    return str(detail or default)
+
+
+class PooledTavilySearch:
+    """
+    Tavily search client that calls the public REST API over reused HTTP connections:
+    one pooled requests.Session, and one aiohttp session per event loop, with keep-alive.
+    `invoke` and `ainvoke` take a query (or a dict of search parameters) and return the
+    raw JSON answer, like the `TavilySearch` tool it stands in for.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_results: int = SEARCH_MAX_RESULTS,
+        timeout: float = SEARCH_TIMEOUT,
+        pool_size: int = SEARCH_POOL_SIZE,
+        url: str = TAVILY_API_URL,
+    ):
+        api_key = api_key or os.getenv("TAVILY_API_KEY")
+        if not api_key:
+            raise ValueError("TAVILY_API_KEY is not set.")
+        self.url = url.rstrip("/") + "/search"
+        self.max_results = max_results
+        self.timeout = timeout or None
+        self.pool_size = pool_size
+        self._headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self._session: Optional[requests.Session] = None
+        self._async_sessions: "weakref.WeakKeyDictionary[Any, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _params(self, query: Any, **kwargs) -> Dict[str, Any]:
+        params = dict(query) if isinstance(query, Mapping) else {"query": str(query)}
+        params = {"max_results": self.max_results, **params, **kwargs}
+        return {k: v for k, v in params.items() if v is not None}
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(self._headers)
+                self._session = session
+            return self._session
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                headers=self._headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._async_sessions[loop] = session
+        return session
+
+    def invoke(self, query: Any, *args, **kwargs) -> Dict[str, Any]:
+        response = self._get_session().post(self.url, json=self._params(query), timeout=self.timeout)
+        if response.status_code != 200:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            raise TavilyAPIError(response.status_code, _error_message(body, response.reason), response.headers)
+        return response.json()
+
+    async def ainvoke(self, query: Any, *args, **kwargs) -> Dict[str, Any]:
+        session = self._get_async_session()
+        async with session.post(self.url, json=self._params(query)) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = None
+            if response.status != 200:
+                raise TavilyAPIError(response.status, _error_message(body, response.reason), response.headers)
+            return body
+
+    async def aclose(self) -> None:
+        """
+        Closes the aiohttp session bound to the running event loop, if any.
+        """
+        session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
@@ -0,0 +1,456 @@
+import atexit
+import contextvars
+import json
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agents.config import TRACE_LOG, OTLP_ENDPOINT, OTLP_FLUSH_INTERVAL
+
+# Histogram buckets, in seconds, for node and client latencies.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class NodeSpan:
+    """
+    What one node execution did: wall time plus the LLM, search and cache activity made
+    from inside it.
+    """
+
+    def __init__(self, node: str, trace_id: str):
+        self.node = node
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = "ok"
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Compact form kept in the graph state; zero counters are left out.
+        """
+        summary = {"node": self.node, "trace_id": self.trace_id, "ms": round(self.duration * 1000, 1)}
+        if self.status != "ok":
+            summary["status"] = self.status
+        for name, value in sorted(self.counters.items()):
+            if name.endswith("_time"):
+                summary[name[:-len("_time")] + "_ms"] = round(value * 1000, 1)
+            else:
+                summary[name] = int(value)
+        return summary
+
+
+_current_span: contextvars.ContextVar[Optional[NodeSpan]] = contextvars.ContextVar("current_span", default=None)
+
+
+def detached_context() -> contextvars.Context:
+    """
+    Returns a copy of the current context with no node span, for background work that
+    outlives the node that started it.
+    """
+    context = contextvars.copy_context()
+    context.run(_current_span.set, None)
+    return context
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and latency histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, help_text: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, help_text: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def total(self, name: str) -> float:
+        """
+        Sum of a counter across all its labels.
+        """
+        with self._lock:
+            return sum(value for (counter, _), value in self._counters.items() if counter == name)
+
+    @staticmethod
+    def _labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{self._labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    lines.append(f"{name}_bucket{self._labels(labels, ('le', f'{bound:g}'))} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.total:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def render_prometheus() -> str:
+    """
+    Returns every metric recorded in this process in the Prometheus text format.
+    """
+    return metrics.render()
+
+
+class OTLPExporter:
+    """
+    Ships finished spans to an OpenTelemetry collector as OTLP/HTTP JSON, batching them
+    on a background thread so nodes never wait on the network.
+    """
+
+    def __init__(self, endpoint: str, flush_interval: float = OTLP_FLUSH_INTERVAL):
+        self.endpoint = endpoint
+        self.flush_interval = flush_interval
+        self._queue: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._warned = False
+        threading.Thread(target=self._loop, name="wally-otlp", daemon=True).start()
+        atexit.register(self.flush)
+
+    def export(self, span: NodeSpan, attributes: Dict[str, Any]) -> None:
+        end = span.started_at + span.duration
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.node,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.started_at * 1e9)),
+            "endTimeUnixNano": str(int(end * 1e9)),
+            "attributes": [_otlp_attribute(key, value) for key, value in attributes.items()],
+            "status": {"code": 1 if span.status == "ok" else 2},
+        }
+        with self._lock:
+            self._queue.append(otlp_span)
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            spans, self._queue = self._queue, []
+        if not spans:
+            return
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", "wally")]},
+            "scopeSpans": [{"scope": {"name": "agents.tracing"}, "spans": spans}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            if not self._warned:
+                print(f"Could not export spans to {self.endpoint}: {e}")
+                self._warned = True
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_exporter = OTLPExporter(OTLP_ENDPOINT) if OTLP_ENDPOINT else None
+_log_lock = threading.Lock()
+
+
+def _log(record: Dict[str, Any]) -> None:
+    if not TRACE_LOG:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        if TRACE_LOG in ("stderr", "stdout"):
+            print(line, file=getattr(sys, TRACE_LOG), flush=True)
+        else:
+            with open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def record(name: str, value: float = 1) -> None:
+    """
+    Adds to a counter on the node span that is currently running, if any.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.add(name, value)
+
+
+def record_event(event: str, count: int = 1) -> None:
+    """
+    Counts a notable event, such as "fallbacks" or "retries", against the current node.
+    """
+    if count <= 0:
+        return
+    span = _current_span.get()
+    record(event, count)
+    metrics.inc(f"wally_{event}_total", f"Number of {event} by node.", count,
+                node=span.node if span is not None else "none")
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    record("cache_hits" if hit else "cache_misses")
+    metrics.inc("wally_cache_requests_total", "Cache lookups by cache and result.",
+                cache=cache, result="hit" if hit else "miss")
+
+
+def _finish(span: NodeSpan) -> None:
+    metrics.inc("wally_node_runs_total", "Node executions by node and status.", node=span.node, status=span.status)
+    metrics.observe("wally_node_duration_seconds", "Node wall time.", span.duration, node=span.node)
+    attributes = {"wally.node": span.node, "wally.status": span.status}
+    try:
+        from langgraph.config import get_config
+
+        attributes["wally.thread_id"] = str(get_config()["configurable"].get("thread_id"))
+    except (RuntimeError, KeyError):
+        pass
+    attributes.update({f"wally.{name}": value for name, value in span.counters.items()})
+    _log({"event": "node", "trace_id": span.trace_id, "span_id": span.span_id, "ts": span.started_at,
+          "duration_ms": round(span.duration * 1000, 1), **attributes})
+    if _exporter is not None:
+        _exporter.export(span, attributes)
+
+
+def _start(node: str, state: Any, entry: bool) -> NodeSpan:
+    trace = None if entry or not isinstance(state, dict) else state.get("trace")
+    trace_id = trace[-1]["trace_id"] if trace else uuid.uuid4().hex
+    return NodeSpan(node, trace_id)
+
+
+def _attach(result: Any, span: NodeSpan, entry: bool) -> Any:
+    from langgraph.types import Command
+
+    summary = span.summary()
+    if entry:
+        summary["entry"] = True
+    if isinstance(result, Command):
+        update = dict(result.update or {})
+        update["trace"] = [summary]
+        return Command(graph=result.graph, update=update, resume=result.resume, goto=result.goto)
+    if isinstance(result, dict):
+        return {**result, "trace": [summary]}
+    return result
+
+
+def _is_interrupt(error: BaseException) -> bool:
+    from langgraph.errors import GraphInterrupt
+
+    return isinstance(error, GraphInterrupt)
+
+
+def trace_node(node: str, func: Callable, entry: bool = False) -> Callable:
+    """
+    Wraps a node so its execution is timed, the client calls it makes are counted, and a
+    summary is appended to the state's `trace`. `entry` marks the node that starts a request.
+    """
+    def traced(state):
+        span = _start(node, state, entry)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            result = func(state)
+        except BaseException as e:
+            span.status = "interrupted" if _is_interrupt(e) else "error"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            _finish(span)
+        return _attach(result, span, entry)
+
+    traced.__name__ = func.__name__
+    traced.__doc__ = func.__doc__
+    return traced
+
+
+def atrace_node(node: str, afunc: Callable, entry: bool = False) -> Callable:
+    """
+    Async variant of `trace_node`.
+    """
+    async def traced(state):
+        span = _start(node, state, entry)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            result = await afunc(state)
+        except BaseException as e:
+            span.status = "interrupted" if _is_interrupt(e) else "error"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            _finish(span)
+        return _attach(result, span, entry)
+
+    traced.__name__ = afunc.__name__
+    traced.__doc__ = afunc.__doc__
+    return traced
+
+
+def merge_trace(left: Optional[List[Dict[str, Any]]], right: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    State reducer for `trace`: appends node summaries, starting over when a new request
+    enters the graph on the same thread.
+    """
+    if not right:
+        return list(left or [])
+    if right[0].get("entry"):
+        return list(right)
+    return list(left or []) + list(right)
+
+
+def trace_summary(trace: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Totals a request's node summaries: overall node time and the summed counters.
+    """
+    totals: Dict[str, Any] = {"nodes": len(trace or []), "ms": 0.0}
+    for span in trace or []:
+        for key, value in span.items():
+            if key in ("node", "trace_id", "status", "entry"):
+                continue
+            totals[key] = round(totals.get(key, 0) + value, 1)
+    return totals
+
+
+def _message_chars(payload: Any) -> int:
+    if isinstance(payload, str):
+        return len(payload)
+    chars = 0
+    for message in payload if isinstance(payload, list) else [payload]:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", message)
+        chars += len(content) if isinstance(content, str) else len(str(content))
+    return chars
+
+
+class TracedClient:
+    """
+    Wraps the shared LLM or search client so every call is timed and counted against the
+    node that made it. Other attributes pass straight through.
+    """
+
+    def __init__(self, client: Any, kind: str):
+        self.client = client
+        self.kind = kind
+
+    def _done(self, payload: Any, result: Any, elapsed: float, failed: bool) -> None:
+        record(f"{self.kind}_calls")
+        record(f"{self.kind}_time", elapsed)
+        span = _current_span.get()
+        node = span.node if span is not None else "none"
+        metrics.inc(f"wally_{self.kind}_calls_total", f"{self.kind} calls by node and status.",
+                    node=node, status="error" if failed else "ok")
+        metrics.observe(f"wally_{self.kind}_latency_seconds", f"{self.kind} call latency.", elapsed, node=node)
+        if self.kind == "llm":
+            prompt_chars = _message_chars(payload)
+            record("prompt_chars", prompt_chars)
+            metrics.inc("wally_llm_prompt_chars_total", "Characters sent to the LLM.", prompt_chars, node=node)
+            if result is not None:
+                completion_chars = _message_chars(result)
+                record("completion_chars", completion_chars)
+                metrics.inc("wally_llm_completion_chars_total", "Characters received from the LLM.",
+                            completion_chars, node=node)
+        if failed:
+            record_event("errors")
+
+    def invoke(self, payload, *args, **kwargs):
+        start = time.perf_counter()
+        result, failed = None, True
+        try:
+            result = self.client.invoke(payload, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._done(payload, result, time.perf_counter() - start, failed)
+
+    async def ainvoke(self, payload, *args, **kwargs):
+        start = time.perf_counter()
+        result, failed = None, True
+        try:
+            result = await self.client.ainvoke(payload, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._done(payload, result, time.perf_counter() - start, failed)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+def traced_client(client: Any, kind: str) -> Any:
+    """
+    Returns `client` wrapped in a `TracedClient`, unless it already is one.
+    """
+    if client is None or isinstance(client, TracedClient):
+        return client
+    return TracedClient(client, kind)
+
+
+def untraced_client(client: Any) -> Any:
+    """
+    The client a `TracedClient` wraps, for wrapping it further before tracing it again.
+    """
+    return client.client if isinstance(client, TracedClient) else client
@@ -1,38 +1,86 @@
+import threading
+from typing import Any, Optional
+
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Command, interrupt
+from langgraph.errors import GraphInterrupt
 from agents.states import (
     InputInterpreterInputState,
     InputInterpreterOutputState,
     OverallState,
 )
 
-from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.runnables import RunnableLambda
 
-from agents.input_interpreter import input_interpreter
-from agents.item_extractor import item_expansion_agent
-from agents.category_assigner import category_inference_agent
-from agents.product_fetcher import product_search_agent
-from agents.budget_optimizer import budget_optimizer_agent
+from agents.input_interpreter import input_interpreter, ainput_interpreter
+from agents.item_extractor import item_expansion_agent, aitem_expansion_agent
+from agents.category_assigner import category_inference_agent, acategory_inference_agent
+from agents.product_fetcher import product_search_agent, aproduct_search_agent
+from agents.budget_optimizer import budget_optimizer_agent, abudget_optimizer_agent
 from agents.cart_builder import cart_builder_agent
+from agents.planner import fused_planner_agent, afused_planner_agent
+from agents.checkpointer import make_checkpointer
+from agents.tracing import trace_node, atrace_node
+from agents.prefetch import prefetcher, current_thread_id
+from agents.config import PLANNER_MODE, PRODUCT_SEARCH_ITEM_TIMEOUT
+
+
+def with_async(func, afunc) -> RunnableLambda:
+    """
+    Pairs a node with its async variant: the graph runs `func` under invoke/stream
+    and `afunc` under ainvoke/astream.
+    """
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
+
+
+def add_node(builder: StateGraph, name: str, func, afunc=None, entry: bool = False, **kwargs) -> None:
+    """
+    Registers a node wrapped in tracing, with its async variant when there is one.
+    `entry` marks the node each request starts at, which begins a fresh trace.
+    """
+    node = trace_node(name, func, entry=entry)
+    if afunc is not None:
+        node = with_async(node, atrace_node(name, afunc, entry=entry))
+    builder.add_node(name, node, **kwargs)
 
 
 def human_verification(state: OverallState) -> OverallState:
     """
     Pauses the graph to allow a human to review and edit the item list.
     This node will loop, re-prompting the user until they 'accept' the list.
+    For a goal or dish the expanded ingredients are reviewed, since those are what gets bought.
+    While the user reviews, products for the list on screen are prefetched in the background.
     """
-    current_list = state["item_list"]
+    review_key = "expanded_items" if state.get("expanded_items") else "item_list"
+    current_list = state[review_key]
+    categories = state.get("categories") or {}
+    thread_id = current_thread_id() if prefetcher is not None else None
     while True:
-        user_feedback = interrupt({
-            "task": "Please review the item list. You can 'accept' it or 'edit' it.",
-            "current_list": current_list
-        })
+        try:
+            user_feedback = interrupt({
+                "task": "Please review the item list. You can 'accept' it or 'edit' it.",
+                "current_list": current_list
+            })
+        except GraphInterrupt:
+            # Only the round that actually pauses prefetches; replayed rounds on resume don't.
+            if thread_id is not None:
+                prefetcher.sync(thread_id, current_list, categories)
+            raise
 
         action = user_feedback.get("action")
 
         if action == "accept":
             print("--- User accepted the list. Continuing graph execution. ---")
-            return {"item_list": current_list}
+            # Keep categories only for items still on the list; edited items get re-categorized
+            # unless the prefetch already did it.
+            kept = {item: categories[item] for item in current_list if item in categories}
+            if thread_id is not None:
+                missing = [item for item in current_list if item not in kept]
+                kept.update(prefetcher.categories(thread_id, missing, PRODUCT_SEARCH_ITEM_TIMEOUT))
+            return {
+                review_key: current_list,
+                "categories": {item: kept[item] for item in current_list if item in kept},
+            }
         elif action == "edit":
             new_list = user_feedback.get("editedList")
             if new_list is not None:
@@ -45,37 +93,96 @@ def human_verification(state: OverallState) -> OverallState:
 
 
 
-builder = StateGraph(
-    OverallState,
-    input_schema=InputInterpreterInputState,
-    output_schema=InputInterpreterOutputState,
-)
-
-builder.add_node("input_interpreter", input_interpreter)
-builder.add_node("item_expansion_agent", item_expansion_agent)
-builder.add_node("category_inference_agent", category_inference_agent)
-builder.add_node("product_search_agent", product_search_agent)
-builder.add_node("budget_optimizer_agent", budget_optimizer_agent)
-builder.add_node("cart_builder_agent", cart_builder_agent)
-builder.add_node("Human_review", human_verification)
-
-builder.add_edge(START, "input_interpreter")
-
 def route_after_input_interpreter(state: OverallState):
     if state.get("task_type") == "goal_or_dish":
         return "item_expansion_agent"
     else:
         return "category_inference_agent"
 
-builder.add_conditional_edges("input_interpreter", route_after_input_interpreter)
-builder.add_edge("item_expansion_agent", "Human_review")
-builder.add_edge("Human_review", "category_inference_agent")
-builder.add_edge("category_inference_agent", "product_search_agent")
-builder.add_edge("product_search_agent", "budget_optimizer_agent")
-builder.add_edge("budget_optimizer_agent", END)
 
-# builder.add_edge("budget_optimizer_agent", "cart_builder_agent")
-# builder.add_edge("cart_builder_agent", END)
+def route_to_categorization(state: OverallState):
+    """
+    Skips category inference when every item already has a category.
+    """
+    items = state.get("expanded_items") or state.get("item_list") or []
+    categories = state.get("categories") or {}
+    if items and all(item in categories for item in items):
+        return "product_search_agent"
+    return "category_inference_agent"
+
+
+def route_after_fused_planner(state: OverallState):
+    if state.get("task_type") == "goal_or_dish":
+        return "Human_review"
+    return route_to_categorization(state)
+
+
+def build_graph(checkpointer: Optional[Any] = None):
+    """
+    Builds and compiles the workflow, with a checkpointer from configuration unless one
+    is given. Most callers want the shared graph from `get_graph` instead.
+    """
+    builder = StateGraph(
+        OverallState,
+        input_schema=InputInterpreterInputState,
+        output_schema=InputInterpreterOutputState,
+    )
+
+    if PLANNER_MODE == "fused":
+        add_node(
+            builder, "fused_planner", fused_planner_agent, afused_planner_agent,
+            entry=True, input_schema=InputInterpreterInputState,
+        )
+    else:
+        add_node(
+            builder, "input_interpreter", input_interpreter, ainput_interpreter,
+            entry=True, input_schema=InputInterpreterInputState,
+        )
+        add_node(builder, "item_expansion_agent", item_expansion_agent, aitem_expansion_agent)
+    add_node(builder, "category_inference_agent", category_inference_agent, acategory_inference_agent)
+    add_node(builder, "product_search_agent", product_search_agent, aproduct_search_agent)
+    add_node(builder, "budget_optimizer_agent", budget_optimizer_agent, abudget_optimizer_agent)
+    add_node(builder, "cart_builder_agent", cart_builder_agent)
+    add_node(builder, "Human_review", human_verification)
+
+    if PLANNER_MODE == "fused":
+        builder.add_edge(START, "fused_planner")
+        builder.add_conditional_edges("fused_planner", route_after_fused_planner)
+    else:
+        builder.add_edge(START, "input_interpreter")
+        builder.add_conditional_edges("input_interpreter", route_after_input_interpreter)
+        builder.add_edge("item_expansion_agent", "Human_review")
+    builder.add_conditional_edges("Human_review", route_to_categorization)
+    builder.add_edge("category_inference_agent", "product_search_agent")
+    builder.add_edge("product_search_agent", "budget_optimizer_agent")
+    builder.add_edge("budget_optimizer_agent", END)
+
+    # builder.add_edge("budget_optimizer_agent", "cart_builder_agent")
+    # builder.add_edge("cart_builder_agent", END)
+
+    return builder.compile(checkpointer=checkpointer if checkpointer is not None else make_checkpointer())
+
+
+_graph: Optional[Any] = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """
+    Returns the process-wide compiled graph, building it on first use.
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = build_graph()
+    return _graph
+
 
-checkpointer = InMemorySaver()
-graph = builder.compile(checkpointer=checkpointer)
+def __getattr__(name: str) -> Any:
+    # `from agents.workflow import graph` keeps working, without compiling on import.
+    if name == "graph":
+        return get_graph()
+    if name == "checkpointer":
+        return get_graph().checkpointer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
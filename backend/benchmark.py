@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+# Benchmarks run against throwaway in-memory state, never the user's checkpoints or caches.
+os.environ.setdefault("WALLY_CHECKPOINTER", "memory")
+os.environ.setdefault("WALLY_CACHE_BACKEND", "memory")
+os.environ.setdefault("WALLY_CATEGORY_INDEX_PATH", "")
+os.environ.setdefault("WALLY_CATALOG_PATH", "")
+
+from langgraph.types import Command
+
+from agents.workflow import graph
+from agents.clients import llm_limiter, provider_stats, search_limiter, set_clients
+from agents.fakes import (
+    FakeChatModel,
+    FakeProviderServer,
+    FakeSearch,
+    Fixtures,
+    HttpChatModel,
+    HttpSearch,
+    RecordingChatModel,
+    RecordingSearch,
+    ReplayChatModel,
+    ReplaySearch,
+)
+from agents.catalog import catalog_stats, get_catalog
+from agents.category_index import category_index_stats
+from agents.product_fetcher import search_cache, extraction_cache
+from agents.ratelimit import RateLimitedClient
+from agents.search_compaction import estimate_tokens
+from agents.structured import parse_stats
+from agents.tracing import metrics
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "corpus.json")
+
+_current_run: contextvars.ContextVar[Optional["RunMetrics"]] = contextvars.ContextVar("current_run", default=None)
+
+
+class RunMetrics:
+    """
+    Everything measured for one end-to-end run of a corpus case.
+    """
+
+    def __init__(self, case: Dict[str, Any]):
+        self.case = case
+        self.total = 0.0
+        self.nodes: Dict[str, float] = {}
+        self.llm_calls = 0
+        self.llm_time = 0.0
+        self.prompt_tokens = 0
+        self.search_calls = 0
+        self.search_time = 0.0
+        self.selected = 0
+        self.error: Optional[str] = None
+
+
+class MeteredClient:
+    """
+    Wraps an LLM or search client and charges each call to the run it was made from.
+    """
+
+    def __init__(self, client: Any, kind: str):
+        self.client = client
+        self.kind = kind
+
+    def _record(self, payload, elapsed: float) -> None:
+        run = _current_run.get()
+        if run is None:
+            return
+        if self.kind == "llm":
+            run.llm_calls += 1
+            run.llm_time += elapsed
+            run.prompt_tokens += sum(
+                estimate_tokens(m["content"] if isinstance(m, dict) else m.content) for m in payload
+            )
+        else:
+            run.search_calls += 1
+            run.search_time += elapsed
+
+    def invoke(self, payload, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.client.invoke(payload, *args, **kwargs)
+        finally:
+            self._record(payload, time.perf_counter() - start)
+
+    async def ainvoke(self, payload, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.client.ainvoke(payload, *args, **kwargs)
+        finally:
+            self._record(payload, time.perf_counter() - start)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile; 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(round(pct / 100 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def load_corpus(path: str, kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    if kinds:
+        corpus = [case for case in corpus if case.get("kind") in kinds]
+    return corpus
+
+
+def build_clients(args) -> Dict[str, Any]:
+    """
+    Picks synthetic, replayed or recording clients and installs them behind metering wrappers.
+    With --provider-rpm or --provider-errors the synthetic answers come from a local
+    `FakeProviderServer` over HTTP, through the shared rate limiters.
+    """
+    fixtures = None
+    provider = None
+    if args.provider_rpm or args.provider_errors:
+        provider = FakeProviderServer(rpm=args.provider_rpm, error_rate=args.provider_errors,
+                                      llm_latency=args.llm_latency, search_latency=args.search_latency,
+                                      jitter=args.jitter).start()
+        llm = RateLimitedClient(HttpChatModel(provider.url), llm_limiter)
+        search = RateLimitedClient(HttpSearch(provider.url), search_limiter)
+    elif args.record:
+        from agents.clients import _build_llm, _build_search
+
+        fixtures = Fixtures(args.record)
+        llm = RecordingChatModel(_build_llm(), fixtures)
+        search = RecordingSearch(_build_search(), fixtures)
+    elif args.replay:
+        fixtures = Fixtures(args.replay)
+        llm = ReplayChatModel(fixtures, latency=args.llm_latency, jitter=args.jitter)
+        search = ReplaySearch(fixtures, latency=args.search_latency, jitter=args.jitter)
+    else:
+        llm = FakeChatModel(latency=args.llm_latency, jitter=args.jitter, malformed=args.malformed)
+        search = FakeSearch(latency=args.search_latency, jitter=args.jitter)
+
+    set_clients(MeteredClient(llm, "llm"), MeteredClient(search, "search"))
+    return {"llm": llm, "search": search, "fixtures": fixtures, "provider": provider}
+
+
+async def run_case(case: Dict[str, Any], thread_id: str, think_time: float = 0.0) -> RunMetrics:
+    """
+    Runs one corpus case to completion, answering review interrupts from the case's
+    scripted "review" list (accepting once it runs out) after `think_time` seconds.
+    The think time is excluded from the run's total.
+    """
+    run = RunMetrics(case)
+    _current_run.set(run)
+    config = {"configurable": {"thread_id": thread_id}}
+    reviews = list(case.get("review") or [])
+    graph_input: Any = {"user_input": case["user_input"]}
+
+    start = time.perf_counter()
+    try:
+        while graph_input is not None:
+            interrupted = False
+            last = time.perf_counter()
+            async for chunk in graph.astream(graph_input, config=config, stream_mode="updates"):
+                now = time.perf_counter()
+                for node in chunk:
+                    if node == "__interrupt__":
+                        interrupted = True
+                    elif not node.startswith("__"):
+                        run.nodes[node] = run.nodes.get(node, 0.0) + now - last
+                last = now
+            graph_input = Command(resume=reviews.pop(0) if reviews else {"action": "accept"}) if interrupted else None
+            if interrupted and think_time > 0:
+                await asyncio.sleep(think_time)
+                start += think_time
+        snapshot = await graph.aget_state(config)
+        run.selected = len(snapshot.values.get("optimized_products") or [])
+    except Exception as e:
+        run.error = f"{type(e).__name__}: {e}"
+    run.total = time.perf_counter() - start
+    return run
+
+
+async def run_benchmark(corpus: List[Dict[str, Any]], iterations: int, concurrency: int,
+                        warm: bool, think_time: float = 0.0) -> List[RunMetrics]:
+    runs: List[RunMetrics] = []
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(case, thread_id):
+        async with semaphore:
+            # Each case gets a fresh context so client calls are charged to it alone.
+            return await asyncio.create_task(run_case(case, thread_id, think_time), context=contextvars.copy_context())
+
+    for iteration in range(iterations):
+        if not warm:
+            search_cache.clear()
+            extraction_cache.clear()
+            if get_catalog() is not None:
+                get_catalog().clear()
+        runs.extend(await asyncio.gather(*(
+            bounded(case, f"bench-{iteration}-{index}") for index, case in enumerate(corpus)
+        )))
+        print(f"Iteration {iteration + 1}/{iterations} done", file=sys.stderr)
+    return runs
+
+
+def summarize(runs: List[RunMetrics], wall_time: float, peak_bytes: int) -> Dict[str, Any]:
+    ok = [run for run in runs if run.error is None]
+    totals = [run.total for run in ok]
+
+    cases: Dict[str, Dict[str, Any]] = {}
+    for name in dict.fromkeys(run.case["name"] for run in runs):
+        case_runs = [run for run in ok if run.case["name"] == name]
+        times = [run.total for run in case_runs]
+        count = len(case_runs) or 1
+        cases[name] = {
+            "runs": len(case_runs),
+            "errors": sum(1 for run in runs if run.case["name"] == name and run.error),
+            "p50_ms": round(percentile(times, 50) * 1000, 1),
+            "p95_ms": round(percentile(times, 95) * 1000, 1),
+            "llm_calls": round(sum(run.llm_calls for run in case_runs) / count, 2),
+            "prompt_tokens": round(sum(run.prompt_tokens for run in case_runs) / count),
+            "search_calls": round(sum(run.search_calls for run in case_runs) / count, 2),
+            "selected": round(sum(run.selected for run in case_runs) / count, 2),
+        }
+
+    nodes: Dict[str, Dict[str, float]] = {}
+    for node in dict.fromkeys(node for run in ok for node in run.nodes):
+        times = [run.nodes[node] for run in ok if node in run.nodes]
+        nodes[node] = {
+            "runs": len(times),
+            "mean_ms": round(sum(times) / len(times) * 1000, 1),
+            "p95_ms": round(percentile(times, 95) * 1000, 1),
+        }
+
+    return {
+        "runs": len(runs),
+        "errors": [f"{run.case['name']}: {run.error}" for run in runs if run.error],
+        "total": {
+            "p50_ms": round(percentile(totals, 50) * 1000, 1),
+            "p95_ms": round(percentile(totals, 95) * 1000, 1),
+            "p99_ms": round(percentile(totals, 99) * 1000, 1),
+            "runs_per_second": round(len(ok) / wall_time, 2) if wall_time > 0 else 0.0,
+        },
+        "llm_calls": sum(run.llm_calls for run in ok),
+        "llm_time_s": round(sum(run.llm_time for run in ok), 2),
+        "prompt_tokens": sum(run.prompt_tokens for run in ok),
+        "search_calls": sum(run.search_calls for run in ok),
+        "fallbacks": int(metrics.total("wally_fallbacks_total")),
+        "peak_traced_mb": round(peak_bytes / 2**20, 1),
+        # ru_maxrss is in KiB on Linux.
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "parsing": parse_stats(),
+        "catalog": catalog_stats(),
+        "category_index": category_index_stats(),
+        "providers": provider_stats(),
+        "nodes": nodes,
+        "cases": cases,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{'case':<20}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'llm':>7}{'tokens':>9}{'search':>8}{'picked':>8}")
+    for name, case in report["cases"].items():
+        print(f"{name:<20}{case['runs']:>6}{case['p50_ms']:>10}{case['p95_ms']:>10}{case['llm_calls']:>7}"
+              f"{case['prompt_tokens']:>9}{case['search_calls']:>8}{case['selected']:>8}")
+
+    print(f"\n{'node':<28}{'runs':>6}{'mean ms':>10}{'p95 ms':>10}")
+    for node, stats in report["nodes"].items():
+        print(f"{node:<28}{stats['runs']:>6}{stats['mean_ms']:>10}{stats['p95_ms']:>10}")
+
+    total = report["total"]
+    print(f"\nTotal: p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, p99 {total['p99_ms']} ms, "
+          f"{total['runs_per_second']} runs/s")
+    print(f"LLM calls: {report['llm_calls']}, prompt tokens: {report['prompt_tokens']}, "
+          f"search calls: {report['search_calls']}, fallbacks: {report['fallbacks']}")
+    print(f"Peak traced memory: {report['peak_traced_mb']} MB, max RSS: {report['max_rss_mb']} MB")
+    if report.get("parsing"):
+        print(f"Parsing: {report['parsing']}")
+    if report.get("catalog"):
+        print(f"Catalog: {report['catalog']}")
+    index = report.get("category_index")
+    if index and index["hits"] + index["misses"]:
+        print(f"Category index: {index['hits']} hits, {index['misses']} misses, "
+              f"hit rate {index['hit_rate']:.0%}")
+    for name, stats in report["providers"].items():
+        if stats["calls"]:
+            print(f"Provider {name}: {stats['calls']} calls, {stats['throttled']} throttled, {stats['retried']} retried, "
+                  f"{stats['rejected']} rejected, circuit {stats['circuit']}, effective rpm {stats['effective_rpm']}")
+    if report.get("provider_server"):
+        print(f"Fake provider served: {report['provider_server']}")
+    for error in report["errors"]:
+        print(f"ERROR {error}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Returns the metrics that got worse than `baseline` by more than `tolerance` (a fraction).
+    """
+    checks = {
+        "total p95": (report["total"]["p95_ms"], baseline["total"]["p95_ms"]),
+        "total p99": (report["total"]["p99_ms"], baseline["total"]["p99_ms"]),
+        "llm calls": (report["llm_calls"], baseline["llm_calls"]),
+        "prompt tokens": (report["prompt_tokens"], baseline["prompt_tokens"]),
+        "search calls": (report["search_calls"], baseline["search_calls"]),
+        "peak traced memory": (report["peak_traced_mb"], baseline["peak_traced_mb"]),
+    }
+    return [
+        f"{name}: {current} vs baseline {previous}"
+        for name, (current, previous) in checks.items()
+        if current > previous * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Smart Cart Agent graph offline.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSON list of cases to run.")
+    parser.add_argument("--kind", action="append", help="Only run cases of this kind (direct, dish, large).")
+    parser.add_argument("--iterations", type=int, default=3, help="Times to run the whole corpus.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Cases in flight at once.")
+    parser.add_argument("--warm", action="store_true", help="Keep caches and the product catalog between iterations.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Injected seconds per LLM call.")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="Injected seconds per search call.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency spread as a fraction (0.2 = +/-20%%).")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Fraction of synthetic LLM replies to break.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds a reviewer takes per review round.")
+    parser.add_argument("--replay", help="Answer from recorded fixtures, synthesizing anything missing.")
+    parser.add_argument("--record", help="Call the live APIs and record their responses to this file.")
+    parser.add_argument("--provider-rpm", type=int, default=0,
+                        help="Serve synthetic answers from a local fake API allowing this many requests a minute.")
+    parser.add_argument("--provider-errors", type=float, default=0.0,
+                        help="Fraction of fake API requests answered with a 503.")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip Python allocation tracing.")
+    parser.add_argument("--json", help="Also write the report to this file.")
+    parser.add_argument("--baseline", help="Report from an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs the baseline.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.kind)
+    clients = build_clients(args)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    runs = asyncio.run(run_benchmark(corpus, args.iterations, args.concurrency, args.warm, args.think_time))
+    wall_time = time.perf_counter() - start
+    peak_bytes = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    tracemalloc.stop()
+
+    report = summarize(runs, wall_time, peak_bytes)
+    if clients["provider"] is not None:
+        report["provider_server"] = clients["provider"].counts
+        clients["provider"].stop()
+    print_report(report)
+
+    if clients["fixtures"] is not None and args.record:
+        clients["fixtures"].save()
+        print(f"Recorded {len(clients['fixtures'])} fixture(s) to {args.record}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
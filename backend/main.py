@@ -1,16 +1,26 @@
 import argparse
 import asyncio
+import contextlib
 import json
 import os
 import shutil
-from agents.workflow import graph
-from langgraph.types import Command
-from dotenv import load_dotenv
+import sys
+import threading
+import uuid
+
+# The graph, LangGraph and the provider SDKs are imported on first use, so the CLI can
+# parse its arguments and show the first prompt while they load in the background.
+
 
 def setup_api_keys():
     """
     Checks for a .env file and prompts the user for API keys if it doesn't exist.
+    Nothing is asked in fake client mode or when the keys are already in the environment.
     """
+    from agents.config import CLIENT_MODE
+
+    if CLIENT_MODE == "fake" or (os.getenv("GOOGLE_API_KEY") and os.getenv("TAVILY_API_KEY")):
+        return
     if not os.path.exists(".env"):
         print("API keys not found. Please enter your API keys.")
         google_api_key = input("Enter your GOOGLE_API_KEY: ").strip()
@@ -24,77 +34,293 @@ def setup_api_keys():
             f.write(f"TAVILY_API_KEY={tavily_api_key}\n")
 
         print(".env file created successfully.")
-    
-    # Load the .env file
-    load_dotenv()
+
+        # agents.config loaded the environment before the file existed.
+        from dotenv import load_dotenv
+
+        load_dotenv()
+
+
+def load_graph():
+    """
+    Returns the compiled graph, importing and building it on first use.
+    """
+    from agents.workflow import get_graph
+
+    return get_graph()
+
+
+def start_catalog_refresher():
+    """
+    Starts keeping the most-requested items fresh in the product catalog, as the HTTP
+    server does. Returns the refresher, or None when the catalog is off.
+    """
+    from agents.catalog import get_catalog_refresher
+
+    refresher = get_catalog_refresher()
+    if refresher is not None:
+        refresher.start()
+    return refresher
+
+
+def _warm_up() -> None:
+    load_graph()
+    start_catalog_refresher()
+
+
+def warm_graph() -> threading.Thread:
+    """
+    Builds the graph on a background thread, so it is usually ready by the time the
+    user has typed a request, then starts the catalog refresher.
+    """
+    thread = threading.Thread(target=_warm_up, name="graph-warmup", daemon=True)
+    thread.start()
+    return thread
 
 
-async def run_agent_cli(user_input: str, user_id: str | None = None):
+def print_progress(node: str, update) -> None:
     """
-    Asynchronously runs the agent graph with the given user input,
-    handling human-in-the-loop interruptions.
+    Prints a short summary of a node's update as soon as the node finishes.
     """
-    inputs = {"user_input": user_input}
-    thread_id = user_id or "cli_user_1"
+    print(f"\n--- [{node}] done ---")
+    if not isinstance(update, dict):
+        return
+    update = {key: value for key, value in update.items() if key != "trace"}
+    if node == "product_search_agent":
+        print(f"Found products for {len(update.get('products', []))} item(s).")
+        return
+    if node == "budget_optimizer_agent":
+        print_cart(update.get("optimized_products") or [])
+        return
+    print(json.dumps(update, indent=2, default=str))
+
+
+def print_cart(selected) -> None:
+    for product in selected:
+        print(f"  {product.get('item')}: {product.get('name')} - ${product.get('price')}")
+    total = sum(float(p.get("price") or 0) for p in selected)
+    print(f"Selected {len(selected)} product(s), total ${total:.2f}")
+
+
+def print_timing(trace) -> None:
+    from agents.tracing import trace_summary
+
+    print("Timing: " + ", ".join(f"{span['node']} {span['ms']:.0f} ms" for span in trace))
+    print(f"Trace summary: {trace_summary(trace)}")
+
+
+def print_partial_products(chunk) -> None:
+    """
+    Prints one item's product options as the product search streams them.
+    """
+    options = chunk.get("options") or []
+    prices = [o.get("price") for o in options if isinstance(o.get("price"), (int, float))]
+    cheapest = f", from ${min(prices):.2f}" if prices else ""
+    print(f"  {chunk.get('item')}: {len(options)} option(s){cheapest}")
+
+
+async def stream_graph(graph_input, config):
+    """
+    Streams one graph run, printing progress per node and partial products.
+    Returns the interrupt payload if the run paused for human review, else None.
+    """
+    async for mode, chunk in load_graph().astream(graph_input, config=config, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            print_partial_products(chunk)
+            continue
+        for node, update in chunk.items():
+            if node == "__interrupt__":
+                return update[0].value
+            if node.startswith("__"):
+                continue
+            print_progress(node, update)
+    return None
+
+
+def ask_for_review(interrupt_info) -> dict:
+    """
+    Shows the proposed item list and returns the resume payload for the Human_review node.
+    """
+    print("\n--- [!] Human Review Required ---")
+    print(f"Task: {interrupt_info.get('task')}")
+    print(f"Current Item List: {json.dumps(interrupt_info.get('current_list'), indent=2)}")
+
+    user_action = ""
+    while user_action not in ["accept", "edit"]:
+        user_action = input("Do you want to 'accept' or 'edit' the list? > ").strip().lower()
+
+    if user_action == "accept":
+        return {"action": "accept"}
+
+    print("Please provide the new list as a valid JSON array (e.g., [\"pasta\", \"sauce\", \"cheese\"])")
+    while True:
+        try:
+            new_list_str = input("Enter new list: > ")
+            new_list = json.loads(new_list_str)
+            if isinstance(new_list, list):
+                return {"action": "edit", "editedList": new_list}
+            else:
+                print("Invalid input. The JSON must be an array (e.g., [\"item1\"]).")
+        except json.JSONDecodeError:
+            print("Invalid JSON format. Please try again.")
+
+
+def new_thread_id(user_id: str | None = None) -> str:
+    """
+    A thread ID of its own for each new request, so nothing checkpointed for an
+    earlier request (even by an earlier run of the CLI) carries over into it.
+    """
+    return f"{user_id or 'cli_user'}-{uuid.uuid4().hex[:12]}"
+
+
+async def run_agent_cli(user_input: str, thread_id: str) -> bool:
+    """
+    Asynchronously runs the agent graph with the given user input, streaming
+    per-node progress and handling human-in-the-loop interruptions.
+    Returns False if the request failed (it is reported, not raised), so the prompt can
+    move on to the next one.
+    """
+    graph = load_graph()
+    from langgraph.types import Command
+    from agents.ratelimit import CircuitOpenError
+    from agents.structured import StructuredOutputError
+
+    graph_input = {"user_input": user_input}
     config = {"configurable": {"thread_id": thread_id}}
 
     print("\n--- Invoking Agent ---")
     print(f"Input: {user_input}\n")
 
-    result = graph.invoke(inputs, config=config)
-
-    while result.get('__interrupt__'):
-        interrupt_info = result['__interrupt__'][0].value
-        print("\n--- [!] Human Review Required ---")
-        print(f"Task: {interrupt_info.get('task')}")
-        print(f"Current Item List: {json.dumps(interrupt_info.get('current_list'), indent=2)}")
-
-        user_action = ""
-        while user_action not in ["accept", "edit"]:
-            user_action = input("Do you want to 'accept' or 'edit' the list? > ").strip().lower()
-
-        if user_action == "accept":
-            resume_payload = {"action": "accept"}
-            result = graph.invoke(Command(resume=resume_payload), config=config)
-
-        elif user_action == "edit":
-            print("Please provide the new list as a valid JSON array (e.g., [\"pasta\", \"sauce\", \"cheese\"])")
-            while True:
-                try:
-                    new_list_str = input("Enter new list: > ")
-                    new_list = json.loads(new_list_str)
-                    if isinstance(new_list, list):
-                        resume_payload = {"action": "edit", "editedList": new_list}
-                        result = graph.invoke(Command(resume=resume_payload), config=config)
-                        break
-                    else:
-                        print("Invalid input. The JSON must be an array (e.g., [\"item1\"]).")
-                except json.JSONDecodeError:
-                    print("Invalid JSON format. Please try again.")
-                except Exception as e:
-                    print(f"An unexpected error occurred: {e}")
+    try:
+        while True:
+            interrupt_info = await stream_graph(graph_input, config)
+            if interrupt_info is None:
+                break
+            resume_payload = await asyncio.to_thread(ask_for_review, interrupt_info)
+            graph_input = Command(resume=resume_payload)
+    except StructuredOutputError as e:
+        print(f"\nSorry, the request could not be understood: {e}")
+        return False
+    except CircuitOpenError as e:
+        print(f"\nRequest failed: {e}. Please try again shortly.")
+        return False
+    except Exception as e:
+        # Anything else a provider or node raised (a 429 or 5xx that outlasted the
+        # retries, a rejected request) fails this request, not the whole session.
+        print(f"\nRequest failed: {type(e).__name__}: {e}")
+        return False
+
+    snapshot = await graph.aget_state(config)
+    result = {"optimized_products": snapshot.values.get("optimized_products")}
 
     print("\n--- Agent Finished ---")
     print("Final State:")
     print(json.dumps(result, indent=2, default=str))
 
+    print_timing(snapshot.values.get("trace") or [])
+    return True
 
-def main():
+
+async def update_agent_cli(changes: dict, thread_id: str) -> None:
     """
-    Sets up API keys, prompts for user input, and runs the agent.
+    Applies a quick tweak to the last cart, re-running only the steps it affects.
     """
-    setup_api_keys()
-    
-    parser = argparse.ArgumentParser(description="Run the Smart Cart Agent from the command line.")
-    parser.add_argument("--user-id", type=str, help="An optional user ID to maintain state.", default=None)
-    args = parser.parse_args()
+    from agents.incremental import aupdate_cart
+    from agents.ratelimit import CircuitOpenError
+
+    try:
+        values = await aupdate_cart(load_graph(), thread_id, **changes)
+    except (ValueError, CircuitOpenError) as e:
+        print(f"Cannot update the cart: {e}")
+        return
+    except Exception as e:
+        print(f"Cart update failed: {type(e).__name__}: {e}")
+        return
+    print(f"\n--- Cart updated ({changes}) ---")
+    print_cart(values.get("optimized_products") or [])
+    print_timing(values.get("trace") or [])
+
+
+async def run_cli(user_id: str | None = None):
+    """
+    Prompts for requests in a loop on a single event loop. After the first cart, tweaks
+    like "under $30", "add eggs" or "remove bread" update it in place.
+    """
+    from agents.clients import aclose_clients
+    from agents.incremental import parse_update
 
+    warmup = warm_graph()
+    cart_thread = None
     while True:
-        user_input = input("Please enter your request (or type 'exit' to quit): ").strip()
+        user_input = (await asyncio.to_thread(input, "Please enter your request (or type 'exit' to quit): ")).strip()
         if user_input.lower() == 'exit':
             break
-        
-        asyncio.run(run_agent_cli(user_input, args.user_id))
+
+        changes = parse_update(user_input) if cart_thread else None
+        if changes is not None:
+            await update_agent_cli(changes, cart_thread)
+            continue
+        thread_id = new_thread_id(user_id)
+        if await run_agent_cli(user_input, thread_id):
+            cart_thread = thread_id
+
+    # The warm-up thread starts the refresher; let it get that far before stopping it.
+    await asyncio.to_thread(warmup.join)
+    from agents.catalog import get_catalog_refresher
+
+    refresher = get_catalog_refresher()
+    if refresher is not None:
+        refresher.stop()
+    await aclose_clients()
+
+
+async def run_batch_cli(path: str, budget: float | None = None, max_carts: int | None = None,
+                        output: str | None = None) -> None:
+    """
+    Plans every request in `path` ("-" for stdin) as one batch and writes one JSON line
+    per request as its cart is ready. Progress goes to stderr so the output stays clean.
+    """
+    from agents.batch import BatchRun, read_requests
+    from agents.clients import aclose_clients
+
+    with (contextlib.nullcontext(sys.stdin) if path == "-" else open(path, "r", encoding="utf-8")) as f:
+        requests = read_requests(f)
+    options = {"max_carts": max_carts} if max_carts else {}
+    run = BatchRun(load_graph(), requests, budget, **options)
+
+    with (contextlib.nullcontext(sys.stdout) if output is None else open(output, "w", encoding="utf-8")) as out:
+        with contextlib.redirect_stdout(sys.stderr):
+            async for result in run.results():
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+    print(f"Batch done: {run.stats}", file=sys.stderr)
+    await aclose_clients()
+
+
+def main():
+    """
+    Parses arguments, sets up API keys, prompts for user input, and runs the agent.
+    """
+    parser = argparse.ArgumentParser(description="Run the Smart Cart Agent from the command line.")
+    parser.add_argument("--user-id", type=str, help="An optional user ID to prefix thread IDs with.", default=None)
+    parser.add_argument("--batch", type=str, help="Plan every request in this file (one per line, - for stdin).")
+    parser.add_argument("--budget", type=float, help="With --batch, one budget shared by all carts.")
+    parser.add_argument("--max-carts", type=int, help="With --batch, carts in flight at once.")
+    parser.add_argument("--output", type=str, help="With --batch, write results here instead of stdout.")
+    parser.add_argument("--llm-rpm", type=float, help="Max LLM requests per minute (overrides WALLY_LLM_RPM).")
+    parser.add_argument("--llm-tpm", type=float, help="Max LLM tokens per minute (overrides WALLY_LLM_TPM).")
+    parser.add_argument("--search-rpm", type=float, help="Max search requests per minute (overrides WALLY_SEARCH_RPM).")
+    args = parser.parse_args()
+
+    setup_api_keys()
+    from agents.clients import llm_limiter, search_limiter
+
+    llm_limiter.configure(args.llm_rpm, args.llm_tpm)
+    search_limiter.configure(args.search_rpm)
+    if args.batch:
+        asyncio.run(run_batch_cli(args.batch, args.budget, args.max_carts, args.output))
+        return
+    asyncio.run(run_cli(args.user_id))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
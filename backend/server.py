@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Flask, Response, jsonify, request
+from langgraph.types import Command
+
+from agents.workflow import graph
+from agents.batch import BatchRun, as_request
+from agents.batching import BatchedChatModel, BatchedSearch
+from agents.cache import cache_stats
+from agents.catalog import catalog_stats, get_catalog_refresher
+from agents.category_index import category_index_stats
+from agents.clients import get_llm, get_search, set_clients, aclose_clients, provider_stats
+from agents.prefetch import prefetch_stats
+from agents.incremental import aupdate_cart
+from agents.structured import parse_stats
+from agents.tracing import render_prometheus, trace_summary, untraced_client
+from agents.config import SERVER_HOST, SERVER_PORT, SERVER_MAX_CONCURRENT_RUNS, SERVER_WAIT_TIMEOUT
+
+
+class SessionManager:
+    """
+    Runs graph sessions on one background event loop so many threads can be in flight at
+    once, while Flask's request threads only submit work and read state.
+    """
+
+    def __init__(self, max_concurrent_runs: int = SERVER_MAX_CONCURRENT_RUNS):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="wally-sessions", daemon=True)
+        self._thread.start()
+        self._runs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._semaphore = self.call(self._make_semaphore(max_concurrent_runs))
+        self.completed = 0
+        self.failed = 0
+        self.started_at = time.time()
+
+        # Route every session's model and search calls through shared micro-batchers.
+        # They go under the tracing wrapper, so each call is counted once, against its node.
+        self.llm = BatchedChatModel(untraced_client(get_llm()))
+        self.search = BatchedSearch(untraced_client(get_search()))
+        set_clients(self.llm, self.search)
+
+        # Keep the most-requested items fresh in the product catalog between requests.
+        refresher = get_catalog_refresher()
+        if refresher is not None:
+            refresher.start()
+
+    @staticmethod
+    async def _make_semaphore(limit: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(max(1, limit))
+
+    def call(self, coro, timeout: Optional[float] = None):
+        """
+        Runs `coro` on the session loop and waits for its result. On timeout the
+        coroutine is cancelled rather than left running, and TimeoutError is raised.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def is_running(self, thread_id: str) -> bool:
+        with self._lock:
+            run = self._runs.get(thread_id)
+        return run is not None and run["status"] == "running"
+
+    def submit(self, thread_id: str, graph_input) -> bool:
+        """
+        Starts a graph run for `thread_id` in the background.
+        Returns False if that thread already has a run in progress.
+        """
+        with self._lock:
+            run = self._runs.get(thread_id)
+            if run is not None and run["status"] == "running":
+                return False
+            run = {"status": "running", "error": None, "submitted_at": time.time(), "done": threading.Event()}
+            self._runs[thread_id] = run
+        asyncio.run_coroutine_threadsafe(self._run(thread_id, graph_input, run), self.loop)
+        return True
+
+    async def _run(self, thread_id: str, graph_input, run: Dict[str, Any]) -> None:
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            async with self._semaphore:
+                async for _ in graph.astream(graph_input, config=config, stream_mode="updates"):
+                    pass
+            run["status"] = "finished"
+            self.completed += 1
+        except Exception as e:
+            print(f"Run for thread {thread_id} failed: {e}")
+            run["status"] = "error"
+            run["error"] = str(e)
+            self.failed += 1
+        finally:
+            run["elapsed"] = round(time.time() - run["submitted_at"], 3)
+            run["done"].set()
+
+    def update(self, thread_id: str, changes: Dict[str, Any]) -> Optional[str]:
+        """
+        Applies a cart edit to a finished thread and waits for the re-optimized cart.
+        Returns an error message if the thread cannot be updated.
+        """
+        with self._lock:
+            previous = self._runs.get(thread_id)
+            if previous is not None and previous["status"] == "running":
+                return f"thread {thread_id} already has a run in progress"
+            run = {"status": "running", "error": None, "submitted_at": time.time(), "done": threading.Event()}
+            self._runs[thread_id] = run
+        try:
+            # wait_for cancels a late update on the loop and returns only once it has
+            # stopped, so the thread is not released while the update can still write to it.
+            self.call(asyncio.wait_for(aupdate_cart(graph, thread_id, **changes), SERVER_WAIT_TIMEOUT))
+            run["status"] = "finished"
+            self.completed += 1
+        except TimeoutError:
+            print(f"Update for thread {thread_id} timed out after {SERVER_WAIT_TIMEOUT:g}s; cancelled it")
+            run["status"] = "error"
+            run["error"] = f"update timed out after {SERVER_WAIT_TIMEOUT:g}s and was cancelled"
+            self.failed += 1
+        except ValueError as e:
+            with self._lock:
+                if previous is None:
+                    self._runs.pop(thread_id, None)
+                else:
+                    self._runs[thread_id] = previous
+            return str(e)
+        except Exception as e:
+            print(f"Update for thread {thread_id} failed: {e}")
+            run["status"] = "error"
+            run["error"] = str(e)
+            self.failed += 1
+        finally:
+            run["elapsed"] = round(time.time() - run["submitted_at"], 3)
+            run["done"].set()
+        return None
+
+    def batch(self, requests: List[Dict[str, Any]], budget: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Runs a batch of requests on the session loop, yielding each cart's result as it is ready.
+        """
+        results: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+        async def produce() -> None:
+            try:
+                async for result in BatchRun(graph, requests, budget).results():
+                    results.put(result)
+                    if result["status"] == "ok":
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                results.put({"status": "error", "error": str(e)})
+            finally:
+                results.put(None)
+
+        asyncio.run_coroutine_threadsafe(produce(), self.loop)
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            yield result
+
+    def wait(self, thread_id: str, timeout: float) -> None:
+        with self._lock:
+            run = self._runs.get(thread_id)
+        if run is not None:
+            run["done"].wait(timeout)
+
+    def result(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Describes a thread: whether it is running, waiting for review, finished or failed,
+        plus its outputs so far. Returns None for unknown threads.
+        """
+        with self._lock:
+            run = dict(self._runs.get(thread_id) or {})
+        body: Dict[str, Any] = {"thread_id": thread_id}
+        if run.get("status") == "running":
+            body["status"] = "running"
+            return body
+
+        snapshot = self.call(graph.aget_state({"configurable": {"thread_id": thread_id}}))
+        if not snapshot.values and not run:
+            return None
+
+        if run.get("status") == "error":
+            body["status"] = "error"
+            body["error"] = run["error"]
+        elif snapshot.interrupts:
+            body["status"] = "interrupted"
+            body["interrupt"] = snapshot.interrupts[0].value
+        else:
+            body["status"] = "finished"
+        if "elapsed" in run:
+            body["elapsed"] = run["elapsed"]
+
+        values = snapshot.values or {}
+        for key in ("task_type", "item_list", "expanded_items", "budget", "optimized_products", "trace"):
+            if key in values:
+                body[key] = values[key]
+        if values.get("trace"):
+            body["trace_summary"] = trace_summary(values["trace"])
+        return body
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for run in self._runs.values() if run["status"] == "running")
+        uptime = time.time() - self.started_at
+        return {
+            "running": running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "runs_per_second": round(self.completed / uptime, 3) if uptime > 0 else 0.0,
+            "llm_batching": self.llm.batcher.stats(),
+            "search_batching": self.search.batcher.stats(),
+            "caches": cache_stats(),
+            "catalog": catalog_stats(),
+            "category_index": category_index_stats(),
+            "prefetch": prefetch_stats(),
+            "parsing": parse_stats(),
+            "providers": provider_stats(),
+        }
+
+    def close(self) -> None:
+        refresher = get_catalog_refresher()
+        if refresher is not None:
+            refresher.stop()
+        self.call(aclose_clients())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def create_app(sessions: Optional[SessionManager] = None) -> Flask:
+    """
+    Builds the HTTP API. Runs are keyed by thread_id:
+
+      POST /threads/<thread_id>/start   {"user_input": "..."}
+      POST /threads/<thread_id>/resume  {"action": "accept"} or {"action": "edit", "editedList": [...]}
+      POST /threads/<thread_id>/update  {"budget": 30, "add": [...], "remove": [...]} or {"items": [...]}
+      GET  /threads/<thread_id>         status, pending review, results and per-node trace
+      POST /batch                       {"requests": ["...", {"id": ..., "user_input": "...", "budget": 20}], "budget": 100}
+      GET  /metrics                     Prometheus metrics
+
+    start and resume return 202 straight away; pass ?wait=true to block until the run
+    pauses or finishes. update re-runs only what the edit affects and answers when done.
+    batch plans every request without review and streams one JSON line per cart; a
+    top-level budget is shared by all carts.
+    """
+    sessions = sessions or SessionManager()
+    app = Flask(__name__)
+    app.config["sessions"] = sessions
+
+    def accepted(thread_id: str):
+        if request.args.get("wait", "").lower() in ("1", "true", "yes"):
+            sessions.wait(thread_id, SERVER_WAIT_TIMEOUT)
+            return jsonify(sessions.result(thread_id)), 200
+        return jsonify({"thread_id": thread_id, "status": "running"}), 202
+
+    @app.post("/threads/<thread_id>/start")
+    def start(thread_id: str):
+        body = request.get_json(silent=True) or {}
+        user_input = body.get("user_input")
+        if not isinstance(user_input, str) or not user_input.strip():
+            return jsonify({"error": "user_input must be a non-empty string"}), 400
+        if not sessions.submit(thread_id, {"user_input": user_input.strip()}):
+            return jsonify({"error": f"thread {thread_id} already has a run in progress"}), 409
+        return accepted(thread_id)
+
+    @app.post("/threads/<thread_id>/resume")
+    def resume(thread_id: str):
+        body = request.get_json(silent=True) or {}
+        action = body.get("action")
+        if action not in ("accept", "edit"):
+            return jsonify({"error": "action must be 'accept' or 'edit'"}), 400
+        if action == "edit" and not isinstance(body.get("editedList"), list):
+            return jsonify({"error": "editedList must be a JSON array"}), 400
+        if sessions.is_running(thread_id):
+            return jsonify({"error": f"thread {thread_id} already has a run in progress"}), 409
+
+        state = sessions.result(thread_id)
+        if state is None or state["status"] != "interrupted":
+            return jsonify({"error": f"thread {thread_id} is not waiting for review"}), 409
+        payload = {"action": action}
+        if action == "edit":
+            payload["editedList"] = body["editedList"]
+        if not sessions.submit(thread_id, Command(resume=payload)):
+            return jsonify({"error": f"thread {thread_id} already has a run in progress"}), 409
+        return accepted(thread_id)
+
+    @app.post("/threads/<thread_id>/update")
+    def update(thread_id: str):
+        body = request.get_json(silent=True) or {}
+        changes = {}
+        for key in ("items", "add", "remove"):
+            if key in body:
+                if not isinstance(body[key], list) or not all(isinstance(item, str) for item in body[key]):
+                    return jsonify({"error": f"{key} must be a JSON array of strings"}), 400
+                changes[key] = body[key]
+        if "budget" in body:
+            budget = body["budget"]
+            if isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0:
+                return jsonify({"error": "budget must be a positive number"}), 400
+            changes["budget"] = budget
+        if not changes:
+            return jsonify({"error": "nothing to update; pass items, add, remove or budget"}), 400
+
+        error = sessions.update(thread_id, changes)
+        if error is not None:
+            return jsonify({"error": error}), 409
+        return jsonify(sessions.result(thread_id))
+
+    @app.post("/batch")
+    def batch():
+        body = request.get_json(silent=True) or {}
+        values = body.get("requests")
+        if not isinstance(values, list) or not values:
+            return jsonify({"error": "requests must be a non-empty JSON array"}), 400
+        budget = body.get("budget")
+        if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0):
+            return jsonify({"error": "budget must be a positive number"}), 400
+        try:
+            requests = [as_request(value, index) for index, value in enumerate(values)]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        lines = (json.dumps(result, default=str) + "\n" for result in sessions.batch(requests, budget))
+        return Response(lines, mimetype="application/x-ndjson")
+
+    @app.get("/threads/<thread_id>")
+    def result(thread_id: str):
+        body = sessions.result(thread_id)
+        if body is None:
+            return jsonify({"error": f"unknown thread {thread_id}"}), 404
+        return jsonify(body)
+
+    @app.get("/health")
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.get("/stats")
+    def stats():
+        return jsonify(sessions.stats())
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+    """
+    Runs the API on Flask's threaded server.
+    """
+    app = create_app()
+    try:
+        app.run(host=host, port=port, threaded=True)
+    finally:
+        app.config["sessions"].close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Smart Cart Agent over HTTP.")
+    parser.add_argument("--host", type=str, default=SERVER_HOST, help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to listen on.")
+    args = parser.parse_args()
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
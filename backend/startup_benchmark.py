@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmark import percentile
+
+PROMPT = "Please enter your request"
+FINISHED = "--- Agent Finished ---"
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+class _Watcher:
+    """
+    Reads a child's output on a thread and timestamps the first time each marker appears.
+    """
+
+    def __init__(self, stream, started: float, markers: List[str]):
+        self.started = started
+        self.seen: Dict[str, float] = {}
+        self._stream = stream
+        self._markers = markers
+        self._output = ""
+        self._changed = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self) -> None:
+        while True:
+            chunk = self._stream.read1(4096)
+            now = time.perf_counter()
+            with self._changed:
+                if not chunk:
+                    self.seen.setdefault("exit", now - self.started)
+                    self._changed.notify_all()
+                    return
+                self._output += chunk.decode("utf-8", "replace")
+                for marker in self._markers:
+                    if marker not in self.seen and marker in self._output:
+                        self.seen[marker] = now - self.started
+                self._changed.notify_all()
+
+    def wait(self, marker: str, timeout: float) -> Optional[float]:
+        with self._changed:
+            self._changed.wait_for(lambda: marker in self.seen or "exit" in self.seen, timeout)
+            return self.seen.get(marker)
+
+    @property
+    def output(self) -> str:
+        return self._output
+
+
+def run_once(request: str, timeout: float) -> Dict[str, Any]:
+    """
+    Starts the CLI in fake client mode, times the first prompt, sends `request` and
+    times its cart, then exits.
+    """
+    env = dict(os.environ, PYTHONUNBUFFERED="1", WALLY_CLIENT_MODE="fake", WALLY_CHECKPOINTER="memory",
+               WALLY_CACHE_BACKEND="memory", WALLY_CATEGORY_INDEX_PATH="", WALLY_CATALOG_PATH="")
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, MAIN], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, cwd=os.path.dirname(MAIN), env=env)
+    watcher = _Watcher(child.stdout, started, [PROMPT, FINISHED])
+    try:
+        first_prompt = watcher.wait(PROMPT, timeout)
+        first_cart = None
+        if first_prompt is not None:
+            child.stdin.write(f"{request}\nexit\n".encode("utf-8"))
+            child.stdin.flush()
+            first_cart = watcher.wait(FINISHED, timeout)
+        child.stdin.close()
+        child.wait(timeout)
+    except subprocess.TimeoutExpired:
+        child.kill()
+        child.wait()
+    watcher.wait("exit", timeout)
+    run = {"first_prompt_s": first_prompt, "first_cart_s": first_cart, "exit_s": watcher.seen.get("exit")}
+    if first_prompt is None or first_cart is None or child.returncode != 0:
+        run["error"] = watcher.output[-2000:]
+    return run
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"runs": len(runs), "errors": sum(1 for run in runs if "error" in run)}
+    for key, name in (("first_prompt_s", "first_prompt"), ("first_cart_s", "first_cart"), ("exit_s", "exit")):
+        times = [run[key] for run in runs if run.get(key) is not None]
+        report[name] = {
+            "p50_ms": round(percentile(times, 50) * 1000, 1),
+            "p95_ms": round(percentile(times, 95) * 1000, 1),
+            "max_ms": round(max(times, default=0.0) * 1000, 1),
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Runs: {report['runs']}  errors: {report['errors']}")
+    for name, label in (("first_prompt", "time to first prompt"), ("first_cart", "time to first cart"),
+                        ("exit", "time to exit")):
+        stats = report[name]
+        print(f"  {label:<22} p50 {stats['p50_ms']:>8.1f} ms  p95 {stats['p95_ms']:>8.1f} ms  "
+              f"max {stats['max_ms']:>8.1f} ms")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Returns the metrics that got worse than `baseline` by more than `tolerance` (a fraction).
+    """
+    checks = {
+        "first prompt p50": (report["first_prompt"]["p50_ms"], baseline["first_prompt"]["p50_ms"]),
+        "first prompt p95": (report["first_prompt"]["p95_ms"], baseline["first_prompt"]["p95_ms"]),
+        "first cart p50": (report["first_cart"]["p50_ms"], baseline["first_cart"]["p50_ms"]),
+    }
+    return [
+        f"{name}: {current} vs baseline {previous}"
+        for name, (current, previous) in checks.items()
+        if current > previous * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark how fast the CLI starts, in fake client mode.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to time.")
+    parser.add_argument("--request", default="milk, eggs and bread", help="Request to send at the first prompt.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for each step.")
+    parser.add_argument("--json", help="Also write the report to this file.")
+    parser.add_argument("--baseline", help="Report from an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs the baseline.")
+    args = parser.parse_args()
+
+    runs = [run_once(args.request, args.timeout) for _ in range(args.runs)]
+    report = summarize(runs)
+    print_report(report)
+    for run in runs:
+        if "error" in run:
+            print(f"Failed run output:\n{run['error']}")
+            break
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
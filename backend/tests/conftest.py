@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The tests run offline: fake model and search clients, and nothing written outside tmp_path.
+os.environ["WALLY_CLIENT_MODE"] = "fake"
+os.environ["WALLY_CHECKPOINTER"] = "memory"
+os.environ["WALLY_CACHE_BACKEND"] = "memory"
+os.environ["WALLY_CATALOG_PATH"] = ""
+os.environ["WALLY_CATEGORY_INDEX_PATH"] = ""
+os.environ["WALLY_PREFETCH_ENABLED"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
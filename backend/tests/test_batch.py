@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+from agents import workflow
+from agents.batch import BatchRun, as_request, read_requests
+from agents.budget_optimizer import select_products_jointly
+from agents.products import ItemOptions
+from agents.workflow import build_graph
+
+
+def _products():
+    return [
+        ItemOptions("milk", "Dairy", names=["Milk A", "Milk B"], prices=[2.5, 4.0], ratings=[4.0, 4.8],
+                    brands=["A", "B"]),
+        ItemOptions("eggs", "Eggs", names=["Eggs A", "Eggs B"], prices=[3.0, 5.5], ratings=[4.2, 4.6],
+                    brands=["A", "B"]),
+    ]
+
+
+def _run(graph, requests, budget=None):
+    run = BatchRun(graph, [as_request(request, index) for index, request in enumerate(requests)], budget)
+
+    async def collect():
+        return [result async for result in run.results()]
+
+    return run, asyncio.run(collect())
+
+
+def test_read_requests_accepts_text_and_json_lines():
+    lines = ["# week", "pasta dinner", "", '{"id": "mon", "user_input": "milk and eggs", "budget": 10}']
+    assert read_requests(lines) == [
+        {"id": "1", "user_input": "pasta dinner", "budget": None},
+        {"id": "mon", "user_input": "milk and eggs", "budget": 10},
+    ]
+    with pytest.raises(ValueError):
+        read_requests(['{"user_input": "milk", "budget": -1}'])
+
+
+def test_joint_selection_keeps_each_cart_within_its_own_budget():
+    first, second = select_products_jointly([_products(), _products()], 20, budgets=[3, None])
+    assert sum(product["price"] for product in first) <= 3
+    assert sum(product["price"] for product in first + second) <= 20
+
+
+def test_shared_items_are_searched_once():
+    run, results = _run(build_graph(InMemorySaver()), ["milk, eggs and bread", "milk and eggs for $10"])
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert run.stats["items"] == 5 and run.stats["distinct_items"] == 3
+    assert results[1]["total"] <= 10
+
+
+def test_shared_budget_carts_finish_their_runs(monkeypatch):
+    # Put a node after the budget optimizer, so a cart left at its joint update would not finish.
+    monkeypatch.setattr(workflow, "END", "cart_builder_agent")
+    graph = build_graph(InMemorySaver())
+    run, results = _run(graph, ["spaghetti dinner", {"user_input": "milk, eggs and bread", "budget": 4}], budget=20)
+
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert sum(result["total"] for result in results) <= 20
+    assert results[1]["total"] <= 4
+    for cart in run.carts:
+        state = graph.get_state(cart.config)
+        assert state.next == ()
+        assert state.values["cart_url"]
@@ -0,0 +1,87 @@
+import itertools
+import random
+
+import pytest
+
+from agents.budget_optimizer import check_selection, select_products, solve_exact, solve_greedy
+from agents.products import ItemOptions
+
+
+def _random_table(rng, items, options):
+    return [
+        [(rng.randint(50, 900), round(rng.uniform(0.1, 5.0), 3), None) for _ in range(rng.randint(1, options))]
+        for _ in range(items)
+    ]
+
+
+def _cost(table, selection):
+    return sum(table[i][index][0] for i, index in enumerate(selection) if index >= 0)
+
+
+def _utility(table, selection):
+    return sum(table[i][index][1] for i, index in enumerate(selection) if index >= 0)
+
+
+def _brute_force(table, budget_cents):
+    best = 0.0
+    for selection in itertools.product(*[range(-1, len(candidates)) for candidates in table]):
+        if _cost(table, selection) <= budget_cents:
+            best = max(best, _utility(table, selection))
+    return best
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_solve_exact_matches_brute_force(seed):
+    rng = random.Random(seed)
+    table = _random_table(rng, rng.randint(1, 5), 4)
+    budget_cents = rng.randint(0, 2500)
+    selection = solve_exact(table, budget_cents)
+    assert _cost(table, selection) <= budget_cents
+    assert _utility(table, selection) == pytest.approx(_brute_force(table, budget_cents))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_solve_exact_stays_within_budget_when_prices_are_bucketed(seed):
+    rng = random.Random(seed)
+    table = _random_table(rng, 5, 4)
+    budget_cents = rng.randint(500, 2500)
+    # 100 cells for up to 2500 cents buckets prices into units of up to 25 cents.
+    selection = solve_exact(table, budget_cents, max_cells=100)
+    assert _cost(table, selection) <= budget_cents
+    assert _utility(table, selection) <= _brute_force(table, budget_cents) + 1e-9
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_solve_greedy_stays_within_budget(seed):
+    rng = random.Random(seed)
+    table = _random_table(rng, 6, 4)
+    budget_cents = rng.randint(0, 3000)
+    selection = solve_greedy(table, budget_cents)
+    assert _cost(table, selection) <= budget_cents
+    assert all(-1 <= index < len(table[i]) for i, index in enumerate(selection))
+
+
+def _products():
+    return [
+        ItemOptions("milk", "Dairy", names=["Milk A", "Milk B"], prices=[2.5, 4.0], ratings=[4.0, 4.8],
+                    brands=["A", "B"]),
+        ItemOptions("eggs", "Eggs", names=["Eggs A", "Eggs B"], prices=[3.0, 5.5], ratings=[4.2, 4.6],
+                    brands=["A", "B"]),
+    ]
+
+
+def test_select_products_keeps_to_the_budget():
+    for budget in (0, 2.49, 2.5, 5.5, 7.0, 9.5, 100):
+        selected = select_products(_products(), budget)
+        assert sum(product["price"] for product in selected) <= budget
+        assert len({product["item"] for product in selected}) == len(selected)
+    assert {product["item"] for product in select_products(_products(), 100)} == {"milk", "eggs"}
+
+
+def test_check_selection_rejects_unknown_duplicate_and_over_budget_picks():
+    products = _products()
+    ok = check_selection(products, [{"item": "milk", "name": "Milk A", "price": 0.01}], 5)
+    assert ok is not None and ok[0]["price"] == 2.5
+    assert check_selection(products, [{"item": "milk", "name": "Milk C", "price": 1}], 5) is None
+    assert check_selection(products, [{"item": "milk", "name": "Milk A"}, {"item": "milk", "name": "Milk B"}], 10) is None
+    assert check_selection(products, [{"item": "milk", "name": "Milk B"}, {"item": "eggs", "name": "Eggs B"}], 9) is None
@@ -0,0 +1,69 @@
+import pytest
+
+from agents import cache
+from agents.cache import MemoryCacheBackend, SQLiteCacheBackend, TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return lambda max_entries: MemoryCacheBackend(max_entries)
+    return lambda max_entries: SQLiteCacheBackend(str(tmp_path / "cache.sqlite"), "test", max_entries)
+
+
+def test_entries_expire_after_their_ttl(clock, backend):
+    ttl_cache = TTLCache("test", backend(10), ttl=60)
+    ttl_cache.set("milk", {"price": 2.5})
+    clock.now += 59
+    assert ttl_cache.get("milk") == {"price": 2.5}
+    clock.now += 2
+    assert ttl_cache.get("milk") is None
+    assert (ttl_cache.hits, ttl_cache.misses) == (1, 1)
+    assert len(ttl_cache.backend) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock, backend):
+    store = backend(2)
+    store.set("a", 1, 60)
+    clock.now += 1
+    store.set("b", 2, 60)
+    clock.now += 1
+    assert store.get("a") == 1
+    clock.now += 1
+    store.set("c", 3, 60)
+    assert store.get("b") is None
+    assert (store.get("a"), store.get("c")) == (1, 3)
+
+
+def test_cached_values_are_copies(clock):
+    store = MemoryCacheBackend(10)
+    value = {"options": [1]}
+    store.set("k", value, 60)
+    value["options"].append(2)
+    store.get("k")["options"].append(3)
+    assert store.get("k") == {"options": [1]}
+
+
+def test_zero_ttl_and_none_are_not_stored(clock):
+    assert len(_store_one(TTLCache("test", MemoryCacheBackend(10), ttl=0), 1)) == 0
+    assert len(_store_one(TTLCache("test", MemoryCacheBackend(10), ttl=60), None)) == 0
+
+
+def _store_one(ttl_cache, value):
+    ttl_cache.set("k", value)
+    return ttl_cache.backend
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from agents import catalog, product_fetcher
+from agents.catalog import CatalogRefresher, ProductCatalog
+
+MILK = [{"name": "Great Value Whole Milk", "price": 3.5, "rating": 4.6, "brand": "Great Value"},
+        {"name": "Horizon Organic Milk", "price": 5.2, "rating": 4.8, "brand": "Horizon"}]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(catalog, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return ProductCatalog(str(tmp_path / "catalog.sqlite"), max_age=3600)
+
+
+def test_lookup_serves_fresh_options_for_the_same_item(store, clock):
+    store.upsert("Milk", "Dairy", MILK)
+    clock.now += 60
+    options = store.lookup("milks", "dairy")
+    assert [option["name"] for option in options] == [option["name"] for option in MILK]
+    assert options[0]["price"] == 3.5
+
+
+def test_lookup_does_not_serve_other_items_or_stale_options(store, clock):
+    store.upsert("cream cheese", "Dairy", [{"name": "Philadelphia Cream Cheese", "price": 2.9}])
+    store.upsert("milk", "Dairy", MILK)
+    assert store.lookup("cheese", "Dairy") is None
+    assert store.lookup("milk", "Bakery") is None
+    clock.now += 3601
+    assert store.lookup("milk", "Dairy") is None
+    assert store.stats()["hits"] == 0 and store.stats()["misses"] == 3
+
+
+def test_only_latest_options_are_served(store, clock):
+    store.upsert("milk", "Dairy", MILK)
+    clock.now += 10
+    store.upsert("milk", "Dairy", [{**MILK[1], "price": 4.9}])
+    assert store.lookup("milk", "Dairy") == [{**dict.fromkeys(catalog._OPTION_COLUMNS), **MILK[1], "price": 4.9,
+                                              "category": "Dairy"}]
+
+
+def test_refresh_counts_only_items_rewritten_in_the_catalog(store, clock, monkeypatch):
+    for item in ("milk", "eggs", "bread"):
+        store.upsert(item, "Grocery", MILK)
+        store.record_requests([(item, "Grocery")] * 3)
+    clock.now += 3600
+
+    def fetch(llm, search, pairs, refresh=False):
+        assert refresh
+        # milk is found again, eggs fails, bread is found but not written to the catalog.
+        store.upsert("milk", "Grocery", MILK)
+        return [MILK if item != "eggs" else [] for item, _ in pairs]
+
+    monkeypatch.setattr(product_fetcher, "fetch_products_batched", fetch)
+    monkeypatch.setattr("agents.clients.get_llm", lambda: None)
+    monkeypatch.setattr("agents.clients.get_search", lambda: None)
+    refresher = CatalogRefresher(store, interval=0, ahead=0.5)
+    assert refresher.refresh_once() == 1
+    assert refresher.stats() == {"rounds": 1, "refreshed": 1, "failed": 2}
+    # Items that failed to refresh are still due next round.
+    assert sorted(item for item, _ in store.hot_items(10, clock.now - 1800)) == ["bread", "eggs"]
+
+
+def test_cli_starts_and_stops_the_refresher(monkeypatch):
+    calls = []
+    refresher = SimpleNamespace(start=lambda: calls.append("start"), stop=lambda: calls.append("stop"))
+    monkeypatch.setattr(catalog, "get_catalog_refresher", lambda: refresher)
+    monkeypatch.setattr(main, "load_graph", lambda: None)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "exit")
+    asyncio.run(main.run_cli())
+    assert calls == ["start", "stop"]
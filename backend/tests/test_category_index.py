@@ -0,0 +1,38 @@
+from agents.category_index import CategoryIndex, normalize_item
+from agents.tracing import metrics
+
+SEED = {"tomato": "Produce", "ground beef": "Meat & Seafood", "spaghetti": "Pasta & Noodles"}
+
+
+def _lookups(result):
+    return metrics._counters.get(("wally_category_index_lookups_total", (("result", result),)), 0)
+
+
+def test_normalize_item_singularizes_and_drops_punctuation():
+    assert normalize_item("Roma Tomatoes!") == "roma tomato"
+    assert normalize_item("Cherries") == "cherry"
+    assert normalize_item("Swiss") == "swiss"
+
+
+def test_lookup_matches_exact_and_close_names_only():
+    index = CategoryIndex(SEED)
+    found, missing = index.lookup(["Tomatoes", "ground beefs", "lemon pepper", "beef jerky"])
+    assert found == {"Tomatoes": "Produce", "ground beefs": "Meat & Seafood"}
+    assert missing == ["lemon pepper", "beef jerky"]
+
+
+def test_learned_categories_persist(tmp_path):
+    path = str(tmp_path / "categories.json")
+    CategoryIndex(SEED, path=path).learn({"Oat Milk": "Dairy"})
+    found, missing = CategoryIndex(SEED, path=path).lookup(["oat milk"])
+    assert found == {"oat milk": "Dairy"} and missing == []
+
+
+def test_hits_and_misses_are_exported_as_metrics():
+    index = CategoryIndex(SEED)
+    hits, misses = _lookups("hit"), _lookups("miss")
+    index.lookup(["tomato", "spaghetti", "saffron"])
+    assert index.stats()["hit_rate"] == 2 / 3
+    assert _lookups("hit") - hits == 2
+    assert _lookups("miss") - misses == 1
+    assert 'wally_category_index_lookups_total{result="hit"}' in metrics.render()
@@ -0,0 +1,101 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from langgraph.types import Command
+
+from agents import checkpointer
+from agents.checkpointer import SQLiteCheckpointSaver
+from agents.workflow import build_graph
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _thread_rows(saver):
+    return dict(saver._conn.execute("SELECT thread_id, finished FROM threads").fetchall())
+
+
+def _travel(monkeypatch, now):
+    monkeypatch.setattr(checkpointer, "time", SimpleNamespace(time=lambda: now))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "checkpoints.sqlite")
+
+
+def test_state_survives_a_new_saver(path):
+    graph = build_graph(SQLiteCheckpointSaver(path))
+    graph.invoke({"user_input": "spaghetti dinner for $20"}, _config("alice"))
+    paused = graph.get_state(_config("alice"))
+    assert paused.next
+
+    reopened = build_graph(SQLiteCheckpointSaver(path))
+    state = reopened.get_state(_config("alice"))
+    assert state.next == paused.next
+    assert state.values == paused.values
+
+    final = reopened.invoke(Command(resume={"action": "accept"}), _config("alice"))
+    assert final["optimized_products"]
+    assert sum(product["price"] for product in final["optimized_products"]) <= 20
+    assert not reopened.get_state(_config("alice")).next
+    assert _thread_rows(SQLiteCheckpointSaver(path)) == {"alice": 1}
+
+
+def test_history_is_trimmed(path):
+    saver = SQLiteCheckpointSaver(path, max_history=3)
+    graph = build_graph(saver)
+    graph.invoke({"user_input": "spaghetti dinner"}, _config("alice"))
+    graph.invoke(Command(resume={"action": "accept"}), _config("alice"))
+    assert saver.stats()["checkpoints"] == 3
+    assert len(list(graph.get_state_history(_config("alice")))) == 3
+
+
+def test_expired_threads_are_evicted_by_their_ttl(path, monkeypatch):
+    saver = SQLiteCheckpointSaver(path, ttl=60, idle_ttl=600)
+    graph = build_graph(saver)
+    # A direct list needs no review, so it runs to the end.
+    graph.invoke({"user_input": "milk and eggs"}, _config("done"))
+    graph.invoke({"user_input": "spaghetti dinner"}, _config("waiting"))
+    assert _thread_rows(saver) == {"done": 1, "waiting": 0}
+
+    now = time.time()
+    _travel(monkeypatch, now + 120)
+    assert saver.evict_expired() == 1
+    assert _thread_rows(saver) == {"waiting": 0}
+    assert graph.get_state(_config("done")).values == {}
+    assert graph.get_state(_config("waiting")).next
+
+    _travel(monkeypatch, now + 1200)
+    assert saver.evict_expired() == 1
+    assert saver.stats() == {"threads": 0, "checkpoints": 0, "blobs": 0, "writes": 0}
+
+
+def test_zero_ttl_keeps_threads(path, monkeypatch):
+    saver = SQLiteCheckpointSaver(path, ttl=0, idle_ttl=0)
+    graph = build_graph(saver)
+    graph.invoke({"user_input": "spaghetti dinner"}, _config("alice"))
+    _travel(monkeypatch, time.time() + 10 ** 9)
+    assert saver.evict_expired() == 0
+    assert graph.get_state(_config("alice")).next
+
+
+@pytest.mark.parametrize("planner_mode", ["staged", "fused"])
+def test_a_new_request_on_a_thread_starts_clean(path, monkeypatch, planner_mode):
+    from agents import workflow
+
+    monkeypatch.setattr(workflow, "PLANNER_MODE", planner_mode)
+    graph = build_graph(SQLiteCheckpointSaver(path))
+    graph.invoke({"user_input": "spaghetti dinner for $20"}, _config("alice"))
+    graph.invoke(Command(resume={"action": "accept"}), _config("alice"))
+
+    # A new process picks the thread up again with a different request.
+    graph = build_graph(SQLiteCheckpointSaver(path))
+    graph.invoke({"user_input": "milk, bread for $10"}, _config("alice"))
+    final = graph.get_state(_config("alice")).values
+    assert final["expanded_items"] == []
+    assert set(final["categories"]) == {"milk", "bread"}
+    assert {product.item for product in final["products"]} == {"milk", "bread"}
+    assert {product["item"] for product in final["optimized_products"]} <= {"milk", "bread"}
@@ -0,0 +1,65 @@
+import asyncio
+import builtins
+
+import pytest
+
+import main
+from agents import clients
+from agents.fakes import FakeChatModel
+
+
+class _ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"provider answered {status_code}")
+        self.status_code = status_code
+
+
+class _FailingOnce(FakeChatModel):
+    """
+    Fails the first request's first call with `error`, then answers like the fake model.
+    """
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    async def ainvoke(self, *args, **kwargs):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return await super().ainvoke(*args, **kwargs)
+
+
+@pytest.fixture
+def session(monkeypatch, capsys):
+    monkeypatch.setattr(clients, "_llm", None)
+    monkeypatch.setattr(clients, "_search", None)
+
+    def run(requests):
+        replies = iter(requests + ["exit"])
+        monkeypatch.setattr(builtins, "input", lambda prompt="": next(replies))
+        asyncio.run(main.run_cli())
+        return capsys.readouterr().out
+
+    return run
+
+
+@pytest.mark.parametrize("error", [_ProviderError(429), _ProviderError(400), ValueError("invalid argument")])
+def test_a_failed_request_does_not_end_the_session(session, error):
+    clients.set_clients(_FailingOnce(error))
+    out = session(["milk and eggs", "bread and butter"])
+    assert "Request failed" in out
+    assert out.count("--- Agent Finished ---") == 1
+
+
+def test_each_request_gets_its_own_thread(session, monkeypatch):
+    threads = []
+    original = main.run_agent_cli
+
+    async def spy(user_input, thread_id):
+        threads.append(thread_id)
+        return await original(user_input, thread_id)
+
+    monkeypatch.setattr(main, "run_agent_cli", spy)
+    session(["milk and eggs", "bread and butter"])
+    assert len(set(threads)) == 2
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from agents import clients
+from agents.fakes import FakeChatModel, FakeSearch
+from agents.incremental import aupdate_cart, parse_update, plan_update, update_cart
+from agents.workflow import build_graph
+
+
+class _RecordingSearch(FakeSearch):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def _results(self, query):
+        self.queries.append(query)
+        return super()._results(query)
+
+
+@pytest.fixture
+def search(monkeypatch):
+    monkeypatch.setattr(clients, "_llm", None)
+    monkeypatch.setattr(clients, "_search", None)
+    search = _RecordingSearch()
+    clients.set_clients(FakeChatModel(), search)
+    return search
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _items(values):
+    return {product.item for product in values["products"]}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("under $30", {"budget": 30.0}),
+    ("now make it under 25.5", {"budget": 25.5}),
+    ("add eggs, milk and butter", {"add": ["eggs", "milk", "butter"]}),
+    ("Drop bread", {"remove": ["bread"]}),
+    ("spaghetti dinner for $20", None),
+    ("add", None),
+])
+def test_parse_update(text, expected):
+    assert parse_update(text) == expected
+
+
+def test_plan_update_picks_the_node_to_resume_from():
+    values = {"item_list": ["milk", "bread"], "budget": 10.0, "products": [],
+              "categories": {"milk": "Dairy", "bread": "Bakery"}}
+
+    assert plan_update(values, add=["eggs"], remove=["bread"]) == (
+        {"item_list": ["milk", "eggs"], "categories": {"milk": "Dairy"}}, "Human_review")
+    assert plan_update(values, budget=15) == ({"budget": 15.0}, "product_search_agent")
+    assert plan_update(values, items=["milk", "bread"], budget=10.0) is None
+    with pytest.raises(ValueError):
+        plan_update({"item_list": ["milk"]}, add=["eggs"])
+
+
+def test_adding_an_item_searches_only_for_it(search):
+    graph = build_graph()
+    graph.invoke({"user_input": "milk, bread for $10"}, _config("alice"))
+    search.queries.clear()
+
+    values = update_cart(graph, "alice", add=["eggs"])
+
+    assert _items(values) == {"milk", "bread", "eggs"}
+    assert not any("milk" in query or "bread" in query for query in search.queries)
+    assert values["trace"][0]["node"] == "cart_update"
+
+
+def test_a_budget_change_only_reoptimizes(search):
+    graph = build_graph()
+    graph.invoke({"user_input": "milk, bread for $10"}, _config("alice"))
+    search.queries.clear()
+
+    values = asyncio.run(aupdate_cart(graph, "alice", budget=4.0))
+
+    assert values["budget"] == 4.0
+    assert search.queries == []
+    assert sum(product["price"] for product in values["optimized_products"]) <= 4.0
+
+
+def test_a_thread_waiting_for_review_cannot_be_updated(search):
+    graph = build_graph()
+    graph.invoke({"user_input": "spaghetti dinner for $20"}, _config("alice"))
+
+    with pytest.raises(ValueError, match="not finished"):
+        update_cart(graph, "alice", add=["eggs"])
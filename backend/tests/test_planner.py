@@ -0,0 +1,91 @@
+import pytest
+
+from agents import clients, planner, workflow
+from agents.category_index import CategoryIndex
+from agents.fakes import FakeChatModel, FakeSearch
+from agents.workflow import build_graph
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = CategoryIndex({})
+    monkeypatch.setattr(planner, "category_index", index)
+    return index
+
+
+class _RecordingChatModel(FakeChatModel):
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def answer(self, prompt):
+        self.prompts.append(prompt)
+        return super().answer(prompt)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(clients, "_llm", None)
+    monkeypatch.setattr(clients, "_search", None)
+    llm = _RecordingChatModel()
+    clients.set_clients(llm, FakeSearch())
+    return llm
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def test_plan_update_keeps_categories_of_bought_items_and_learns_them(index):
+    update = planner._plan_update({
+        "task_type": "goal_or_dish",
+        "item_list": ["pancakes"],
+        "budget": 15.0,
+        "expanded_items": ["flour", "eggs"],
+        "categories": {"flour": "Baking", "eggs": "Dairy & Eggs", "pancakes": "Breakfast"},
+    })
+
+    assert update["expanded_items"] == ["flour", "eggs"]
+    assert update["categories"] == {"flour": "Baking", "eggs": "Dairy & Eggs"}
+    assert update["products"] is None and update["optimized_products"] is None
+    assert index.lookup(["flour", "pancakes"]) == ({"flour": "Baking"}, ["pancakes"])
+
+
+def test_plan_update_ignores_expansions_of_a_direct_list(index):
+    update = planner._plan_update({
+        "task_type": "direct_product_list",
+        "item_list": ["milk", "bread"],
+        "budget": None,
+        "expanded_items": ["butter"],
+        "categories": {"milk": "Dairy", "butter": "Dairy"},
+    })
+
+    assert update["expanded_items"] == []
+    assert update["categories"] == {"milk": "Dairy"}
+
+
+@pytest.mark.parametrize("planner_mode, planning_calls", [("fused", 1), ("staged", 2)])
+def test_fused_planner_plans_a_dish_in_one_llm_call(monkeypatch, index, llm, planner_mode, planning_calls):
+    monkeypatch.setattr(workflow, "PLANNER_MODE", planner_mode)
+    graph = build_graph()
+
+    graph.invoke({"user_input": "spaghetti dinner for $20"}, _config(planner_mode))
+
+    state = graph.get_state(_config(planner_mode))
+    assert state.next == ("Human_review",)
+    assert state.values["task_type"] == "goal_or_dish"
+    assert state.values["budget"] == 20.0
+    assert state.values["expanded_items"]
+    assert llm.calls == planning_calls
+
+
+def test_fused_planner_sends_a_categorized_list_straight_to_search(monkeypatch, index, llm):
+    monkeypatch.setattr(workflow, "PLANNER_MODE", "fused")
+    graph = build_graph()
+
+    graph.invoke({"user_input": "milk, bread for $10"}, _config("list"))
+
+    final = graph.get_state(_config("list")).values
+    assert final["categories"] == {"milk": "Grocery", "bread": "Grocery"}
+    assert not any("category" in prompt for prompt in llm.prompts[1:])
+    assert {product.item for product in final["products"]} == {"milk", "bread"}
@@ -0,0 +1,58 @@
+import pytest
+
+from agents import clients
+from agents.fakes import FakeChatModel, FakeSearch
+from agents.prefetch import Prefetcher
+
+
+@pytest.fixture
+def prefetcher(monkeypatch):
+    monkeypatch.setattr(clients, "_llm", None)
+    monkeypatch.setattr(clients, "_search", None)
+    clients.set_clients(FakeChatModel(), FakeSearch())
+    prefetcher = Prefetcher(max_workers=2, max_sessions=2)
+    yield prefetcher
+    prefetcher._executor.shutdown(wait=True)
+
+
+def test_prefetched_options_are_taken_once(prefetcher):
+    prefetcher.sync("alice", ["milk", "eggs"], {"milk": "Dairy", "eggs": "Dairy"})
+
+    found = prefetcher.take("alice", [("milk", "Dairy"), ("eggs", "Dairy")], timeout=5)
+
+    assert set(found) == {"milk", "eggs"} and all(found.values())
+    assert prefetcher.take("alice", [("milk", "Dairy")], timeout=5) == {}
+    assert prefetcher.stats() == {"sessions": 0, "started": 2, "cancelled": 0, "used": 2}
+
+
+def test_review_edits_cancel_removed_items_and_start_only_new_ones(prefetcher):
+    prefetcher.sync("alice", ["milk", "eggs"], {"milk": "Dairy", "eggs": "Dairy"})
+    prefetcher.sync("alice", ["milk", "bread"], {"milk": "Dairy", "bread": "Bakery"})
+
+    assert prefetcher.stats()["started"] == 3
+    assert prefetcher.stats()["cancelled"] == 1
+    found = prefetcher.take("alice", [("milk", "Dairy"), ("eggs", "Dairy"), ("bread", "Bakery")], timeout=5)
+    assert set(found) == {"milk", "bread"}
+
+
+def test_items_whose_category_changed_are_left_to_the_caller(prefetcher):
+    prefetcher.sync("alice", ["milk"], {"milk": "Dairy"})
+
+    assert prefetcher.take("alice", [("milk", "Beverages")], timeout=5) == {}
+
+
+def test_unknown_items_are_categorized_in_the_background(monkeypatch, prefetcher):
+    monkeypatch.setattr("agents.category_assigner.infer_categories", lambda items: {"oat milk": "Dairy"})
+    prefetcher.sync("alice", ["oat milk", "tofu"])
+
+    assert prefetcher.categories("alice", ["oat milk", "tofu", "eggs"], timeout=5) == {"oat milk": "Dairy"}
+    assert set(prefetcher.take("alice", [("oat milk", "Dairy"), ("tofu", "Grocery")], timeout=5)) == {"oat milk"}
+
+
+def test_oldest_session_is_evicted(prefetcher):
+    for thread_id in ("alice", "bob", "carol"):
+        prefetcher.sync(thread_id, ["milk"], {"milk": "Dairy"})
+
+    assert prefetcher.stats()["sessions"] == 2
+    assert prefetcher.take("alice", [("milk", "Dairy")], timeout=5) == {}
+    assert prefetcher.take("carol", [("milk", "Dairy")], timeout=5)
@@ -0,0 +1,151 @@
+import pytest
+
+from agents import ratelimit
+from agents.ratelimit import BATCH, CircuitOpenError, ProviderLimiter, call_priority
+
+
+class _Clock:
+    """
+    Stands in for the `time` module: sleeping just moves the clock forward.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"provider answered {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def _limiter(**kwargs):
+    options = dict(retries=3, backoff=0.1, max_backoff=1.0, reserve=0.0, failures=3, cooldown=10.0)
+    options.update(kwargs)
+    return ProviderLimiter("test", **options)
+
+
+def test_bucket_allows_a_burst_then_waits_for_refill(clock):
+    limiter = _limiter(rpm=60)
+    for _ in range(60):
+        limiter.acquire()
+    assert clock.now == 1000.0
+    limiter.acquire()
+    assert clock.now == pytest.approx(1001.0)
+    clock.now += 5
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.now == pytest.approx(1006.0)
+    assert limiter.stats()["calls"] == 66
+
+
+def test_token_limit_holds_back_large_calls(clock):
+    limiter = _limiter(tpm=6000)
+    limiter.acquire(cost=6000)
+    limiter.acquire(cost=600)
+    assert clock.now == pytest.approx(1006.0)
+
+
+def test_batch_calls_leave_the_reserve_free(clock):
+    limiter = _limiter(rpm=10, reserve=0.2)
+    with call_priority(BATCH):
+        for _ in range(8):
+            limiter.acquire()
+        assert clock.now == 1000.0
+        limiter.acquire()
+    assert clock.now > 1000.0
+
+
+def test_throttle_honors_retry_after_and_halves_the_rate(clock):
+    limiter = _limiter(rpm=60)
+    delay = limiter.failed(_ProviderError(429, {"Retry-After": "4"}), attempt=0)
+    assert delay >= 4
+    assert limiter.effective_rpm == pytest.approx(30)
+    # 429s from the same burst only slow the rate down once.
+    limiter.failed(_ProviderError(429), attempt=0)
+    assert limiter.effective_rpm == pytest.approx(30)
+    limiter.acquire()
+    assert clock.now >= 1004.0
+    clock.now += 2
+    limiter.failed(_ProviderError(429), attempt=0)
+    assert limiter.effective_rpm == pytest.approx(15)
+    for _ in range(3):
+        limiter.succeeded()
+    assert limiter.effective_rpm == pytest.approx(18)
+
+
+def test_throttle_without_a_limit_learns_the_accepted_rate(clock):
+    limiter = _limiter()
+    for _ in range(12):
+        limiter.acquire()
+        limiter.succeeded()
+    limiter.failed(_ProviderError(429), attempt=0)
+    assert limiter.effective_rpm == pytest.approx(12)
+
+
+def test_non_transient_errors_are_not_retried(clock):
+    limiter = _limiter()
+    assert limiter.failed(_ProviderError(400), attempt=0) is None
+    assert limiter.failed(ValueError("bad request"), attempt=0) is None
+    assert limiter.failed(_ProviderError(503), attempt=3) is None
+    assert limiter.failed(TimeoutError(), attempt=0) is not None
+
+
+def test_circuit_opens_after_consecutive_failures_and_closes_after_a_probe(clock):
+    limiter = _limiter()
+    for attempt in range(2):
+        limiter.failed(_ProviderError(503), attempt)
+    assert limiter.stats()["circuit"] == "closed"
+    limiter.failed(_ProviderError(503), 2)
+    assert limiter.stats()["circuit"] == "open"
+    with pytest.raises(CircuitOpenError) as raised:
+        limiter.acquire()
+    assert raised.value.retry_in == pytest.approx(10.0)
+
+    clock.now += 10
+    assert limiter.stats()["circuit"] == "half_open"
+    limiter.acquire()
+    # Only one probe goes out while it is in flight.
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+    limiter.succeeded()
+    assert limiter.stats()["circuit"] == "closed"
+    limiter.acquire()
+    assert limiter.stats()["circuit_opens"] == 1
+    assert limiter.stats()["rejected"] == 2
+
+
+def test_failed_probe_reopens_the_circuit(clock):
+    limiter = _limiter(failures=1)
+    limiter.failed(ConnectionError(), 0)
+    clock.now += 10
+    limiter.acquire()
+    limiter.failed(ConnectionError(), 0)
+    assert limiter.stats()["circuit"] == "open"
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+    assert limiter.stats()["circuit_opens"] == 1
+
+
+def test_a_success_resets_the_failure_count(clock):
+    limiter = _limiter()
+    for _ in range(2):
+        limiter.failed(_ProviderError(500), 0)
+    limiter.succeeded()
+    for _ in range(2):
+        limiter.failed(_ProviderError(500), 0)
+    assert limiter.stats()["circuit"] == "closed"
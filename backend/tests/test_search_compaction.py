@@ -0,0 +1,72 @@
+from agents.search_compaction import (
+    CompactionMeter,
+    compact_search_results,
+    extract_price,
+    extract_rating,
+    options_from_compacted,
+)
+
+
+def _result(title, url, content="", score=0.5):
+    return {"title": title, "url": url, "content": content, "score": score}
+
+
+RESULTS = {
+    "results": [
+        _result("Great Value Whole Milk, 1 Gallon - Walmart.com", "https://www.walmart.com/ip/123?athbdg=L1600",
+                "Now $3.48. 4.6 out of 5 stars. Fresh whole milk."),
+        _result("Great Value Whole Milk 1 Gallon", "https://www.walmart.com/ip/124", "Price $3.52"),
+        _result("Horizon Organic Whole Milk, 64 oz", "https://www.walmart.com/ip/200", "$5.97, 4.8 stars"),
+        _result("Whole Milk - Target", "https://www.target.com/p/milk", "$2.99"),
+        _result("Dairy aisle", "https://www.walmart.com/cp/dairy", "Shop milk, eggs and butter."),
+        "not a result",
+    ]
+}
+
+
+def test_compaction_keeps_walmart_results_drops_duplicates_and_parses_prices():
+    compacted = compact_search_results("whole milk", RESULTS)
+
+    urls = [result["url"] for result in compacted]
+    assert "https://www.target.com/p/milk" not in urls
+    assert urls.count("https://www.walmart.com/ip/123") + urls.count("https://www.walmart.com/ip/124") == 1
+    first = compacted[0]
+    assert first["title"] == "Great Value Whole Milk, 1 Gallon"
+    assert first["price"] == 3.48 and first["rating"] == 4.6
+    assert urls[-1] == "https://www.walmart.com/cp/dairy"
+
+
+def test_compaction_stops_at_the_token_budget_but_keeps_one_result():
+    compacted = compact_search_results("whole milk", RESULTS, token_budget=1)
+
+    assert len(compacted) == 1
+
+
+def test_direct_options_need_enough_priced_product_pages():
+    compacted = compact_search_results("whole milk", RESULTS)
+
+    options = options_from_compacted("Dairy", compacted, min_options=2)
+
+    assert [option["price"] for option in options] == [3.48, 5.97]
+    assert all(option["category"] == "Dairy" for option in options)
+    assert options_from_compacted("Dairy", compacted, min_options=3) is None
+    assert options_from_compacted("Dairy", compacted, min_options=0) is None
+
+
+def test_price_and_rating_extraction():
+    assert extract_price("was $1,299.99 now") == 1299.99
+    assert extract_price("$0.00") is None
+    assert extract_price("no price") is None
+    assert extract_rating("rated 7 stars, then 4.5/5") == 4.5
+
+
+def test_meter_feeds_its_parent():
+    totals = CompactionMeter()
+    meter = CompactionMeter(parent=totals)
+
+    meter.add(100, 20, llm_skipped=True)
+    meter.add(50, 30)
+
+    assert meter.summary() == totals.summary() == {
+        "items": 2, "raw_tokens": 150, "compacted_tokens": 50, "tokens_saved": 100, "llm_skipped": 1,
+    }
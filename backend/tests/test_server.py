@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import server
+from agents import clients
+from agents.batching import MicroBatcher
+from agents.ratelimit import BACKGROUND, INTERACTIVE, call_priority, current_priority
+
+
+def test_micro_batcher_batches_and_coalesces_requests():
+    batches, priorities = [], []
+
+    async def dispatch(requests):
+        batches.append(list(requests))
+        priorities.append(current_priority())
+        return [request.upper() for request in requests]
+
+    async def main():
+        batcher = MicroBatcher("test", dispatch, window=0.01, max_batch=8)
+
+        async def submit(key, level):
+            with call_priority(level):
+                return await batcher.submit(key, key)
+
+        results = await asyncio.gather(submit("milk", BACKGROUND), submit("eggs", BACKGROUND),
+                                       submit("milk", INTERACTIVE), submit("bread", INTERACTIVE))
+        return batcher, results
+
+    batcher, results = asyncio.run(main())
+    assert results == ["MILK", "EGGS", "MILK", "BREAD"]
+    assert batches == [["milk", "eggs", "bread"]]
+    # The batch goes out at its most urgent caller's priority.
+    assert priorities == [INTERACTIVE]
+    assert batcher.stats() == {"requests": 4, "coalesced": 1, "batches": 1, "avg_batch_size": 3.0}
+
+
+def test_micro_batcher_fails_every_caller_of_a_failed_batch():
+    async def dispatch(requests):
+        raise RuntimeError("provider down")
+
+    async def main():
+        batcher = MicroBatcher("test", dispatch, window=0.01)
+        return await asyncio.gather(batcher.submit("a", 1), batcher.submit("b", 2), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(main())] == ["provider down", "provider down"]
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    # SessionManager routes the shared clients through its batchers; put them back afterwards.
+    monkeypatch.setattr(clients, "_llm", None)
+    monkeypatch.setattr(clients, "_search", None)
+    sessions = server.SessionManager()
+    yield sessions
+    sessions.close()
+
+
+def test_runs_and_updates_over_http(sessions):
+    app = server.create_app(sessions).test_client()
+    started = app.post("/threads/alice/start?wait=true", json={"user_input": "milk and eggs for $20"}).get_json()
+    assert started["status"] == "finished"
+    assert {product["item"] for product in started["optimized_products"]} <= {"milk", "eggs"}
+
+    updated = app.post("/threads/alice/update", json={"remove": ["eggs"]}).get_json()
+    assert updated["status"] == "finished"
+    assert [product["item"] for product in updated["optimized_products"]] == ["milk"]
+    assert sessions.stats()["llm_batching"]["requests"] > 0
+
+
+def test_timed_out_update_is_cancelled(sessions, monkeypatch):
+    state = {"cancelled": False, "finished": False}
+
+    async def slow_update(graph, thread_id, **changes):
+        try:
+            await asyncio.sleep(5)
+            state["finished"] = True
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(server, "aupdate_cart", slow_update)
+    monkeypatch.setattr(server, "SERVER_WAIT_TIMEOUT", 0.05)
+    assert sessions.update("alice", {"budget": 10}) is None
+    # The update has stopped by the time the request returns, so a retry cannot race it.
+    assert state == {"cancelled": True, "finished": False}
+    assert not sessions.is_running("alice")
+    assert "timed out" in sessions.result("alice")["error"]
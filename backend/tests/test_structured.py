@@ -0,0 +1,47 @@
+import pytest
+
+from agents.structured import ExpandedItems, StructuredOutputError, loads_lenient, parse
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('```json\n["milk", "eggs"]\n```', ["milk", "eggs"]),
+    ('```\n{"budget": 20}\n```', {"budget": 20}),
+])
+def test_clean_json_is_not_repaired(text, expected):
+    assert loads_lenient(text) == (expected, False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Sure! Here is the list: ["milk", "eggs"] Let me know if you need more.', ["milk", "eggs"]),
+    ('["milk", "eggs",]', ["milk", "eggs"]),
+    ('{"milk": "Dairy", "eggs": "Eggs",\n}', {"milk": "Dairy", "eggs": "Eggs"}),
+    ('{“milk”: “Dairy”}', {"milk": "Dairy"}),
+    ('[["milk", "eggs"], ["bre', [["milk", "eggs"]]),
+    ('{"milk": [{"name": "A", "price": 1.5}, {"name": "B", "pri', {"milk": [{"name": "A", "price": 1.5}]}),
+    ("{'milk': 'Dairy', 'ok': True}", {"milk": "Dairy", "ok": True}),
+    ('```json\n["milk", "eggs",]', ["milk", "eggs"]),
+])
+def test_malformed_json_is_repaired(text, expected):
+    assert loads_lenient(text) == (expected, True)
+
+
+def test_braces_inside_strings_are_not_brackets():
+    assert loads_lenient('Result: {"note": "use } and ]", "n": 2} done') == ({"note": "use } and ]", "n": 2}, True)
+
+
+@pytest.mark.parametrize("text", ["no json here", "[", '"just a string"x', "{'a': }"])
+def test_unrepairable_text_raises(text):
+    with pytest.raises(ValueError):
+        loads_lenient(text)
+
+
+def test_parse_validates_the_repaired_value():
+    assert parse("Items: ['milk', ' eggs ', ]", ExpandedItems) == ["milk", "eggs"]
+
+
+def test_parse_raises_structured_output_error():
+    with pytest.raises(StructuredOutputError):
+        parse("I could not find anything.", ExpandedItems)
+    with pytest.raises(StructuredOutputError):
+        parse("   ", ExpandedItems)
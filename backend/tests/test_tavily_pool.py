@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from agents.fakes import FakeProviderServer
+from agents.ratelimit import error_status, retry_after
+from agents.tavily_pool import PooledTavilySearch, TavilyAPIError
+
+
+@pytest.fixture
+def provider():
+    server = FakeProviderServer(rpm=2).start()
+    yield server
+    server.stop()
+
+
+def test_pooled_search_returns_raw_results_over_one_session(provider):
+    client = PooledTavilySearch(api_key="test-key", max_results=5, url=provider.url)
+
+    first = client.invoke("milk price walmart")
+    session = client._session
+    second = client.invoke({"query": "eggs price walmart"})
+
+    assert first["query"] == "milk price walmart" and first["results"]
+    assert second["query"] == "eggs price walmart"
+    assert client._session is session
+    assert session.headers["Authorization"] == "Bearer test-key"
+    assert client._params("milk") == {"query": "milk", "max_results": 5}
+
+
+def test_pooled_search_raises_status_and_retry_after_for_the_rate_limiter(provider):
+    client = PooledTavilySearch(api_key="test-key", url=provider.url)
+    client.invoke("milk")
+    client.invoke("eggs")
+
+    with pytest.raises(TavilyAPIError) as raised:
+        client.invoke("bread")
+
+    assert error_status(raised.value) == 429
+    assert retry_after(raised.value) > 0
+    assert "rate limit exceeded" in str(raised.value)
+
+
+def test_pooled_search_async_reuses_and_closes_its_loop_session(provider):
+    client = PooledTavilySearch(api_key="test-key", url=provider.url)
+
+    async def main():
+        result = await client.ainvoke("milk")
+        session = client._get_async_session()
+        await client.ainvoke("eggs")
+        with pytest.raises(TavilyAPIError) as raised:
+            await client.ainvoke("bread")
+        await client.aclose()
+        return result, session, raised.value
+
+    result, session, error = asyncio.run(main())
+
+    assert result["query"] == "milk"
+    assert error.status_code == 429
+    assert session.closed and not client._async_sessions
+
+
+def test_pooled_search_needs_an_api_key(monkeypatch):
+    monkeypatch.delenv("TAVILY_API_KEY", raising=False)
+
+    with pytest.raises(ValueError):
+        PooledTavilySearch()
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from langgraph.types import Command
+
+from agents import tracing
+from agents.fakes import FakeChatModel
+from agents.tracing import MetricsRegistry, atrace_node, merge_trace, trace_node, trace_summary, traced_client
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(tracing, "metrics", registry)
+    return registry
+
+
+def test_traced_node_counts_client_calls_and_events(registry):
+    llm = traced_client(FakeChatModel(), "llm")
+
+    def node(state):
+        llm.invoke([{"role": "user", "content": "Goal or dish: pancakes"}])
+        tracing.record_event("fallbacks", 2)
+        tracing.record_event("retries", 0)
+        return {"budget": 10.0}
+
+    update = trace_node("planner", node, entry=True)({})
+
+    assert update["budget"] == 10.0
+    [summary] = update["trace"]
+    assert summary["node"] == "planner" and summary["entry"]
+    assert summary["llm_calls"] == 1 and summary["fallbacks"] == 2
+    assert summary["prompt_chars"] == len("Goal or dish: pancakes")
+    assert "retries" not in summary
+    assert registry.total("wally_llm_calls_total") == 1
+    assert registry.total("wally_fallbacks_total") == 2
+    assert registry.total("wally_node_runs_total") == 1
+
+
+def test_later_nodes_join_the_request_trace_and_keep_commands():
+    earlier = [{"node": "input_interpreter", "trace_id": "abc", "ms": 1.0, "entry": True}]
+
+    async def node(state):
+        return Command(update={"budget": 5.0}, goto="Human_review")
+
+    command = asyncio.run(atrace_node("item_expansion_agent", node)({"trace": earlier}))
+
+    assert command.goto == "Human_review"
+    assert command.update["budget"] == 5.0
+    assert command.update["trace"][0]["trace_id"] == "abc"
+    assert "entry" not in command.update["trace"][0]
+
+
+def test_failed_node_is_recorded_with_its_status(registry):
+    def node(state):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        trace_node("budget_optimizer_agent", node)({})
+
+    assert 'wally_node_runs_total{node="budget_optimizer_agent",status="error"} 1' in registry.render()
+
+
+def test_merge_trace_starts_over_on_a_new_request():
+    first = [{"node": "a", "entry": True}]
+    second = [{"node": "b"}]
+    new = [{"node": "a", "entry": True}]
+
+    assert merge_trace(merge_trace(first, second), None) == first + second
+    assert merge_trace(first + second, new) == new
+
+
+def test_trace_summary_totals_counters():
+    trace = [
+        {"node": "a", "trace_id": "t", "ms": 10.0, "llm_calls": 1, "entry": True},
+        {"node": "b", "trace_id": "t", "ms": 5.5, "llm_calls": 2, "search_calls": 3, "status": "error"},
+    ]
+
+    assert trace_summary(trace) == {"nodes": 2, "ms": 15.5, "llm_calls": 3, "search_calls": 3}
+    assert trace_summary(None) == {"nodes": 0, "ms": 0.0}
+
+
+def test_metrics_render_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.inc("wally_cache_requests_total", "Cache lookups.", cache="search", result="hit")
+    registry.inc("wally_cache_requests_total", "Cache lookups.", 2, cache="search", result="hit")
+    registry.observe("wally_node_duration_seconds", "Node wall time.", 0.02, node="a")
+
+    lines = registry.render().splitlines()
+
+    assert lines[:3] == [
+        "# HELP wally_cache_requests_total Cache lookups.",
+        "# TYPE wally_cache_requests_total counter",
+        'wally_cache_requests_total{cache="search",result="hit"} 3',
+    ]
+    assert "# TYPE wally_node_duration_seconds histogram" in lines
+    assert 'wally_node_duration_seconds_bucket{node="a",le="0.01"} 0' in lines
+    assert 'wally_node_duration_seconds_bucket{node="a",le="0.025"} 1' in lines
+    assert 'wally_node_duration_seconds_count{node="a"} 1' in lines